@@ -35,6 +35,281 @@ def test_find():
     #assert find('')
 
 
+def test_file_index():
+    """
+    Tests that the 'FileIndex' only lists the directories that changed again,
+    forgets the removed ones, is trusted until it gets old, follows a
+    symbolic link given as a root, and answers 'find' like a walk would
+    """
+
+    import time
+    import tempfile
+    from . import searcher
+    from .index import FileIndex
+    from .searcher import find
+
+    with tempfile.TemporaryDirectory() as directory:
+        root = os.path.join(directory, 'tree')
+        for name in ('a', 'b', os.path.join('b', 'c')):
+            os.makedirs(os.path.join(root, name))
+        for name in (os.path.join('a', 'target.h'),
+                     os.path.join('b', 'c', 'target.h'),
+                     os.path.join('b', 'other.h')):
+            open(os.path.join(root, name), 'w').close()
+
+        # Timestamps too recent aren't trusted by the index
+        past = time.time() - 60
+        for dirpath, _, _ in os.walk(root):
+            os.utime(dirpath, (past, past))
+
+        index = FileIndex(os.path.join(directory, 'index.json'))
+        index.update([root])
+        assert index.stats['listed'] == 4
+        expected = [os.path.join(root, 'a'), os.path.join(root, 'b', 'c')]
+        assert index.lookup('target.h') == expected
+        assert index.lookup('target') == []
+        assert index.isIndexed(os.path.join(root, 'b'))
+
+        open(os.path.join(root, 'b', 'target.h'), 'w').close()
+        os.remove(os.path.join(root, 'b', 'c', 'target.h'))
+        os.rmdir(os.path.join(root, 'b', 'c'))
+        os.utime(os.path.join(root, 'b'), (past + 1, past + 1))
+        assert index.refresh(root)
+        assert index.stats['listed'] == 5 and index.stats['reused'] == 2
+        assert index.lookup('target.h') == [os.path.join(root, 'a'),
+                                            os.path.join(root, 'b')]
+        assert not index.refresh(root)
+        index.refresh(root, rescan=True)
+        assert index.stats['listed'] == 8
+
+        index.save()
+        reloaded = FileIndex(index.file_path)
+        assert reloaded.lookup('target.h', [os.path.join(root, 'b')]) == \
+            [os.path.join(root, 'b')]
+        walked = find('target.h', start=root, use_index=False,
+                      parallelize=False)
+        assert sorted(walked) == [os.path.join(path, 'target.h') for path in
+                                  reloaded.lookup('target.h')]
+
+        # 'find' refreshes a cold index with its pool of threads
+        class Recording(FileIndex):
+            workers = []
+
+            def refresh(self, root, *, rescan=False, workers=None):
+                self.workers.append(workers)
+                return super(Recording, self).refresh(root, rescan=rescan,
+                                                      workers=workers)
+
+        get_index = searcher.get_index
+        searcher.get_index = lambda: Recording(
+            os.path.join(directory, 'cold.json'))
+        try:
+            assert sorted(find('target.h', start=root, workers=3)) == \
+                sorted(walked)
+            find('target.h', start=root, parallelize=False, fresh=True)
+        finally:
+            searcher.get_index = get_index
+        assert Recording.workers == [3, 1]
+
+        # The saved index is trusted until it gets old, or asked to rescan
+        open(os.path.join(root, 'a', 'new.h'), 'w').close()
+        os.utime(os.path.join(root, 'a'), (past + 2, past + 2))
+        assert reloaded.isFresh(os.path.join(root, 'a'))
+        reloaded.update([os.path.join(root, 'a')])
+        assert reloaded.lookup('new.h') == []
+        reloaded.max_age = 0
+        reloaded.update([root], workers=3)
+        assert reloaded.lookup('new.h') == [os.path.join(root, 'a')]
+        assert reloaded.stats == {'listed': 1, 'reused': 2}
+        reloaded.max_age = 60
+
+        if hasattr(os, 'symlink'):
+            link = os.path.join(directory, 'link')
+            os.symlink(root, link)
+            reloaded.update([link])
+            # Indexed once, by the directory the link points to
+            assert list(reloaded.getRoots()) == [os.path.realpath(root)]
+            assert reloaded.lookup('new.h', [link]) == \
+                [os.path.join(link, 'a')]
+
+
+def test_find_queries():
+    """
+    Tests that a batch of 'Query' objects is answered by one traversal, and
+    that the search for a query satisfied with 'one' stops at its first match
+    """
+
+    import stat
+    import tempfile
+    from .searcher import find, Query, _search
+    from .extractor import NONE
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = {os.path.join('include', 'Python.h'): '#define Py_PYTHON_H',
+                 os.path.join('other', 'Python.h'): '',
+                 os.path.join('lib', 'libpython.a'): '',
+                 os.path.join('bin', 'tool'): '',
+                 os.path.join('lib', 'tool'): ''}
+        for name, string in files.items():
+            file_path = os.path.join(directory, name)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w') as file:
+                file.write(string)
+        tool = os.path.join(directory, 'bin', 'tool')
+        os.chmod(tool, os.stat(tool).st_mode | stat.S_IXUSR)
+
+        def queries():
+            return [Query('Python.h', content='Py_PYTHON_H'),
+                    Query(['lib', 'libpython.a']),
+                    Query('tool', is_exec=True, one=True),
+                    Query('missing.h', one=True)]
+
+        for parallelize in (False, True):
+            headers, runtimes, executable, missing = find(
+                queries(), start=directory, use_index=False,
+                parallelize=parallelize)
+            assert headers == [os.path.join(directory, 'include',
+                                            'Python.h')]
+            assert runtimes == [os.path.join(directory, 'lib',
+                                             'libpython.a')]
+            if os.name != 'nt':
+                assert executable == tool
+            assert missing == NONE
+
+        visited = []
+
+        def entries():
+            for number in range(100):
+                visited.append(number)
+                yield str(number), {'a', 'b'}
+
+        results = _search([Query('a', one=True), Query('b', one=True)],
+                          entries(), [[], []])
+        assert results == [[os.path.join('0', 'a')],
+                           [os.path.join('0', 'b')]]
+        assert visited == [0]
+        results = _search([Query('a', one=True), Query('b')], entries(),
+                          [[], []])
+        assert len(results[1]) == 100
+
+
+def test_walker():
+    """
+    Tests the depth and breadth first walks of 'walker.walk', that symbolic
+    link loops are walked once, and that it makes fewer system calls than
+    'os.walk'
+    """
+
+    import tempfile
+    from .walker import walk, benchmark_walk, BREADTH_FIRST
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ('a', os.path.join('a', 'c'), 'b'):
+            os.makedirs(os.path.join(directory, name))
+            open(os.path.join(directory, name, 'file'), 'w').close()
+
+        def relative(walked):
+            return [os.path.relpath(dirpath, directory)
+                    for dirpath, _, _ in walked]
+
+        # The entries of a directory come in no particular order
+        depth = relative(walk(directory))
+        nested = os.path.join('a', 'c')
+        assert sorted(depth) == ['.', 'a', nested, 'b']
+        assert depth.index(nested) == depth.index('a') + 1
+        breadth = relative(walk(directory, order=BREADTH_FIRST))
+        assert breadth[0] == '.' and breadth[-1] == nested
+
+        pruned = []
+        for dirpath, dirnames, filenames in walk(directory):
+            assert filenames == ['file'] or dirpath == directory
+            pruned.append(os.path.relpath(dirpath, directory))
+            if 'a' in dirnames:
+                dirnames.remove('a')
+        assert sorted(pruned) == ['.', 'b']
+
+        try:
+            os.symlink(directory, os.path.join(directory, 'b', 'loop'))
+        except (OSError, NotImplementedError):
+            return
+        walked = {os.path.relpath(dirpath, directory): dirnames
+                  for dirpath, dirnames, _ in walk(directory)}
+        assert len(walked) == 4 and walked['b'] == ['loop']
+        followed = relative(walk(directory, follow_links=True))
+        assert len(followed) == 4
+
+        for name, _, counts in benchmark_walk(directory):
+            if name.startswith('scandir'):
+                assert counts == {'scandir': 4}
+            else:
+                assert sum(counts.values()) > 4
+
+
+def test_parallel_walk():
+    """
+    Tests that 'walker.parallel_walk' lists every directory once, prunes from
+    its threads, stops them when the iteration stops, and raises their errors
+    """
+
+    import time
+    import threading
+    import tempfile
+    from .walker import walk, parallel_walk
+
+    with tempfile.TemporaryDirectory() as directory:
+        to_make = [directory]
+        for _ in range(3):
+            to_make = [os.path.join(parent, str(number))
+                       for parent in to_make for number in range(4)]
+        for name in to_make:
+            os.makedirs(name)
+            open(os.path.join(name, 'file'), 'w').close()
+
+        expected = sorted(dirpath for dirpath, _, _ in walk(directory))
+        assert len(expected) == 85
+        for workers in (1, 4):
+            walked = [dirpath for dirpath, _, _
+                      in parallel_walk(directory, workers=workers)]
+            assert sorted(walked) == expected
+
+        def prune(dirpath, dirnames):
+            if '0' in dirnames:
+                dirnames.remove('0')
+
+        pruned = list(parallel_walk(directory, workers=4, prune=prune))
+        assert len(pruned) == 1 + 3 + 9 + 27
+        assert all('0' not in dirnames for _, dirnames, _ in pruned)
+
+        threads = threading.active_count()
+        walked = parallel_walk(directory, workers=4)
+        next(walked)
+        walked.close()
+        deadline = time.time() + 5
+        while threading.active_count() > threads and time.time() < deadline:
+            time.sleep(0.05)
+        assert threading.active_count() == threads
+
+        def failing(dirpath, dirnames):
+            if dirpath != directory:
+                raise RuntimeError(dirpath)
+
+        for workers in (1, 2):
+            try:
+                list(parallel_walk(directory, workers=workers,
+                                   prune=failing))
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError("The error of a thread must be raised")
+
+        try:
+            list(parallel_walk(directory, workers=0))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("A walk without workers must be refused")
+
+
 def test_extract():
     """
     Tests some extraction procedures to make sure they return the correct
@@ -183,3 +458,1251 @@ def test_generateBatches():
     batches = generateBatches(t, g)
     assert batches == [{'j'}, {'i', 'g'}, {'f', 'h'}, {'e'},
                        {'d'}, {'c'}, {'b'}, {'a'}]
+
+
+def test_async_launcher():
+    """
+    Tests that 'call_async' streams lines to its callbacks as they are
+    written (even when a character is split between two writes), that
+    'gather_calls' runs commands concurrently, and that timeouts terminate
+    the command along with its children
+    """
+
+    import sys
+    import time
+    import asyncio
+    from .launcher import call, call_async, gather_calls, _LineDecoder
+
+    lines = []
+    decoder = _LineDecoder('utf-8', lines.append)
+    data = 'première\r\nseconde\nfin'.encode('utf-8')
+    for index in range(len(data)):
+        decoder.feed(data[index:index + 1])
+    decoder.close()
+    assert lines == ['première', 'seconde', 'fin']
+
+    code = 'import sys, time\nfor i in range(3):\n    print(i, flush=True)' \
+           '\n    time.sleep(0.2)\nprint("done", file=sys.stderr)'
+    arrivals = []
+    errors = []
+
+    def on_stdout(index, line):
+        arrivals.append((index, line, time.time()))
+
+    async def run_all():
+        return await gather_calls([[sys.executable, '-c', code]] * 2,
+                                  on_stdout=on_stdout,
+                                  on_stderr=lambda index, line:
+                                  errors.append(line))
+
+    start = time.time()
+    results = asyncio.run(run_all())
+    elapsed = time.time() - start
+    assert [result.stdout for result in results] == ['0\n1\n2\n'] * 2
+    assert errors == ['done', 'done']
+    # Both ran at once, and the first line came well before the end
+    assert elapsed < 1.0
+    assert min(arrival for _, line, arrival in arrivals if line == '0') < \
+        start + elapsed - 0.2
+
+    sleeper = '[sys.executable, "-c", "import time; time.sleep(30)"]'
+    start = time.time()
+    result = call([sys.executable, '-c', 'import sys, subprocess; '
+                   'subprocess.call({})'.format(sleeper)], timeout=0.5)
+    assert result.timed_out and result.returncode
+    assert time.time() - start < 10
+
+    result = asyncio.run(call_async([sys.executable, '-c', 'print(42)']))
+    assert result.stdout.strip() == '42' and not result.timed_out
+    assert call(['a command that does not exist']).returncode == 1
+
+
+def test_output_buffer():
+    """
+    Tests that 'OutputBuffer' keeps the head and the tail of a long output
+    in memory while spilling its middle to disk, and that aggregated
+    'Result's read the same as the old concatenated strings
+    """
+
+    import io
+    import sys
+    from .launcher import OutputBuffer, Result, call
+
+    buffer = OutputBuffer(cap=20)
+    data = b''.join(str(number).encode() * 5 for number in range(10))
+    for index in range(0, len(data), 3):
+        buffer.write(data[index:index + 3])
+    assert len(buffer) == len(data) and buffer.omitted == len(data) - 20
+    text = buffer.getText()
+    assert text.startswith('0000011111') and text.endswith('8888899999')
+    assert str(buffer.omitted) in text
+    assert b''.join(buffer.iterChunks()) == data
+
+    result = Result()
+    for number in range(3):
+        result.extendInformation(Result(0, 'out{}'.format(number)))
+    result.extendInformation(Result(1, '', 'error'))
+    assert result.stdout == '\r\nout0\r\nout1\r\nout2'
+    assert result.stderr == '\r\nerror'
+    assert result.getOutput() == result.stdout + '\r\n' + result.stderr
+
+    code = 'import sys\nfor i in range(20000): print("warning", i)'
+    result = call([sys.executable, '-c', code], output_cap=1000)
+    assert result.stdout.startswith('warning 0\n')
+    assert result.stdout.endswith('warning 19999\n')
+    assert len(result.stdout) < 2000
+    output = io.BytesIO()
+    result.writeOutput(output)
+    assert output.getvalue().count(b'\n') == 20000
+
+
+def test_worker_pool():
+    """
+    Tests that a 'WorkerPool' is reused across calls, pickles a function
+    once per call and hands it over to the workers once, runs closures, and
+    only consumes its input as results are taken (backpressure)
+    """
+
+    from .launcher import WorkerPool, get_pool, distribute
+
+    class Counted:
+        pickled = 0
+
+        def __init__(self, offset):
+            self.offset = offset
+
+        def __call__(self, item):
+            return item + self.offset
+
+        def __getstate__(self):
+            Counted.pickled += 1
+            return self.__dict__
+
+    pool = WorkerPool(2)
+    try:
+        assert pool.map(Counted(10), range(50), chunksize=3) == \
+            [item + 10 for item in range(50)]
+        assert Counted.pickled == 1
+        assert pool.function_writes == 1
+        # The same function is only handed over to the workers once
+        for _ in range(2):
+            assert pool.map(abs, range(-20, 0), chunksize=1) == \
+                list(range(20, 0, -1))
+        assert pool.function_writes == 2
+
+        offset = 5
+        assert sorted(pool.imap_unordered(lambda item: item * offset,
+                                          range(20))) == \
+            [item * offset for item in range(20)]
+
+        consumed = []
+
+        def produce():
+            for item in range(1000):
+                consumed.append(item)
+                yield item
+
+        results = pool.imap_unordered(abs, produce(), chunksize=5,
+                                      max_pending=2)
+        next(results)
+        assert len(consumed) <= 3 * 5
+        results.close()
+
+        try:
+            pool.map(lambda item: 1 // item, [1, 0])
+        except ZeroDivisionError:
+            pass
+        else:
+            raise AssertionError("The error of a worker was swallowed")
+    finally:
+        pool.close()
+
+    assert get_pool(2) is get_pool(2)
+    assert distribute(lambda item: item ** 2, [1, 2, 3], workers=2) == \
+        [1, 4, 9]
+
+
+def test_executor():
+    """
+    Tests that the 'Executor' starts tasks only once their dependencies are
+    finished, and skips everything downstream of a failure
+    """
+
+    import threading
+    from .executor import Executor
+    from .launcher import Result
+
+    finished = []
+    lock = threading.Lock()
+
+    def make_action(task, returncode=0):
+        def action():
+            with lock:
+                finished.append(task)
+            return Result(returncode)
+        return action
+
+    tasks = {'a': ['b', 'c'], 'b': ['d'], 'c': ['d', 'source'], 'd': [],
+             'e': ['f'], 'f': []}
+    actions = {task: make_action(task) for task in tasks}
+    actions['f'] = make_action('f', returncode=1)
+
+    executor = Executor(tasks, ['source'], actions, jobs=3,
+                        print_result=False)
+    results = executor.run()
+
+    assert finished.index('d') < finished.index('b')
+    assert finished.index('d') < finished.index('c')
+    assert finished.index('b') < finished.index('a')
+    assert finished.index('c') < finished.index('a')
+    assert executor.failed == ['f']
+    assert executor.skipped == ['e']
+    assert results['e'] is None and 'e' not in finished
+
+
+def test_critical_path():
+    """
+    Tests that the 'Executor' starts the task with the longest path ahead of
+    it first, and that 'TimingDatabase' remembers durations between runs
+    """
+
+    import tempfile
+    from .executor import Executor
+    from .launcher import Result
+    from .timings import TimingDatabase
+
+    started = []
+
+    def make_action(task):
+        def action():
+            started.append(task)
+            return Result()
+        return action
+
+    tasks = {'quick': [], 'slow': [], 'link': ['slow'], 'final': ['link']}
+    actions = {task: make_action(task) for task in tasks}
+    durations = {'quick': 5.0, 'slow': 3.0, 'link': 1.0, 'final': 2.0}
+
+    executor = Executor(tasks, [], actions, jobs=1, durations=durations)
+    assert executor.getPriority('slow') == 6.0
+    executor.run()
+    assert started == ['slow', 'quick', 'link', 'final']
+    assert executor.getCriticalPath() == ['slow', 'link', 'final']
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = TimingDatabase(directory)
+        database.recordAll(durations)
+        database.save()
+        assert TimingDatabase(directory).getDurations() == durations
+
+
+def test_stage_limits():
+    """
+    Tests that the 'Executor' never runs more tasks of a stage than its limit
+    allows, while other stages keep going, and reports stage utilization;
+    and that the limits of '--stage-jobs' are checked
+    """
+
+    import time
+    import threading
+    from .executor import Executor
+    from .launcher import Result
+    from .core import _parse_stage_jobs
+    from .tools import CytherError
+
+    lock = threading.Lock()
+    running = {}
+    peaks = {}
+
+    def make_action(stage):
+        def action():
+            with lock:
+                running[stage] = running.get(stage, 0) + 1
+                peaks[stage] = max(peaks.get(stage, 0), running[stage])
+            time.sleep(0.05)
+            with lock:
+                running[stage] -= 1
+            return Result()
+        return action
+
+    tasks = {}
+    stages = {}
+    for name in 'abcd':
+        tasks[name + '.c'] = []
+        tasks[name + '.o'] = [name + '.c']
+        stages[name + '.c'] = 'cython'
+        stages[name + '.o'] = 'compile'
+    actions = {task: make_action(stage) for task, stage in stages.items()}
+
+    executor = Executor(tasks, [], actions, jobs=4, stages=stages,
+                        limits={'cython': 1})
+    executor.run()
+    assert not executor.failed
+    assert peaks['cython'] == 1
+    assert peaks['compile'] >= 1
+
+    utilization = executor.getStageUtilization()
+    assert utilization['cython'][0] == 4
+    assert 0.0 < utilization['cython'][2] <= 1.0
+    assert 'cython' in executor.formatStageUtilization()
+
+    assert _parse_stage_jobs(['cython=2']) == {'cython': 2}
+    for item in ('cython=0', 'linker=2', 'link=-1', 'link'):
+        try:
+            _parse_stage_jobs([item])
+        except CytherError:
+            pass
+        else:
+            raise AssertionError("'{}' must be refused".format(item))
+
+
+def test_memory_scheduling():
+    """
+    Tests that the 'Executor' keeps the memory expected of the running tasks
+    within the budget, estimates unmeasured tasks from their inputs, and
+    records the peak memory of the commands it ran
+    """
+
+    import sys
+    import time
+    import tempfile
+    import threading
+    from .executor import Executor, BASE_MEMORY
+    from .launcher import Result
+    from .timings import TimingDatabase
+    from .core import _parse_memory_budget
+    from .tools import CytherError
+
+    assert _parse_memory_budget('512M') == 512 * 2 ** 20
+    assert _parse_memory_budget('1.5GiB') == 3 * 2 ** 29
+    assert _parse_memory_budget('auto') is None or \
+        _parse_memory_budget('auto') > 0
+    for budget in ('inf', 'nanG', '-1M', 'lots'):
+        try:
+            _parse_memory_budget(budget)
+        except CytherError:
+            pass
+        else:
+            raise AssertionError("'{}' must be refused".format(budget))
+
+    lock = threading.Lock()
+    running = []
+    overlaps = []
+
+    def make_action(task):
+        def action():
+            with lock:
+                running.append(task)
+                overlaps.append(sorted(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(task)
+            return Result()
+        return action
+
+    tasks = {name: [] for name in ('big1', 'big2', 'small1', 'small2')}
+    actions = {task: make_action(task) for task in tasks}
+    memory = {'big1': 600, 'big2': 600, 'small1': 200, 'small2': 200}
+    executor = Executor(tasks, [], actions, jobs=4, memory=memory,
+                        memory_budget=1000, durations={'big1': 2, 'big2': 2})
+    executor.run()
+    assert not executor.failed
+    assert all(sum(memory[task] for task in tasks_running) <= 1000
+               for tasks_running in overlaps)
+    assert executor.peak_estimate <= 1000
+    assert executor.memory_waits
+    assert 'Throttling' in executor.formatThrottling()
+
+    # A task bigger than the budget still runs, on its own
+    executor = Executor({'huge': []}, [], {'huge': make_action('huge')},
+                        memory={'huge': 5000}, memory_budget=1000)
+    executor.run()
+    assert not executor.failed
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'big.c')
+        with open(source, 'w') as file:
+            file.write('x' * 1000)
+        target = source[:-2] + '.o'
+        command = [sys.executable, '-c', 'x = bytearray(50 * 2 ** 20)']
+        executor = Executor({target: [source]}, [source],
+                            {target: [command]}, print_result=False)
+        assert executor.estimateMemory(target) == BASE_MEMORY + 64 * 1000
+        executor.run()
+        if hasattr(os, 'wait4'):
+            assert executor.memory[target] >= 50 * 2 ** 20
+
+        timings = TimingDatabase(directory)
+        timings.recordAllMemory(executor.memory)
+        timings.save()
+        assert TimingDatabase(directory).getMemory() == \
+            {task: int(peak) for task, peak in executor.memory.items()}
+
+
+def test_fail_fast():
+    """
+    Tests that the 'Executor' terminates the commands running (along with
+    their children) at the first failure, and that with 'keep_going' it
+    builds everything that doesn't depend on the failure
+    """
+
+    import sys
+    import time
+    from .executor import Executor
+
+    def python(code):
+        return [sys.executable, '-c', code]
+
+    # The child inherits the pipes; the build would hang on them if it was
+    # left running
+    slow = python('import sys, subprocess; subprocess.call([sys.executable, '
+                  '"-c", "import time; time.sleep(30)"])')
+    failing = python('import sys, time; time.sleep(0.5); sys.exit(1)')
+    tasks = {'bad': [], 'slow': [], 'after': ['bad'], 'later': []}
+    actions = {'bad': [failing], 'slow': [slow], 'after': [python('')],
+               'later': [python('')]}
+    durations = {'bad': 10, 'slow': 10, 'after': 1, 'later': 1}
+
+    start = time.time()
+    executor = Executor(tasks, [], actions, jobs=2, durations=durations,
+                        keep_going=False, print_result=False)
+    executor.run()
+    assert time.time() - start < 15
+    assert executor.failed == ['bad']
+    assert executor.cancelled == ['slow']
+    assert executor.skipped == ['after']
+    assert executor.not_started == ['later']
+    summary = executor.formatSummary()
+    assert 'Cancelled while running: slow' in summary
+    assert 'Not started: later' in summary
+
+    actions['slow'] = [python('import time; time.sleep(1)')]
+    executor = Executor(tasks, [], actions, jobs=2, durations=durations,
+                        keep_going=True, print_result=False)
+    executor.run()
+    assert executor.failed == ['bad']
+    assert executor.skipped == ['after']
+    assert not executor.cancelled and not executor.not_started
+    assert executor.results['slow'].returncode == 0
+    assert executor.results['later'].returncode == 0
+
+
+def test_resource_stats():
+    """
+    Tests that 'Result's carry the resources their command used, and that
+    the 'Executor' sums them up per stage and per target
+    """
+
+    import sys
+    from .executor import Executor, describe_resources
+    from .launcher import Result
+
+    def python(code):
+        return [sys.executable, '-c', code]
+
+    tasks = {'busy': [], 'idle': [], 'killed': []}
+    actions = {'busy': [python('x = 0\nfor i in range(2000000): x += i')],
+               'idle': [python('import time; time.sleep(0.5)')],
+               'killed': [python('import os, signal; '
+                                 'os.kill(os.getpid(), signal.SIGTERM)')]}
+    stages = {'busy': 'compute', 'idle': 'wait', 'killed': 'wait'}
+    executor = Executor(tasks, [], actions, stages=stages, keep_going=True,
+                        print_result=False)
+    executor.run()
+
+    busy = executor.results['busy']
+    assert busy.wall_time > 0
+    if hasattr(os, 'wait4'):
+        assert busy.getCPUTime() > 0 and busy.peak_memory > 0
+        assert executor.results['killed'].signal
+        assert 'CPU-bound' in describe_resources(busy.wall_time,
+                                                 busy.getCPUTime(), None)
+        idle = executor.results['idle']
+        assert 'waiting on I/O' in describe_resources(
+            idle.wall_time, idle.getCPUTime(), None)
+
+    by_stage = executor.getResources()
+    assert by_stage['compute']['tasks'] == 1
+    assert by_stage['wait']['tasks'] == 2
+    assert by_stage['wait']['wall_time'] >= 0.5
+    by_target = executor.getResources(by_stage=False)
+    assert set(by_target) == set(tasks)
+    assert 'Resources by stage' in executor.formatResources()
+
+    result = Result()
+    first, second = Result(), Result()
+    first.wall_time, first.user_time, first.system_time = 1.0, 0.5, 0.25
+    second.wall_time, second.signal = 2.0, 9
+    result.extendInformation(first)
+    result.extendInformation(second)
+    assert result.wall_time == 3.0 and result.getCPUTime() == 0.75
+    assert result.signal == 9
+    assert describe_resources(1.0, 0.1, 2 ** 31) == \
+        'waiting on I/O, memory-heavy'
+
+
+def test_timeouts_and_retries():
+    """
+    Tests that the 'Executor' terminates the commands of a stage that run
+    past its timeout, or that hang, and runs again the commands that failed
+    in a transient way; that 'multiCall' passes its timeouts on, and that the
+    stages of '--stage-timeouts' are checked
+    """
+
+    import sys
+    import time
+    import tempfile
+    from . import launcher
+    from .executor import Executor, is_transient_failure
+    from .launcher import Result, call, multiCall
+    from .core import _parse_stage_timeouts, _check_timeout
+    from .tools import CytherError
+
+    def python(code):
+        return [sys.executable, '-c', code]
+
+    with tempfile.TemporaryDirectory() as directory:
+        marker = os.path.join(directory, 'killed')
+        # Kills itself the first time only
+        flaky = python('import os, signal\n'
+                       'if not os.path.exists({0!r}):\n'
+                       '    open({0!r}, "w").close()\n'
+                       '    os.kill(os.getpid(), signal.SIGKILL)'.format(
+                           marker))
+        sleeper = python('import time; time.sleep(30)')
+        tasks = {'slow': [], 'stuck': [], 'flaky': [], 'quick': []}
+        actions = {'slow': [sleeper], 'stuck': [sleeper], 'flaky': [flaky],
+                   'quick': [python('')]}
+        stages = {'slow': 'compile', 'stuck': 'link', 'flaky': 'link',
+                  'quick': 'compile'}
+
+        start = time.time()
+        executor = Executor(tasks, [], actions, jobs=4, stages=stages,
+                            stage_timeouts={'compile': 0.5},
+                            idle_timeout=1.0, retries=2, retry_delay=0.1,
+                            print_result=False)
+        executor.run()
+        assert time.time() - start < 15
+        assert sorted(executor.failed) == ['slow', 'stuck']
+        assert executor.timed_out == ['slow']
+        assert executor.results['slow'].timed_out
+        assert executor.results['quick'].returncode == 0
+        if hasattr(os, 'wait4'):
+            assert executor.hung == ['stuck']
+            assert executor.results['flaky'].returncode == 0
+            assert executor.retried == {'flaky': 1}
+            by_stage = executor.getResources()
+            assert by_stage['link']['retries'] == 1
+            assert by_stage['link']['hung'] == 1
+            assert by_stage['compile']['timeouts'] == 1
+            assert 'Hung: stuck' in executor.formatSummary()
+
+    killed, failed = Result(-9), Result(1)
+    killed.signal = 9
+    memory = Result(1, '', 'fatal error: out of memory')
+    assert is_transient_failure(killed) and is_transient_failure(memory)
+    assert not is_transient_failure(failed)
+    killed.timed_out = True
+    assert not is_transient_failure(killed)
+
+    results = multiCall(python('import time; time.sleep(30)'), timeout=0.2)
+    assert results[0].timed_out
+
+    # Without a way to measure the CPU time, a silent command isn't hung
+    measure = launcher.group_cpu_time
+    launcher.group_cpu_time = lambda group: None
+    try:
+        result = call(python('import time; time.sleep(0.5)'),
+                      idle_timeout=0.1)
+    finally:
+        launcher.group_cpu_time = measure
+    assert result.returncode == 0 and not result.hung
+
+    assert _parse_stage_timeouts(['link=5']) == {'link': 5.0}
+    for item in ('linker=5', 'link=soon', 'link=nan', 'link=inf', 'link=-5'):
+        try:
+            _parse_stage_timeouts([item])
+        except CytherError:
+            pass
+        else:
+            raise AssertionError("'{}' must be refused".format(item))
+    assert _check_timeout('timeout', None) is None
+    assert _check_timeout('timeout', 2.5) == 2.5
+    for seconds in (float('nan'), float('inf'), 0.0, -5.0):
+        try:
+            _check_timeout('timeout', seconds)
+        except CytherError:
+            pass
+        else:
+            raise AssertionError("'{}' must be refused".format(seconds))
+
+
+def test_build_database():
+    """
+    Tests that 'BuildDatabase' rebuilds on content or command changes, but
+    not when a file is merely touched
+    """
+
+    import tempfile
+    from .database import BuildDatabase
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'source.pyx')
+        target = os.path.join(directory, 'source.c')
+        commands = [['cython', source]]
+        for file_path in (source, target):
+            with open(file_path, 'w') as file:
+                file.write('# contents\n')
+
+        database = BuildDatabase(directory, toolchain=['cython 0.25'])
+        assert database.isOutDated(target, [source], commands)
+        database.update(target, [source], commands)
+        database.save()
+
+        database = BuildDatabase(directory, toolchain=['cython 0.25'])
+        assert not database.isOutDated(target, [source], commands)
+
+        stat = os.stat(source)
+        os.utime(source, (stat.st_atime + 10, stat.st_mtime + 10))
+        assert not database.isOutDated(target, [source], commands)
+        assert database.isOutDated(target, [source], [['cython', '-a']])
+
+        with open(source, 'w') as file:
+            file.write('# new contents\n')
+        assert database.isOutDated(target, [source], commands)
+
+        other = BuildDatabase(directory, toolchain=['cython 0.26'])
+        assert other.isOutDated(target, [source], commands)
+
+
+def test_artifact_cache():
+    """
+    Tests the content-addressed 'ArtifactCache' (storing, fetching, and LRU
+    eviction) and that 'CompilerCache' restores an object compiled elsewhere
+    along with its warnings, even when it holds debug information
+    """
+
+    import time
+    import tempfile
+    from .cache import ArtifactCache, CompilerCache, parse_compile_command, \
+        parse_link_command
+
+    assert parse_compile_command(['gcc', '-O3', '-c', '-o', 'a.o', 'a.c']) \
+        == (['-O3', '-c'], 'a.c', 'a.o')
+    assert parse_compile_command(['gcc', '-o', 'a.so', 'a.o']) is None
+    assert parse_link_command(['gcc', '-shared', '-o', 'a.so', 'a.o', '-lm']) \
+        == (['-shared', '-lm'], ['a.o'], 'a.so')
+    assert parse_link_command(['gcc', '-c', '-o', 'a.o', 'a.c']) is None
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ArtifactCache(os.path.join(directory, 'cache'), max_size=30)
+
+        blobs = []
+        for number in range(3):
+            blob = os.path.join(directory, 'blob{}'.format(number))
+            with open(blob, 'w') as file:
+                file.write(str(number) * 10)
+            assert cache.store('key{}'.format(number), blob)
+            os.utime(cache.getBlobPath('key{}'.format(number)),
+                     (time.time() + number, time.time() + number))
+            blobs.append(blob)
+
+        restored = os.path.join(directory, 'restored')
+        assert cache.fetch('key1', restored)
+        assert open(restored).read() == '1' * 10
+        assert not cache.fetch('missing', restored)
+        assert cache.stats['hits'] == 1 and cache.stats['misses'] == 1
+
+        cache.max_size = 25
+        assert cache.evict() == 1
+        assert not cache.contains('key0')
+        assert cache.contains('key1') and cache.contains('key2')
+
+        compiler_cache = CompilerCache(cache)
+        cache.max_size = 10 ** 6
+        for worktree in ('one', 'two'):
+            os.mkdir(os.path.join(directory, worktree))
+            source = os.path.join(directory, worktree, 'unit.c')
+            with open(source, 'w') as file:
+                file.write('#warning "squaring"\n'
+                           'int square(int x) { return x * x; }\n')
+            command = ['gcc', '-O2', '-c', '-o', source[:-1] + 'o', source]
+            result = compiler_cache.call(command)
+            assert result.returncode == 0 and 'squaring' in result.stderr
+            assert os.path.isfile(source[:-1] + 'o')
+        assert cache.stats['hits'] == 2 and cache.stats['stores'] == 5
+
+        # The directories are mapped out of the debug information
+        cwd = os.getcwd()
+        try:
+            for worktree in ('one', 'two'):
+                os.chdir(os.path.join(directory, worktree))
+                command = ['gcc', '-g', '-c', '-o', 'debug.o', 'unit.c']
+                assert compiler_cache.call(command).returncode == 0
+        finally:
+            os.chdir(cwd)
+        assert cache.stats['hits'] == 3 and cache.stats['misses'] == 3
+        with open(os.path.join(directory, 'one', 'debug.o'), 'rb') as file:
+            assert directory.encode() not in file.read()
+
+
+def test_cython_cache():
+    """
+    Tests that the key of 'CythonCache' follows the '.pxd' files a source
+    cimports, and that a hit materializes the C without running cython
+    """
+
+    import tempfile
+    from .cache import ArtifactCache, CythonCache
+    from .scanner import parse_string, find_dependencies
+
+    modules, includes = parse_string("cimport a.b as c, d\n"
+                                     "from .e cimport (f, g)\n"
+                                     "include 'h.pxi'\n")
+    assert modules == ['a.b', 'd', '.e', '.e.f', '.e.g']
+    assert includes == ['h.pxi']
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'module.pyx')
+        declaration = os.path.join(directory, 'helper.pxd')
+        with open(source, 'w') as file:
+            file.write("from helper cimport twice\n\n"
+                       "def run(int x):\n    return twice(x)\n")
+        with open(declaration, 'w') as file:
+            file.write("cdef inline int twice(int x):\n    return 2 * x\n")
+
+        assert find_dependencies(source) == [declaration]
+
+        cache = CythonCache(ArtifactCache(os.path.join(directory, 'cache')))
+        output = os.path.join(directory, 'module.c')
+        command = ['cython', '-o', output, source]
+        key = cache.getKey(command)
+
+        assert cache.call(command).returncode == 0
+        os.remove(output)
+        assert cache.call(command).returncode == 0
+        assert os.path.isfile(output)
+        assert cache.cache.stats['hits'] == 1
+
+        with open(declaration, 'a') as file:
+            file.write("\ncdef int thrice(int x)\n")
+        assert cache.getKey(command) != key
+
+        # A dependency deleted since it was scanned is a miss, not a crash
+        class StaleScanner:
+            def getDependencies(self, source):
+                return [declaration]
+
+        os.remove(declaration)
+        cache.scanner = StaleScanner()
+        assert cache.getKey(command) is None
+
+
+def test_depfiles():
+    """
+    Tests the parsing of gcc depfiles, and that the headers they list make a
+    target out of date in the 'BuildDatabase'
+    """
+
+    import tempfile
+    from .database import BuildDatabase
+    from .depfiles import parse_depfile_string, strip_depfile_flags, \
+        discover_inputs
+
+    string = "tree.o: tree.c tree.h \\\n dir\\ with\\ space/random.h\n" \
+             "tree.h:\n"
+    assert parse_depfile_string(string) == ['tree.c', 'tree.h',
+                                            'dir with space/random.h']
+    assert strip_depfile_flags(['-O3', '-MMD', '-MF', 'a.d', '-c']) == \
+        ['-O3', '-c']
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'tree.c')
+        header = os.path.join(directory, 'tree.h')
+        target = os.path.join(directory, 'tree.o')
+        depfile = os.path.join(directory, 'tree.d')
+        for file_path in (source, header, target):
+            with open(file_path, 'w') as file:
+                file.write('/* contents */\n')
+        with open(depfile, 'w') as file:
+            file.write('{}: {} {}\n'.format(target, source, header))
+
+        commands = [['gcc', '-c', '-MMD', '-MF', depfile, '-o', target,
+                     source]]
+        assert discover_inputs(commands) == [source, header]
+
+        database = BuildDatabase(directory)
+        database.update(target, [source], commands, discover_inputs(commands))
+        assert not database.isOutDated(target, [source], commands)
+
+        with open(header, 'w') as file:
+            file.write('/* new contents */\n')
+        assert database.isOutDated(target, [source], commands)
+
+
+def test_unity_build():
+    """
+    Tests that 'UnityBuild' keeps clashing files out of its unity files,
+    falls back to compiling file by file when a unity file doesn't compile,
+    and gives files of the same name objects of their own
+    """
+
+    import tempfile
+    from .executor import execute
+    from .unity import UnityBuild, find_clashes, split_chunks
+
+    sources = {
+        'main.c': '#include "shared.h"\nint twice(int);\n'
+                  'int main(void){ return twice(get(0)); }\n',
+        'twice.c': '#include "shared.h"\nint twice(int x){ return 2 * x; }\n',
+        'clash.c': 'static int helper(void){ return 1; }\n'
+                   'int clash(void){ return helper(); }\n',
+        'other.c': 'static int helper(void){ return 2; }\n'
+                   'int other(void){ return helper(); }\n',
+        # No include guard, so 'twice.c' breaks when it follows 'main.c'
+        'shared.h': 'struct box { int value; };\n'
+                    'static inline int get(int x){ return x; }\n'}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, string in sources.items():
+            with open(os.path.join(directory, name), 'w') as file:
+                file.write(string)
+        names = ['main.c', 'twice.c', 'clash.c', 'other.c']
+        paths = [os.path.join(directory, name) for name in names]
+
+        assert find_clashes(paths[2:]) == [paths[3]]
+        assert split_chunks(paths, 2) in ([paths[:2], paths[2:]],
+                                          [paths[::2], paths[1::2]],
+                                          [[paths[0], paths[3]], paths[1:3]])
+
+        output = os.path.join(directory, 'program')
+        build = UnityBuild(paths, output)
+        assert build.getSeparate() == [paths[3]]
+        executor = execute(build.getPlan(), wrappers=[build],
+                           print_result=False)
+        assert not executor.failed
+        assert len(build.fallbacks) == 1
+        assert build.getBroken() == [paths[1]]
+        assert os.path.isfile(output)
+
+        build.save()
+        build = UnityBuild(paths, output)
+        assert build.getSeparate() == [paths[1], paths[3]]
+        executor = execute(build.getPlan(), wrappers=[build],
+                           print_result=False)
+        assert not executor.failed and not build.fallbacks
+
+        # Both are kept out of the unity files, as they clash
+        nested = os.path.join(directory, 'nested')
+        os.mkdir(nested)
+        with open(os.path.join(nested, 'other.c'), 'w') as file:
+            file.write(sources['other.c'].replace('other(', 'nested('))
+        build = UnityBuild(paths + [os.path.join(nested, 'other.c')], output)
+        plan = build.getPlan()
+        objects = plan.getTasks()[output]
+        assert len(set(objects)) == len(objects) == len(plan.getStages()) - 1
+        executor = execute(plan, wrappers=[build], print_result=False)
+        assert not executor.failed
+        assert not build.wraps(['gcc', '-c', 'main.c', '-o'])
+
+
+def test_precompiled_header():
+    """
+    Tests that 'PrecompiledHeader' builds one precompiled 'Python.h' per
+    combination of flags and headers, and puts it first on the include path
+    """
+
+    import tempfile
+    from .launcher import call
+    from .pch import PrecompiledHeader
+
+    with tempfile.TemporaryDirectory() as directory:
+        include_dir = os.path.join(directory, 'include')
+        os.makedirs(include_dir)
+        header = os.path.join(include_dir, 'Python.h')
+        with open(header, 'w') as file:
+            file.write('int answer(void);\n')
+        source = os.path.join(directory, 'module.c')
+        with open(source, 'w') as file:
+            file.write('#define PY_SSIZE_T_CLEAN\n#include "Python.h"\n'
+                       'int answer(void){ return 42; }\n')
+
+        pch = PrecompiledHeader(os.path.join(directory, 'pch'),
+                                include_dirs=[include_dir])
+        command = ['gcc', '-O2', '-c', '-I' + include_dir, '-o',
+                   os.path.join(directory, 'module.o'), source]
+        applied = pch.apply(command)
+        assert len(pch.built) == 1
+        assert applied[3].startswith('-I' + pch.directory)
+        assert applied[4:] == command[3:]
+        assert pch.apply(command) == applied and len(pch.built) == 1
+        assert not call(applied + ['-Winvalid-pch', '-Werror']).returncode
+
+        assert pch.apply(command[:1] + ['-O0'] + command[2:]) != applied
+        with open(header, 'a') as file:
+            file.write('int question(void);\n')
+        assert pch.apply(command) != applied
+        assert len(pch.built) == 3
+
+
+def test_ninja_file():
+    """
+    Tests that a 'Commands' plan is written out as an equivalent ninja file
+    """
+
+    from .commands import Commands
+    from .ninja import make_ninja_string, escape_path
+
+    plan = Commands()
+    plan.addTask('a.c', [['cython', '-o', 'a.c', 'a.pyx']], givens=['a.pyx'],
+                 stage='cython')
+    plan.addTask('a.o', [['gcc', '-c', '-MMD', '-MF', 'a.d', '-o', 'a.o',
+                          'a.c']], dependencies=['a.c'], stage='compile')
+    plan.addTask('my lib.so', [['gcc', '-shared', '-o', 'my lib.so', 'a.o']],
+                 dependencies=['a.o'], stage='link')
+    plan.addTask('all', dependencies=['my lib.so'])
+    plan.addTask('clean', [['rm', '-f', 'a.o']], phony=True)
+
+    string = make_ninja_string(plan)
+    assert escape_path('c:/my $dir') == 'c$:/my$ $$dir'
+    assert 'rule compile_deps\n' in string and 'deps = gcc' in string
+    assert string.count('restat = 1') == 4
+    assert 'build a.o: compile_deps a.c\n' in string
+    assert '  depfile = a.d\n' in string
+    assert "  cmd = gcc -shared -o 'my lib.so' a.o\n" in string
+    assert 'build all: phony my$ lib.so\n' in string
+    assert 'build clean: run cyther_always\n' in string
+    assert 'build cyther_always: phony\n' in string
+    assert string.rstrip().endswith('default all clean')
+
+
+def test_makefile():
+    """
+    Tests that 'Makefile' reads rules, variables and phony targets into
+    instructions, and that they build through the 'Executor'
+    """
+
+    import tempfile
+    from .database import BuildDatabase
+    from .executor import execute
+    from .instructions import makeInstructionPlan
+    from .makefile import Makefile
+
+    string = "CC = gcc\nCFLAGS := -O0 \\\n  -g\nOBJECTS = main.o\n" \
+             "OBJECTS += util.o\n\n.PHONY: all clean\n\n" \
+             "all: program  # the default goal\n\n" \
+             "program: $(OBJECTS)\n\t$(CC) $^ -o $@\n\n" \
+             "%s.o: %s.c util.h\n\t@$(CC) $(CFLAGS) -c $<\n\n" \
+             "clean:\n\t-rm -f *.o program\n"
+    string = string.replace('%s.o: %s.c', 'main.o: main.c') + \
+        "util.o: util.c util.h\n\t$(CC) ${CFLAGS} -c util.c\n"
+    sources = {'main.c': '#include "util.h"\n'
+                         'int main(void){ return util(); }\n',
+               'util.c': '#include "util.h"\nint util(void){ return 0; }\n',
+               'util.h': 'int util(void);\n'}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, contents in sources.items():
+            with open(os.path.join(directory, name), 'w') as file:
+                file.write(contents)
+        file_path = os.path.join(directory, 'makefile')
+        with open(file_path, 'w') as file:
+            file.write(string)
+
+        makefile = Makefile(file_path)
+        assert makefile.default_goal == 'all'
+        assert makefile.phony == {'all', 'clean'}
+        assert makefile.getGoals() == ['all', 'program', 'main.o', 'util.o']
+        assert makefile.getVariable('CFLAGS') == '-O0 -g'
+        command = makefile.getCommands(makefile.rules['util.o'])[0]
+        assert ' '.join(command).endswith('gcc -O0 -g -c util.c')
+
+        instructions = makefile.getInstructions()
+        assert [instruction.phony for instruction in instructions] == \
+            [True, False, False, False]
+        program = instructions[1]
+        assert program.buildable_dependencies == [
+            os.path.join(directory, 'main.o'),
+            os.path.join(directory, 'util.o')]
+
+        executor = execute(makeInstructionPlan(instructions),
+                           print_result=False)
+        assert not executor.failed
+        assert os.path.isfile(os.path.join(directory, 'program'))
+
+        # A phony target runs every time, even next to a file of its name
+        database = BuildDatabase(directory)
+        plan = makeInstructionPlan(makefile.getInstructions(['clean']))
+        assert plan.getPhony() == {os.path.join(directory, 'clean')}
+        for _ in range(2):
+            with open(os.path.join(directory, 'clean'), 'w'):
+                pass
+            executor = execute(plan, database=database, print_result=False)
+            assert not executor.failed and not executor.up_to_date
+            assert not os.path.exists(os.path.join(directory, 'program'))
+            executor = execute(makeInstructionPlan(instructions),
+                               database=database, print_result=False)
+            assert os.path.isfile(os.path.join(directory, 'program'))
+
+        # In unity mode, the program is built out of its C files directly
+        os.remove(os.path.join(directory, 'program'))
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            instructions = makefile.getInstructions(unity=2)
+            assert len(instructions) == 2
+            program = instructions[1]
+            assert program.unity_chunks == 2
+            assert program.unity_options['compile_flags'] == ['-O0', '-g']
+            builds = []
+            plan = makeInstructionPlan(instructions, builds=builds)
+            assert len(builds) == 1
+            executor = execute(plan, wrappers=builds, print_result=False)
+            builds[0].save()
+        finally:
+            os.chdir(cwd)
+        assert not executor.failed
+        assert os.path.isfile(os.path.join(directory, 'program'))
+        assert os.path.isfile(os.path.join(directory, '__cythercache__',
+                                           'unity.json'))
+
+
+def test_distributed():
+    """
+    Tests that 'DistributedCompiler' spreads compile commands over workers
+    on localhost (taking the sources a 'CompilerCache' preprocessed), and
+    compiles locally once a worker disappears
+    """
+
+    import socket
+    import tempfile
+    from .commands import Commands
+    from .executor import execute
+    from .cache import ArtifactCache, CompilerCache
+    from .distributed import Worker, DistributedCompiler, is_allowed_flag
+
+    with tempfile.TemporaryDirectory() as directory:
+        header = os.path.join(directory, 'shared.h')
+        with open(header, 'w') as file:
+            file.write('#define VALUE 42\n')
+
+        plan = Commands()
+        objects = []
+        for index in range(4):
+            source = os.path.join(directory, 'unit{}.c'.format(index))
+            with open(source, 'w') as file:
+                file.write('#include "shared.h"\nint unit{}(void){{ return '
+                           'VALUE; }}\n'.format(index))
+            target = source[:-2] + '.o'
+            plan.addTask(target, [['gcc', '-O2', '-c', '-I' + directory,
+                                   '-MMD', '-MF', source[:-2] + '.d', '-o',
+                                   target, source]], givens=[source])
+            objects.append(target)
+
+        token = 'secret'
+        workers = [Worker('localhost:0', jobs=2, token=token).start()]
+        if hasattr(socket, 'AF_UNIX'):
+            address = 'unix:' + os.path.join(directory, 'worker.sock')
+            workers.append(Worker(address, jobs=1, token=token).start())
+        try:
+            addresses = [worker.getAddress() for worker in workers]
+            assert not DistributedCompiler(addresses,
+                                           token='wrong').getCapacity()
+            compiler = DistributedCompiler(addresses, token=token)
+            assert compiler.getCapacity() == sum(worker.jobs
+                                                 for worker in workers)
+            forbidden = {'type': 'compile', 'compiler': 'sh', 'flags': [],
+                         'token': token}
+            assert 'error' in workers[0].handle(forbidden, b'')[0]
+            listing = os.path.join(directory, 'listing.lst')
+            for flag in ('-Wa,-aln=' + listing, '-Xassembler', '-Wl,-v',
+                         '-save-temps', '-fdump-tree-all', '-MD',
+                         '-fprofile-generate', '@' + listing, '-B/tmp'):
+                assert not is_allowed_flag(flag), flag
+                escaping = {'type': 'compile', 'compiler': 'gcc',
+                            'flags': [flag], 'token': token}
+                assert 'error' in workers[0].handle(escaping, b'')[0]
+            assert not os.path.exists(listing)
+            for flag in ('-O3', '-g', '-fPIC', '-Wall', '-Wno-unused',
+                         '-march=native', '-std=c99', '-DNDEBUG', '-pthread',
+                         '-fwrapv', '-fvisibility=hidden',
+                         '-fdebug-prefix-map=' + directory + '=.'):
+                assert is_allowed_flag(flag), flag
+            no_token = {'type': 'status'}
+            assert 'error' in workers[0].handle(no_token, b'')[0]
+
+            executor = execute(plan, jobs=4, wrappers=[compiler],
+                               print_result=False)
+            assert not executor.failed
+            assert all(os.path.isfile(target) for target in objects)
+            with open(objects[0][:-2] + '.d') as file:
+                assert 'shared.h' in file.read()
+            completed = sum(stats[1] for stats in compiler.getStats())
+            assert completed + compiler.local == len(objects)
+            assert completed >= 1
+
+            # Behind a 'CompilerCache', the misses are preprocessed once
+            preprocessed = []
+
+            def preprocess(command):
+                preprocessed.append(command)
+                return DistributedCompiler.preprocess(compiler, command)
+
+            compiler.preprocess = preprocess
+            cache = CompilerCache(ArtifactCache(os.path.join(directory,
+                                                             'cache')),
+                                  compiler)
+            for target in objects:
+                os.remove(target)
+            executor = execute(plan, jobs=4, wrappers=[cache],
+                               print_result=False)
+            assert not executor.failed
+            assert all(os.path.isfile(target) for target in objects)
+            assert cache.cache.stats['misses'] == len(objects)
+            assert not preprocessed
+            assert sum(stats[1] for stats in compiler.getStats()) + \
+                compiler.local == 2 * len(objects)
+
+            workers[0].shutdown()
+            for target in objects:
+                os.remove(target)
+            executor = execute(plan, jobs=4, wrappers=[compiler],
+                               print_result=False)
+            assert not executor.failed
+            assert all(os.path.isfile(target) for target in objects)
+            assert 'unreachable' in compiler.formatStats()
+        finally:
+            for worker in workers[1:]:
+                worker.shutdown()
+
+
+def test_remote_cache():
+    """
+    Tests that 'RemoteCache' shares blobs through the bundled 'CacheServer',
+    stays read-only when asked to, can't upload without the server's token,
+    and gives up quickly on an unreachable server
+    """
+
+    import time
+    import tempfile
+    from .cache import ArtifactCache, make_key
+    from .remote import RemoteCache, CacheServer, READ_ONLY, MAX_ERRORS
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = CacheServer(os.path.join(directory, 'server'),
+                             'localhost:0').start()
+        try:
+            source = os.path.join(directory, 'module.o')
+            with open(source, 'wb') as file:
+                file.write(b'object code')
+            key = make_key('remote test')
+
+            remote = RemoteCache(server.getURL(), token=server.token)
+            assert remote.get(key) is None
+            assert remote.put(key, source)
+            remote.flush()
+            assert remote.get(key) == b'object code'
+            assert remote.stats['uploads'] == 1
+            assert remote.stats['misses'] == 1
+            assert remote.get('not-a-key') is None
+
+            read_only = RemoteCache(server.getURL(), mode=READ_ONLY)
+            assert not read_only.put(make_key('other'), source)
+
+            # Uploads without the token of the server are refused
+            for token in ('', 'wrong'):
+                intruder = RemoteCache(server.getURL(), token=token)
+                assert not intruder.upload(make_key('forged'), b'forged')
+                assert intruder.stats['errors'] == 1
+            assert read_only.get(make_key('forged')) is None
+
+            # A cache on another machine gets the blob without building it
+            first = ArtifactCache(os.path.join(directory, 'first'),
+                                  remote=remote)
+            second = ArtifactCache(os.path.join(directory, 'second'),
+                                   remote=remote)
+            other_key = make_key('shared object')
+            assert first.store(other_key, source)
+            remote.flush()
+            destination = os.path.join(directory, 'copy.o')
+            assert second.fetch(other_key, destination)
+            assert second.contains(other_key)
+            with open(destination, 'rb') as file:
+                assert file.read() == b'object code'
+        finally:
+            server.stop()
+
+        unreachable = RemoteCache(server.getURL(), timeout=0.5)
+        start = time.time()
+        for _ in range(MAX_ERRORS + 2):
+            assert unreachable.get(key) is None
+        assert not unreachable.isEnabled()
+        assert unreachable.stats['errors'] == MAX_ERRORS
+        assert time.time() - start < MAX_ERRORS
+
+        # The uploads are evicted as they go over the cap, not on stop
+        server = CacheServer(os.path.join(directory, 'capped'), 'localhost:0',
+                             max_size=100).start()
+        try:
+            remote = RemoteCache(server.getURL(), token=server.token)
+            with open(source, 'wb') as file:
+                file.write(b'x' * 40)
+            keys = [make_key('capped', number) for number in range(5)]
+            for key in keys:
+                assert remote.put(key, source)
+                remote.flush()
+                assert server.cache.getSize() <= 100
+            assert server.cache.stats['evictions']
+            assert remote.get(keys[-1]) == b'x' * 40
+        finally:
+            server.stop()
+
+
+def test_dependency_scanner():
+    """
+    Tests that 'DependencyScanner' sorts cimported modules into buildable and
+    given dependencies, remembers its scans, and that 'makePlan' orders the
+    cython stages accordingly (even with mutual cimports)
+    """
+
+    import tempfile
+    from .scanner import DependencyScanner
+    from .commands import makePlan
+    from .tools import generateBatches
+
+    with tempfile.TemporaryDirectory() as directory:
+        contents = {'a.pyx': 'from b cimport twice\ninclude "defs.pxi"\n',
+                    'b.pyx': '', 'b.pxd': 'cdef int twice(int x)\n',
+                    'defs.pxi': '', 'c.pyx': 'cimport d\n', 'c.pxd': '',
+                    'd.pyx': 'cimport c\n', 'd.pxd': ''}
+        paths = {}
+        for name, content in contents.items():
+            paths[name] = os.path.join(directory, name)
+            with open(paths[name], 'w') as file:
+                file.write(content)
+
+        cache_path = os.path.join(directory, 'scans.json')
+        scanner = DependencyScanner(cache_path=cache_path)
+        sources = [paths[name] for name in ('a.pyx', 'b.pyx', 'c.pyx',
+                                            'd.pyx')]
+        buildables, givens = scanner.getBuildDependencies(paths['a.pyx'],
+                                                          sources)
+        assert buildables == [paths['b.pyx']]
+        assert givens == sorted([paths['b.pxd'], paths['defs.pxi']])
+        scanner.save()
+
+        assert DependencyScanner(cache_path=cache_path).scan(
+            paths['a.pyx']) == [['b', 'b.twice'], ['defs.pxi']]
+
+        files = []
+        for source in sources:
+            stem = os.path.splitext(source)[0]
+            files.append({'file_path': source, 'c_name': stem + '.c',
+                          'object_file_name': stem + '.o',
+                          'dependency_file_name': stem + '.d',
+                          'output_name': stem + '.so', 'include': []})
+        plan = makePlan(files, scanner)
+        tasks = plan.getTasks()
+        assert os.path.join(directory, 'b.c') in tasks[
+            os.path.join(directory, 'a.c')]
+        generateBatches(tasks, plan.getGivens())
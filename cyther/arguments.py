@@ -6,8 +6,13 @@ an entry point that makes sense.
 """
 
 import argparse
-from .core import info, configure, setup, make, clean, purge
+from .core import info, configure, setup, make, clean, purge, worker, \
+    cache_server
 from .test import test_all, test_compiler, test_utilities
+from .distributed import DEFAULT_ADDRESS, \
+    TOKEN_ENVIRONMENT as WORKER_TOKEN_ENVIRONMENT
+from .remote import MODES, READ_WRITE, DEFAULT_SERVER_ADDRESS, \
+    TOKEN_ENVIRONMENT as CACHE_TOKEN_ENVIRONMENT
 
 
 help_info = "Prints the information regarding cyther's installation and " \
@@ -30,6 +35,14 @@ help_clean = "Cleans the current directory of anything not in use. Will" \
              "the '__cythercache__' of independent files. This command is" \
              "similar to GNU's conventional '$make clean' for use with" \
              "makefiles"
+help_worker = "Runs a build worker daemon, compiling the preprocessed" \
+              " sources sent by 'cyther make --workers' and sending the" \
+              " objects back"
+help_cache_server = "Runs a remote artifact cache server, sharing the objects," \
+                    " generated C and modules built by 'cyther make " \
+                    "--remote-cache' between machines. Only expose it to " \
+                    "trusted clients; what it serves ends up in their " \
+                    "builds"
 help_purge = "Cleans the current directory of EVERYTHING cyther related." \
              "Will ask explicit permission for anything" \
              "to be deleted. Deletes the '__cythercache__'"
@@ -53,7 +66,11 @@ info_parser.set_defaults(func=info)
 # $$$$$$$$$$ COMMANDS FOR CONFIGURE $$$$$$$$$$
 configure_parser = commands.add_parser('configure', help=help_configure)
 configure_parser.set_defaults(func=configure)
-# Empty as of now
+help_fresh = "Rescan every directory of the file index used to search for " \
+             "the include and runtime directories, instead of trusting " \
+             "the ones that didn't change"
+configure_parser.add_argument('--fresh', action='store_true',
+                              help=help_fresh)
 
 
 # $$$$$$$$$$ COMMANDS FOR TEST $$$$$$$$$$
@@ -104,12 +121,112 @@ setup_parser.add_argument('--cython', action='store', nargs='+',
 # $$$$$$$$$$ COMMANDS FOR MAKE $$$$$$$$$$
 make_parser = commands.add_parser('make', help=help_make)
 make_parser.set_defaults(func=make)
+help_make_filenames = "The Cython source file(s), and makefiles (their " \
+                      "default goals are built along with the Cython targets)"
+make_parser.add_argument('filenames', action='store',
+                         nargs='+', help=help_make_filenames)
+make_parser.add_argument('--include', action='store', default='',
+                         help=help_include)
+help_jobs = "The maximum number of commands (cython, gcc) to run at the" \
+            " same time. Defaults to the number of cores"
+make_parser.add_argument('-j', '--jobs', action='store', type=int,
+                         default=None, help=help_jobs)
 help_concise = "Get cyther to NOT print what it is thinking. Only use if" \
                "you like to live on the edge"
 make_parser.add_argument('--concise', action='store_true', help=help_concise)
 help_local = 'When not flagged, builds in __cythercache__, when flagged,' \
              'it builds locally in the same directory'
 make_parser.add_argument('--local', action='store_true', help=help_local)
+help_stage_jobs = "Limits how many commands of a stage run at the same" \
+                  " time, as STAGE=N (stages: cython, compile, link)." \
+                  " Ex: --stage-jobs cython=2 compile=4"
+make_parser.add_argument('--stage-jobs', action='store', nargs='+',
+                         dest='stage_jobs', default=[], help=help_stage_jobs)
+help_memory_budget = "Only starts commands while the memory they are " \
+                     "expected to need (from their last peak, or the size" \
+                     " of their inputs) fits in this budget, as SIZE (Ex: " \
+                     "4G, 512M) or 'auto' for the memory available"
+make_parser.add_argument('--memory-budget', action='store',
+                         dest='memory_budget', default=None,
+                         help=help_memory_budget)
+help_max_load = "Don't start new commands while the load average is at or" \
+                " above this number"
+make_parser.add_argument('-l', '--max-load', action='store', type=float,
+                         dest='max_load', default=None, help=help_max_load)
+help_keep_going = "Keep building what doesn't depend on a failed command," \
+                  " instead of stopping the build (and terminating the " \
+                  "commands running) at the first failure"
+make_parser.add_argument('-k', '--keep-going', action='store_true',
+                         dest='keep_going', help=help_keep_going)
+help_timeout = "Terminates a command (and the processes it started) that" \
+               " runs for longer than this many seconds"
+make_parser.add_argument('--timeout', action='store', type=float,
+                         default=None, help=help_timeout)
+help_stage_timeouts = "Timeouts for the commands of a stage, as " \
+                      "STAGE=SECONDS (stages: cython, compile, link). Ex: " \
+                      "--stage-timeouts cython=60 link=300"
+make_parser.add_argument('--stage-timeouts', action='store', nargs='+',
+                         dest='stage_timeouts', default=[],
+                         help=help_stage_timeouts)
+help_idle_timeout = "Terminates a command that goes this many seconds " \
+                    "without any output or CPU progress, as it most likely" \
+                    " hangs"
+make_parser.add_argument('--idle-timeout', action='store', type=float,
+                         dest='idle_timeout', default=None,
+                         help=help_idle_timeout)
+help_retries = "How many times to run a command again when it fails in a " \
+               "way that could be transient (killed outright, or out of " \
+               "memory), waiting longer before each retry"
+make_parser.add_argument('--retries', action='store', type=int, default=0,
+                         help=help_retries)
+help_stats = "Prints the wall time, CPU time and peak memory the commands" \
+             " used, per stage and for the slowest targets"
+make_parser.add_argument('--stats', action='store_true', help=help_stats)
+help_unity = "Builds the programs of the makefiles that link objects " \
+             "compiled from one C file each out of UNITY concatenated " \
+             "files instead (default: 1)"
+make_parser.add_argument('--unity', action='store', nargs='?', type=int,
+                         const=1, default=None, metavar='UNITY',
+                         help=help_unity)
+help_ninja = "Writes the build out as a 'build.ninja' file instead of " \
+             "executing it. With 'run' (the default), ninja is run on it " \
+             "as well"
+make_parser.add_argument('--ninja', action='store', nargs='?', const='run',
+                         choices=('write', 'run'), default=None,
+                         help=help_ninja)
+help_workers = "Addresses of 'cyther worker' daemons to send compile jobs" \
+               " to, as HOST:PORT or unix:PATH"
+make_parser.add_argument('--workers', action='store', nargs='+',
+                         default=[], help=help_workers)
+help_worker_token = "The token the workers were started with (defaults to" \
+                    " the {} environment variable)".format(
+                        WORKER_TOKEN_ENVIRONMENT)
+make_parser.add_argument('--worker-token', action='store',
+                         dest='worker_token', default=None,
+                         help=help_worker_token)
+help_no_pch = "Don't precompile 'Python.h' for the compile step"
+make_parser.add_argument('--no-pch', action='store_true', dest='no_pch',
+                         help=help_no_pch)
+help_no_cache = "Don't look up or store generated C or compiled objects" \
+                " in the user's artifact cache ('~/.cythercache')"
+make_parser.add_argument('--no-cache', action='store_true',
+                         dest='no_cache', help=help_no_cache)
+help_remote_cache = "The URL of a remote artifact cache (such as one run " \
+                    "by 'cyther cache-server') to share artifacts with"
+make_parser.add_argument('--remote-cache', action='store', dest='remote_cache',
+                         default=None, help=help_remote_cache)
+help_remote_mode = "Whether to only download from the remote cache, or to" \
+                   " upload what was built as well (default: {})".format(
+                       READ_WRITE)
+make_parser.add_argument('--remote-mode', action='store', dest='remote_mode',
+                         choices=MODES, default=READ_WRITE,
+                         help=help_remote_mode)
+help_remote_cache_token = "The upload token of the remote cache (defaults " \
+                          "to the {} environment variable)".format(
+                              CACHE_TOKEN_ENVIRONMENT)
+make_parser.add_argument('--remote-cache-token', action='store',
+                         dest='remote_cache_token', default=None,
+                         help=help_remote_cache_token)
 help_watch = "When given, cyther will watch the directory with the 't'" \
              "option implied and compile, when necessary, the files given"
 make_parser.add_argument('--watch', action='store_true', help=help_watch)
@@ -137,3 +254,46 @@ clean_parser.set_defaults(func=clean)
 purge_parser = commands.add_parser('purge', help=help_purge)
 purge_parser.set_defaults(func=purge)
 # Empty as of now
+
+
+# $$$$$$$$$$ COMMANDS FOR WORKER $$$$$$$$$$
+worker_parser = commands.add_parser('worker', help=help_worker)
+worker_parser.set_defaults(func=worker)
+help_listen = "The address to listen on, as HOST:PORT or unix:PATH" \
+              " (default: {})".format(DEFAULT_ADDRESS)
+worker_parser.add_argument('--listen', action='store',
+                           default=DEFAULT_ADDRESS, help=help_listen)
+help_worker_jobs = "The maximum number of sources to compile at the same" \
+                   " time. Defaults to the number of cores"
+worker_parser.add_argument('-j', '--jobs', action='store', type=int,
+                           default=None, help=help_worker_jobs)
+help_token = "The token clients must send. Defaults to the {} environment" \
+             " variable, or a random token printed on start".format(
+                 WORKER_TOKEN_ENVIRONMENT)
+worker_parser.add_argument('--token', action='store', default=None,
+                           help=help_token)
+
+
+# $$$$$$$$$$ COMMANDS FOR CACHE-SERVER $$$$$$$$$$
+cache_server_parser = commands.add_parser('cache-server',
+                                          help=help_cache_server)
+cache_server_parser.set_defaults(func=cache_server)
+help_server_listen = "The address to listen on, as HOST:PORT" \
+                     " (default: {}). Anyone who can reach it can download" \
+                     " the artifacts, so only listen where trusted clients" \
+                     " are".format(DEFAULT_SERVER_ADDRESS)
+cache_server_parser.add_argument('--listen', action='store',
+                                 default=DEFAULT_SERVER_ADDRESS,
+                                 help=help_server_listen)
+help_server_directory = "Where to store the artifacts. Defaults to a " \
+                        "'remote' directory in the user's artifact cache"
+cache_server_parser.add_argument('--directory', action='store', default=None,
+                                 help=help_server_directory)
+help_cache_token = "The token uploads must carry. Defaults to the {} " \
+                   "environment variable, or a random token printed on " \
+                   "start".format(CACHE_TOKEN_ENVIRONMENT)
+cache_server_parser.add_argument('--token', action='store', default=None,
+                                 help=help_cache_token)
+help_verbose = "Log every request"
+cache_server_parser.add_argument('--verbose', action='store_true',
+                                 help=help_verbose)
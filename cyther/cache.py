@@ -0,0 +1,567 @@
+"""
+This module holds the user-level artifact caches. Artifacts are stored in a
+content-addressed directory shared by every project (and every worktree) of
+the user, so an object built once never has to be built again
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+
+from .pathway import path, USER, ISDIR
+from .launcher import Result, call
+from .definitions import USER_CACHE_NAME
+from .database import hash_file
+from .scanner import find_dependencies, get_module_name
+from .depfiles import strip_depfile_flags, get_depfile
+
+
+OBJECTS_DIRECTORY = 'objects'
+STATS_FILE_NAME = 'stats.json'
+
+# Default cap of the whole cache, in bytes
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3
+
+# When over the cap, evict until the cache is this fraction of it
+EVICTION_TARGET = 0.9
+
+STAT_NAMES = ('hits', 'misses', 'stores', 'evictions')
+
+C_SOURCE_EXTENSIONS = ('.c', '.cc', '.cpp', '.cxx')
+CYTHON_SOURCE_EXTENSIONS = ('.pyx', '.py')
+CYTHON_EXECUTABLES = ('cython', 'cython3', 'cython.exe')
+LINK_INPUT_EXTENSIONS = ('.o', '.obj', '.a', '.lib')
+
+ANNOTATION_EXTENSION = '.html'
+
+# The warnings of a compilation are stored next to its object, under its key
+# with this suffix, so that they are shown again on a hit
+STDERR_EXTENSION = '.stderr'
+
+DEBUG_PREFIX_MAP = '-fdebug-prefix-map={}=.'
+
+
+def make_key(*parts):
+    """
+    Hashes anything json serializable into a cache key
+    """
+    string = json.dumps(parts, sort_keys=True)
+    return hashlib.sha1(string.encode('utf-8')).hexdigest()
+
+
+class ArtifactCache:
+    """
+    A content-addressed store of files, evicted least-recently-used first once
+    it grows past 'max_size' bytes. Statistics are kept per session and merged
+    into the ones on disk when 'save' is called.
+
+    With a 'remote' cache (see 'remote.py'), local misses are looked up
+    remotely, and what is stored locally is uploaded as well
+    """
+    def __init__(self, directory=None, *, max_size=DEFAULT_MAX_SIZE,
+                 remote=None):
+        if not directory:
+            directory = path(USER_CACHE_NAME, ISDIR, root=USER)
+        self.directory = directory
+        self.max_size = max_size
+        self.remote = remote
+        self.stats = dict.fromkeys(STAT_NAMES, 0)
+        self.__lock = threading.Lock()
+        os.makedirs(os.path.join(directory, OBJECTS_DIRECTORY), exist_ok=True)
+
+    def count(self, stat):
+        with self.__lock:
+            self.stats[stat] += 1
+
+    def getBlobPath(self, key):
+        return os.path.join(self.directory, OBJECTS_DIRECTORY, key[:2],
+                            key[2:])
+
+    def contains(self, key):
+        return os.path.isfile(self.getBlobPath(key))
+
+    def fetch(self, key, destination, *, count=True):
+        """
+        Copies the artifact stored under 'key' to 'destination'. Returns
+        whether it was found
+        """
+        blob_path = self.getBlobPath(key)
+        try:
+            shutil.copyfile(blob_path, destination)
+            # Marks the blob as recently used for the eviction
+            os.utime(blob_path, None)
+        except OSError:
+            if not self.remote or not self.remote.fetch(key, destination):
+                if count:
+                    self.count('misses')
+                return False
+            self.store(key, destination, upload=False)
+
+        if count:
+            self.count('hits')
+        return True
+
+    def store(self, key, source, *, upload=True):
+        """
+        Stores a copy of the file 'source' under 'key'. The copy is written
+        to a temporary file first so that readers never see half an artifact
+        """
+        blob_path = self.getBlobPath(key)
+        blob_directory = os.path.dirname(blob_path)
+        os.makedirs(blob_directory, exist_ok=True)
+
+        handle, temporary = tempfile.mkstemp(dir=blob_directory)
+        os.close(handle)
+        try:
+            shutil.copyfile(source, temporary)
+            os.replace(temporary, blob_path)
+        except OSError:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            return False
+
+        self.count('stores')
+        if upload and self.remote:
+            self.remote.put(key, blob_path)
+        return True
+
+    def getSize(self):
+        return sum(size for _, size, _ in self._listBlobs())
+
+    def _listBlobs(self):
+        blobs = []
+        top = os.path.join(self.directory, OBJECTS_DIRECTORY)
+        for dirpath, _, filenames in os.walk(top):
+            for filename in filenames:
+                blob_path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(blob_path)
+                except OSError:
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, blob_path))
+        return blobs
+
+    def evict(self):
+        """
+        Deletes the least recently used artifacts until the cache is back
+        under its size cap. Returns the number of artifacts deleted
+        """
+        blobs = self._listBlobs()
+        total = sum(size for _, size, _ in blobs)
+        if total <= self.max_size:
+            return 0
+
+        evicted = 0
+        target = self.max_size * EVICTION_TARGET
+        for _, size, blob_path in sorted(blobs):
+            if total <= target:
+                break
+            try:
+                os.remove(blob_path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+
+        self.stats['evictions'] += evicted
+        return evicted
+
+    def getTotalStats(self):
+        """
+        Returns the statistics of every session, including this one
+        """
+        stats_path = os.path.join(self.directory, STATS_FILE_NAME)
+        try:
+            with open(stats_path) as file:
+                total = json.load(file)
+        except (OSError, ValueError):
+            total = {}
+
+        for stat in STAT_NAMES:
+            total[stat] = total.get(stat, 0) + self.stats[stat]
+        return total
+
+    def save(self):
+        """
+        Evicts what is over the cap, and merges this session's statistics into
+        the ones on disk
+        """
+        self.evict()
+        total = self.getTotalStats()
+        with open(os.path.join(self.directory, STATS_FILE_NAME), 'w') as file:
+            json.dump(total, file, indent=1, sort_keys=True)
+        self.stats = dict.fromkeys(STAT_NAMES, 0)
+
+    def formatStats(self):
+        hits, misses = self.stats['hits'], self.stats['misses']
+        lookups = hits + misses
+        rate = 100 * hits / lookups if lookups else 0
+        return "{} hits, {} misses ({:.0f}% hit rate)".format(hits, misses,
+                                                               rate)
+
+
+def _split_command(command, source_extensions):
+    """
+    Splits a command into its flags, its single source file and the file
+    given to '-o'. Returns None if the command doesn't look like that
+    """
+    if '-o' not in command:
+        return None
+
+    output_index = command.index('-o') + 1
+    if output_index >= len(command):
+        return None
+    output = command[output_index]
+
+    flags = []
+    sources = []
+    for index, arg in enumerate(command[1:], 1):
+        if index in (output_index - 1, output_index):
+            continue
+        elif os.path.splitext(arg)[1] in source_extensions and \
+                not arg.startswith('-'):
+            sources.append(arg)
+        else:
+            flags.append(arg)
+
+    if len(sources) != 1:
+        return None
+    return flags, sources[0], output
+
+
+def parse_compile_command(command):
+    """
+    Splits a 'gcc -c' command into its flags, its source file and its output
+    file. Returns None if the command isn't a single-source compile command
+    """
+    if '-c' not in command:
+        return None
+    return _split_command(command, C_SOURCE_EXTENSIONS)
+
+
+def parse_cython_command(command):
+    """
+    Splits a 'cython -o' command into its flags, its source file and its
+    output file. Returns None if the command isn't a single-source cython
+    command
+    """
+    if os.path.basename(command[0]) not in CYTHON_EXECUTABLES:
+        return None
+    return _split_command(command, CYTHON_SOURCE_EXTENSIONS)
+
+
+def has_debug_info(flags):
+    return any(flag.startswith('-g') and flag != '-g0' for flag in flags)
+
+
+def map_debug_prefixes(command, source):
+    """
+    Adds flags to a compile command that map the directory it runs from (and
+    the one of its source, if it is elsewhere) to '.' in the debug
+    information, so that the object doesn't depend on where the tree is
+    checked out. Debuggers then look the sources up from where they run
+    """
+    cwd = os.getcwd()
+    directories = [cwd]
+    directory = os.path.dirname(os.path.abspath(source))
+    if os.path.commonpath([cwd, directory]) != cwd:
+        directories.append(directory)
+    return list(command) + [DEBUG_PREFIX_MAP.format(directory)
+                            for directory in directories]
+
+
+def get_include_dirs(flags):
+    include_dirs = []
+    for index, flag in enumerate(flags):
+        if flag in ('-I', '--include-dir') and index + 1 < len(flags):
+            include_dirs.append(flags[index + 1])
+        elif flag.startswith('-I') and len(flag) > 2:
+            include_dirs.append(flag[2:])
+    return include_dirs
+
+
+class _CommandCache:
+    """
+    What the command wrappers backed by an 'ArtifactCache' have in common
+    """
+    name = None
+    version_flag = None
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.__identities = {}
+        self.__lock = threading.Lock()
+
+    def parse(self, command):
+        raise NotImplementedError
+
+    def wraps(self, command):
+        return self.parse(command) is not None
+
+    def getIdentity(self, executable):
+        """
+        Returns (and remembers) the version output of an executable
+        """
+        with self.__lock:
+            identity = self.__identities.get(executable)
+        if identity is None:
+            identity = call([executable, self.version_flag]).getOutput()
+            with self.__lock:
+                self.__identities[executable] = identity
+        return identity
+
+
+class CompilerCache(_CommandCache):
+    """
+    A wrapper around 'gcc -c' commands that works like ccache. Each object is
+    keyed on the preprocessed translation unit, the flags and the identity of
+    the compiler, and restored from the 'ArtifactCache' on a hit, along with
+    the warnings the compilation printed. On a miss, the command is run by
+    'runner' (like 'distributed.DistributedCompiler') if one is given, which
+    is handed the preprocessed source so that it doesn't preprocess again.
+
+    The directories in the debug information are mapped to '.' (see
+    'map_debug_prefixes'), so that '-g' objects are shared between checkouts
+    too. Headers included through absolute paths into the checkout still
+    keep it in the key
+    """
+    name = 'Object'
+    version_flag = '-v'
+
+    def __init__(self, cache, runner=None):
+        super(CompilerCache, self).__init__(cache)
+        self.runner = runner
+
+    def parse(self, command):
+        return parse_compile_command(command)
+
+    def preprocess(self, compiler, flags, source, output):
+        """
+        Runs the preprocessor, and returns its output, or None if
+        preprocessing failed. If the command writes a depfile, the
+        preprocessor writes it (for 'output') as well, so that it exists even
+        when the object comes out of the cache
+        """
+        flags = [flag for flag in flags if flag != '-c']
+        if get_depfile(flags):
+            flags += ['-MT', output]
+        command = [compiler, '-E'] + flags + [source]
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE)
+        except OSError:
+            return None
+        stdout, _ = process.communicate()
+        if process.returncode:
+            return None
+        return stdout
+
+    def makeKey(self, command, preprocessed):
+        """
+        Returns the key of the object of a compile command, given its
+        preprocessed source. The line markers are hashed, as they end up in
+        the warnings and the debug information; the directory of the source
+        is left out of them, so that the same code in two different
+        directories hashes the same
+        """
+        flags, source, _ = self.parse(command)
+        directory = os.path.dirname(os.path.abspath(source))
+        prefix = ('"' + directory + os.sep).encode()
+        preprocessed = b'\n'.join(line.replace(prefix, b'"', 1)
+                                  if line.startswith(b'# ') else line
+                                  for line in preprocessed.split(b'\n'))
+        digest = hashlib.sha1(preprocessed).hexdigest()
+        return make_key('object', self.getIdentity(command[0]),
+                        strip_depfile_flags(flags), digest)
+
+    def getKey(self, command):
+        flags, source, output = self.parse(command)
+        preprocessed = self.preprocess(command[0], flags, source, output)
+        if preprocessed is None:
+            return None
+        return self.makeKey(command, preprocessed)
+
+    def fetchStderr(self, key):
+        """
+        Returns the warnings stored with the object under 'key', or None
+        """
+        handle, temporary = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            if not self.cache.fetch(key + STDERR_EXTENSION, temporary,
+                                    count=False):
+                return None
+            with open(temporary, errors='replace') as file:
+                return file.read()
+        finally:
+            os.remove(temporary)
+
+    def storeStderr(self, key, stderr):
+        handle, temporary = tempfile.mkstemp()
+        try:
+            with os.fdopen(handle, 'w') as file:
+                file.write(stderr)
+            self.cache.store(key + STDERR_EXTENSION, temporary)
+        finally:
+            os.remove(temporary)
+
+    def call(self, command):
+        """
+        Restores the object (and its warnings) from the cache, or compiles
+        it and stores it
+        """
+        flags, source, output = self.parse(command)
+        preprocessed = self.preprocess(command[0], flags, source, output)
+        key = None
+        if preprocessed is not None:
+            key = self.makeKey(command, preprocessed)
+        if has_debug_info(flags):
+            command = map_debug_prefixes(command, source)
+        if key is not None:
+            if self.cache.fetch(key, output, count=False):
+                stderr = self.fetchStderr(key)
+                if stderr is not None:
+                    self.cache.count('hits')
+                    return Result(stderr=stderr)
+            self.cache.count('misses')
+
+        if self.runner:
+            result = self.runner.call(command, preprocessed=preprocessed)
+        else:
+            result = call(command)
+        if key is not None and not result.returncode:
+            self.cache.store(key, output)
+            self.storeStderr(key, result.stderr)
+        return result
+
+
+class CythonCache(_CommandCache):
+    """
+    A wrapper around 'cython -o' commands. The generated C (and the annotation
+    html, if '-a' is given) is keyed on the contents of the source and of
+    every '.pxd'/'.pxi' it transitively depends on, the module name, the
+    flags and the version of Cython. On a hit, cython is never started. A
+    'DependencyScanner' can be given to reuse its cached scans
+    """
+    name = 'Cython'
+    version_flag = '-V'
+
+    def __init__(self, cache, scanner=None):
+        super(CythonCache, self).__init__(cache)
+        self.scanner = scanner
+
+    def parse(self, command):
+        return parse_cython_command(command)
+
+    def getKey(self, command):
+        flags, source, output = self.parse(command)
+        try:
+            source_hash = hash_file(source)
+        except OSError:
+            return None
+
+        if self.scanner:
+            found = self.scanner.getDependencies(source)
+        else:
+            found = find_dependencies(source, get_include_dirs(flags))
+        try:
+            dependencies = [hash_file(dependency) for dependency in found]
+        except OSError:
+            # A dependency deleted since it was scanned; cython will tell
+            return None
+        return make_key('cython', self.getIdentity(command[0]), flags,
+                        get_module_name(source), os.path.basename(output),
+                        source_hash, dependencies)
+
+    def call(self, command):
+        """
+        Materializes the generated C from the cache, or runs cython and
+        stores what it generated
+        """
+        flags, _, output = self.parse(command)
+        key = self.getKey(command)
+
+        outputs = [(key, output)]
+        if '-a' in flags or '--annotate' in flags:
+            annotation = os.path.splitext(output)[0] + ANNOTATION_EXTENSION
+            outputs.append((key and key + ANNOTATION_EXTENSION, annotation))
+
+        if key is not None:
+            if all(self.cache.fetch(name, file_path, count=False)
+                   for name, file_path in outputs):
+                self.cache.count('hits')
+                return Result()
+            self.cache.count('misses')
+
+        result = call(command)
+        if key is not None and not result.returncode:
+            for name, file_path in outputs:
+                if os.path.isfile(file_path):
+                    self.cache.store(name, file_path)
+        return result
+
+
+def parse_link_command(command):
+    """
+    Splits a 'gcc -shared' command into its flags, its input objects and its
+    output. Returns None if the command isn't one
+    """
+    if '-shared' not in command or '-c' in command or '-o' not in command:
+        return None
+    output_index = command.index('-o') + 1
+    if output_index >= len(command):
+        return None
+
+    flags = []
+    inputs = []
+    for index, arg in enumerate(command[1:], 1):
+        if index in (output_index - 1, output_index):
+            continue
+        elif os.path.splitext(arg)[1] in LINK_INPUT_EXTENSIONS and \
+                not arg.startswith('-'):
+            inputs.append(arg)
+        else:
+            flags.append(arg)
+    if not inputs:
+        return None
+    return flags, inputs, command[output_index]
+
+
+class LinkCache(_CommandCache):
+    """
+    A wrapper around 'gcc -shared' commands, caching the final extension
+    modules. They are keyed on the contents of the objects linked, the flags
+    and the identity of the linker
+    """
+    name = 'Link'
+    version_flag = '-v'
+
+    def parse(self, command):
+        return parse_link_command(command)
+
+    def getKey(self, command):
+        flags, inputs, output = self.parse(command)
+        try:
+            digests = [hash_file(name) for name in inputs]
+        except OSError:
+            return None
+        return make_key('link', self.getIdentity(command[0]), flags,
+                        os.path.splitext(output)[1], digests)
+
+    def call(self, command):
+        """
+        Restores the linked module from the cache, or links it and stores it
+        """
+        _, _, output = self.parse(command)
+        key = self.getKey(command)
+        if key is not None and self.cache.fetch(key, output):
+            return Result()
+
+        result = call(command)
+        if key is not None and not result.returncode:
+            self.cache.store(key, output)
+        return result
@@ -3,10 +3,20 @@ import argparse
 
 from .system import *
 from .arguments import parser
+from .pathway import path
+from .tools import generateBatches
+from .configuration import getDirsToInclude
+from .depfiles import DEPFILE_FLAGS, make_depfile_name
+from .ninja import write_ninja
 
 
 COMMAND_FILENAME = '.cyther'
 
+CYTHON_STAGE = 'cython'
+COMPILE_STAGE = 'compile'
+LINK_STAGE = 'link'
+STAGES = (CYTHON_STAGE, COMPILE_STAGE, LINK_STAGE)
+
 
 class SimpleCommand:
     def __init__(self):
@@ -99,13 +109,13 @@ def processFiles(args):
     for filename in args['filenames']:
         file = dict()
 
-        if args['include']:
-            file['include'] = INCLUDE_STRING + ''.join(
-                ['-I' + item for item in args['include']])
+        if args.get('include'):
+            file['include'] = INCLUDE_OPTIONS + \
+                getDirsToInclude(args['include'])
         else:
-            file['include'] = INCLUDE_STRING
+            file['include'] = INCLUDE_OPTIONS
 
-        file['file_path'] = getPath(filename)
+        file['file_path'] = path(filename)
         file['file_base_name'] = \
         os.path.splitext(os.path.basename(file['file_path']))[0]
         file['no_extension'], file['extension'] = os.path.splitext(
@@ -115,7 +125,10 @@ def processFiles(args):
                 "The file '{}' is not a designated cython file".format(
                     file['file_path']))
         base_path = os.path.dirname(file['file_path'])
-        local_build = args['local']
+        # The C is compiled away from the source, so headers next to the
+        # source (used in 'cdef extern from' blocks) need to be found
+        file['include'] = file['include'] + ['-I' + base_path]
+        local_build = args.get('local')
         if not local_build:
             cache_name = os.path.join(base_path, '__cythercache__')
             os.makedirs(cache_name, exist_ok=True)
@@ -124,8 +137,10 @@ def processFiles(args):
         else:
             file['c_name'] = file['no_extension'] + '.c'
         file['object_file_name'] = os.path.splitext(file['c_name'])[0] + '.o'
-        output_name = args['output_name']
-        if args['watch']:
+        file['dependency_file_name'] = \
+            make_depfile_name(file['object_file_name'])
+        output_name = args.get('output_name')
+        if args.get('watch'):
             file['output_name'] = file['no_extension']+DEFAULT_OUTPUT_EXTENSION
         elif output_name:
             if os.path.exists(output_name) and os.path.isfile(output_name):
@@ -162,7 +177,64 @@ class Commands:
     into commands to execute in order to do what should be accomplished
     """
     def __init__(self):
-        self.__unprocessed = []
+        self.__tasks = {}
+        self.__actions = {}
+        self.__stages = {}
+        self.__givens = set()
+        self.__phony = set()
+
+    def addTask(self, target, commands=None, dependencies=(), givens=(),
+                stage=None, phony=False):
+        """
+        Adds a target to the plan, along with the commands that build it.
+        'dependencies' are other targets of the plan, while 'givens' are
+        files that must already exist (sources). 'stage' names the kind of
+        work the commands do, so that each stage can be limited separately.
+        A 'phony' target isn't a file, and its commands always run
+        """
+        self.__tasks[target] = list(dependencies) + list(givens)
+        self.__givens.update(givens)
+        if commands:
+            self.__actions[target] = commands
+        if stage:
+            self.__stages[target] = stage
+        if phony:
+            self.__phony.add(target)
+
+    def getTasks(self):
+        """
+        Returns a copy of the task graph in the form 'generateBatches' takes
+        """
+        return {task: list(deps) for task, deps in self.__tasks.items()}
+
+    def getGivens(self):
+        return set(self.__givens)
+
+    def getActions(self):
+        return dict(self.__actions)
+
+    def getStages(self):
+        return dict(self.__stages)
+
+    def getPhony(self):
+        return set(self.__phony)
+
+    def extend(self, other):
+        """
+        Adds the tasks of another plan to this one
+        """
+        givens = other.getGivens()
+        actions = other.getActions()
+        stages = other.getStages()
+        phony = other.getPhony()
+        for target, dependencies in other.getTasks().items():
+            self.addTask(target, actions.get(target),
+                         dependencies=[dependency for dependency
+                                       in dependencies
+                                       if dependency not in givens],
+                         givens=[dependency for dependency in dependencies
+                                 if dependency in givens],
+                         stage=stages.get(target), phony=target in phony)
 
     def toFile(self, filename=None):
         if not filename:
@@ -179,6 +251,12 @@ class Commands:
 
         return chars
 
+    def toNinja(self, filename=None):
+        """
+        Writes the plan as a ninja file (see 'ninja.py'), and returns its path
+        """
+        return write_ninja(self, filename)
+
     @staticmethod
     def fromFile(filename=None):
         if not filename:
@@ -195,12 +273,15 @@ class Commands:
 
     def generateCommands(self):
         """
-        Generate a list of lists of commands from the internal manager object
+        Generate a list of lists of commands from the internal manager object,
+        in an order that can be run serially
         """
-        # 1) Sort the commands
-        # 2) Return the commands in the form of a list
-        # 3) This does what makeCommands does right now
-        pass
+        batches = generateBatches(self.getTasks(), self.getGivens())
+        commands = []
+        for batch in batches:
+            for task in sorted(batch):
+                commands.extend(self.__actions.get(task, []))
+        return commands
 
 
 def makeCommands(file):
@@ -211,10 +292,81 @@ def makeCommands(file):
     commands = [['cython', '-a', '-p', '-o',
                  file['c_name'], file['file_path']],
                 ['gcc', '-DNDEBUG', '-g', '-fwrapv', '-O3', '-Wall', '-Wextra',
-                 '-pthread', '-fPIC', '-c', file['include'], '-o',
-                 file['object_file_name'], file['c_name']],
-                ['gcc', '-g', '-Wall', '-Wextra', '-pthread', '-shared',
-                 RUNTIME_STRING, '-o', file['output_name'],
-                 file['object_file_name'], L_OPTION]]
+                 '-pthread', '-fPIC', '-c'] + file['include'] +
+                DEPFILE_FLAGS + [file['dependency_file_name'],
+                                 '-o', file['object_file_name'],
+                                 file['c_name']],
+                ['gcc', '-g', '-Wall', '-Wextra', '-pthread', '-shared'] +
+                RUNTIME_OPTIONS + ['-o', file['output_name'],
+                                   file['object_file_name'], L_OPTION]]
 
     return commands
+
+
+def _dropCycles(graph):
+    """
+    Removes the edges of a graph (node -> list of nodes) that close a cycle,
+    so that mutually cimporting modules don't make the plan unsolvable
+    """
+    visited = set()
+    for root in sorted(graph):
+        if root in visited:
+            continue
+        visited.add(root)
+        on_path = {root}
+        stack = [(root, iter(list(graph[root])))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if child in on_path:
+                    graph[node].remove(child)
+                elif child not in visited:
+                    visited.add(child)
+                    on_path.add(child)
+                    stack.append((child, iter(list(graph[child]))))
+                    break
+            else:
+                stack.pop()
+                on_path.discard(node)
+    return graph
+
+
+def makePlan(files, scanner=None, pch=None):
+    """
+    Constructs a 'Commands' plan out of the processed files. Each file is
+    split into its three stages (cython, compile, link) so that independent
+    stages of different files can run at the same time.
+
+    If a 'DependencyScanner' is given, the '.pxd' and '.pxi' files each
+    source depends on become givens of its cython stage, and the cython stage
+    of a module cimporting another module of the plan runs after it.
+
+    If a 'PrecompiledHeader' is given, the compile stages use it
+    """
+    sources = [file['file_path'] for file in files]
+    c_names = {file['file_path']: file['c_name'] for file in files}
+
+    buildables = {source: [] for source in sources}
+    givens = {source: [] for source in sources}
+    if scanner:
+        for source in sources:
+            buildables[source], givens[source] = \
+                scanner.getBuildDependencies(source, sources)
+        _dropCycles(buildables)
+
+    plan = Commands()
+    for file in files:
+        source = file['file_path']
+        cython_command, compile_command, link_command = makeCommands(file)
+        if pch:
+            compile_command = pch.apply(compile_command, source)
+        plan.addTask(file['c_name'], [cython_command],
+                     dependencies=[c_names[other]
+                                   for other in buildables[source]],
+                     givens=[source] + givens[source], stage=CYTHON_STAGE)
+        plan.addTask(file['object_file_name'], [compile_command],
+                     dependencies=[file['c_name']], stage=COMPILE_STAGE)
+        plan.addTask(file['output_name'], [link_command],
+                     dependencies=[file['object_file_name']],
+                     stage=LINK_STAGE)
+    return plan
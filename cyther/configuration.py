@@ -7,7 +7,7 @@ hold critical data about where different compile-critical directories exist.
 import os
 
 from .pathway import path, USER
-from .searcher import find
+from .searcher import find, Query
 from .extractor import extractMajorMinor
 from .definitions import CONFIG_FILE_NAME, VER, DOT_VER
 
@@ -250,8 +250,15 @@ INCLUDE_PROMPT = "Choose one of the listed include directories above (by " \
                  "entering the number), or enter nothing to exit the process"
 
 
-def _make_include_dirs(*, guided):
-    unfiltered_dirs = find('Python.h', content="Py_PYTHON_H")
+def _find_config_files(*, fresh=False):
+    """
+    Finds the 'Python.h' headers and the runtime libraries in a single search
+    """
+    return find([Query('Python.h', content="Py_PYTHON_H"),
+                 Query(_make_full_runtime())], fresh=fresh)
+
+
+def _make_include_dirs(unfiltered_dirs, *, guided):
     include_dirs = _filter_include_dirs(unfiltered_dirs)
 
     if not include_dirs:
@@ -277,10 +284,9 @@ RUNTIME_DIRS_PROMPT = "Choose one of the listed runtime search directories " \
                       "exit the process"
 
 
-def _make_runtime_dirs(*, guided):
+def _make_runtime_dirs(unfiltered_dirs, *, guided):
     # Dont need to filter on this one
     print("Calculated runtime name: '{}'".format(_make_full_runtime()))
-    unfiltered_dirs = find(_make_full_runtime())
     print("Unfiltered: '{}'".format(unfiltered_dirs))
     runtime_dirs = _filter_runtime_dirs(unfiltered_dirs)
     print("Filtered dirs: '{}'".format(runtime_dirs))
@@ -305,32 +311,36 @@ def _make_runtime():
     return name
 
 
-def make_config_data(*, guided):
+def make_config_data(*, guided, fresh=False):
     """
-    Makes the data necessary to construct a functional config file
+    Makes the data necessary to construct a functional config file. With
+    'fresh', the file index used to search is rescanned first
     """
+    headers, runtimes = _find_config_files(fresh=fresh)
     config_data = {}
-    config_data[INCLUDE_DIRS_KEY] = _make_include_dirs(guided=guided)
-    config_data[RUNTIME_DIRS_KEY] = _make_runtime_dirs(guided=guided)
+    config_data[INCLUDE_DIRS_KEY] = _make_include_dirs(headers, guided=guided)
+    config_data[RUNTIME_DIRS_KEY] = _make_runtime_dirs(runtimes,
+                                                       guided=guided)
     config_data[RUNTIME_KEY] = _make_runtime()
 
     return config_data
 
 
-def make_config_file(guided=False):
+def make_config_file(guided=False, fresh=False):
     """
     Options: --auto, --guided, --manual
     Places for the file: --inplace, --user
     """
     config_path = _make_config_location(guided=guided)
 
-    config_data = make_config_data(guided=guided)
+    config_data = make_config_data(guided=guided, fresh=fresh)
 
     write_config_file(config_path, config_data)
 
 
 # TODO Make errors cascade out to the outside (this is why travis !catching it)
-def generate_configurations(*, guided=False, fresh_start=False, save=False):
+def generate_configurations(*, guided=False, fresh_start=False, save=False,
+                            fresh=False):
     """
     If a config file is found in the standard locations, it will be loaded and
     the config data would be retuned. If not found, then generate the data on
@@ -343,10 +353,10 @@ def generate_configurations(*, guided=False, fresh_start=False, save=False):
     loaded_status, loaded_data = get_config()
     if loaded_status != CONFIG_VALID:
         if save:
-            make_config_file(guided=guided)
+            make_config_file(guided=guided, fresh=fresh)
             status, config_data = get_config()
         else:
-            config_data = make_config_data(guided=guided)
+            config_data = make_config_data(guided=guided, fresh=fresh)
     else:
         config_data = loaded_data
 
@@ -3,8 +3,26 @@
 The heart of Cyther
 """
 
-from .system import INFO
-from .project import purge_project, clean_project
+import os
+import math
+
+from .system import INFO, GCC_INFO, CYTHON_OUTPUT
+from .tools import CytherError
+from .project import purge_project, clean_project, assure_cache
+from .executor import execute, default_jobs, available_memory, \
+    NOT_ENOUGH_STAGE_JOBS
+from .timings import TimingDatabase
+from .database import BuildDatabase
+from .cache import ArtifactCache, CompilerCache, CythonCache, LinkCache, \
+    get_include_dirs
+from .scanner import DependencyScanner, SCANS_FILE_NAME
+from .pch import PrecompiledHeader
+from .ninja import run_ninja
+from .distributed import Worker, DistributedCompiler, TOKEN_ENVIRONMENT
+from .remote import RemoteCache, CacheServer, REMOTE_DIRECTORY, \
+    TOKEN_ENVIRONMENT as CACHE_TOKEN_ENVIRONMENT
+from .pathway import path, USER, ISDIR
+from .definitions import USER_CACHE_NAME
 
 """
 Each function must have the parameter 'args', even if they do not use it.
@@ -18,15 +36,290 @@ def info(**kwargs):
 
 
 def configure(**kwargs):
-    pass
+    from .configuration import generate_configurations
+    generate_configurations(fresh_start=True, save=True,
+                            fresh=kwargs.get('fresh', False))
 
 
 def setup(**kwargs):
     print(kwargs)
 
 
+UNKNOWN_STAGE = "Unknown stage '{}', the stages are: {}"
+
+
+def _check_stage(stage):
+    from .commands import STAGES
+
+    if stage not in STAGES:
+        raise CytherError(UNKNOWN_STAGE.format(stage, ', '.join(STAGES)))
+
+
+STAGE_JOBS_FORMAT = "Stage limits must look like 'STAGE=N', not '{}'"
+
+
+def _parse_stage_jobs(stage_jobs):
+    limits = {}
+    for item in stage_jobs:
+        stage, _, number = item.partition('=')
+        if not stage or not number.isdigit():
+            raise CytherError(STAGE_JOBS_FORMAT.format(item))
+        _check_stage(stage)
+        limits[stage] = int(number)
+        if limits[stage] < 1:
+            raise CytherError(NOT_ENOUGH_STAGE_JOBS.format(stage, number))
+    return limits
+
+
+STAGE_TIMEOUTS_FORMAT = "Stage timeouts must look like 'STAGE=SECONDS', " \
+                        "not '{}'"
+TIMEOUT_FORMAT = "The {} must be a positive number of seconds, not '{}'"
+
+
+def _check_timeout(name, seconds):
+    """
+    Returns 'seconds', unless it isn't a finite positive number; a NaN
+    timeout would never expire
+    """
+    if seconds is not None and not (math.isfinite(seconds) and seconds > 0):
+        raise CytherError(TIMEOUT_FORMAT.format(name, seconds))
+    return seconds
+
+
+def _parse_stage_timeouts(stage_timeouts):
+    timeouts = {}
+    for item in stage_timeouts:
+        stage, _, seconds = item.partition('=')
+        try:
+            timeouts[stage] = float(seconds)
+        except ValueError:
+            raise CytherError(STAGE_TIMEOUTS_FORMAT.format(item))
+        if not stage:
+            raise CytherError(STAGE_TIMEOUTS_FORMAT.format(item))
+        _check_stage(stage)
+        _check_timeout("timeout of stage '{}'".format(stage), timeouts[stage])
+    return timeouts
+
+
+MEMORY_BUDGET_FORMAT = "The memory budget must look like '4G', '512M' or " \
+                       "'auto', not '{}'"
+MEMORY_UNITS = {'': 1, 'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+AUTO_BUDGET = 'auto'
+
+
+def _parse_memory_budget(budget):
+    """
+    Returns the memory budget in bytes; a size like '4G', or 'auto' for the
+    memory available when the build starts
+    """
+    if budget is None:
+        return None
+    if budget.lower() == AUTO_BUDGET:
+        return available_memory()
+
+    string = budget.upper().rstrip('B').rstrip('I')
+    unit = string[-1:] if string[-1:] in MEMORY_UNITS else ''
+    number = string[:len(string) - len(unit)]
+    try:
+        size = float(number) * MEMORY_UNITS[unit]
+    except ValueError:
+        raise CytherError(MEMORY_BUDGET_FORMAT.format(budget))
+    if not math.isfinite(size) or size <= 0:
+        raise CytherError(MEMORY_BUDGET_FORMAT.format(budget))
+    return int(size)
+
+
+UNITY_FORMAT = "The number of unity files must be at least 1, not '{}'"
+
+
+def _check_unity(chunks):
+    """
+    Returns the number of unity files to build the makefile programs in
+    (None if unity builds are off)
+    """
+    if chunks is not None and chunks < 1:
+        raise CytherError(UNITY_FORMAT.format(chunks))
+    return chunks
+
+
+def _make_with_ninja(plan, args):
+    """
+    Leaves the execution of the plan to ninja
+    """
+    filename = plan.toNinja()
+    if not args['concise']:
+        print("Wrote '{}'".format(filename))
+    if args['ninja'] != 'run':
+        return
+
+    result = run_ninja(filename, jobs=args['jobs'])
+    if result.returncode:
+        message = "Ninja failed to build '{}'".format(filename)
+        if args['error']:
+            raise CytherError(message)
+        print(message)
+
+
 def make(**kwargs):
-    pass
+    from .commands import furtherArgsProcessing, processFiles, makePlan
+    from .configuration import getDirsToInclude
+    from .instructions import makeInstructionPlan
+    from .makefile import is_makefile, read_makefile
+
+    args = furtherArgsProcessing(kwargs)
+    makefiles = [name for name in args['filenames'] if is_makefile(name)]
+    args['filenames'] = [name for name in args['filenames']
+                         if name not in makefiles]
+    include_dirs = []
+    if args.get('include'):
+        include_dirs = get_include_dirs(getDirsToInclude(args['include']))
+    scanner = DependencyScanner(include_dirs,
+                                cache_path=os.path.join(assure_cache(),
+                                                        SCANS_FILE_NAME))
+    pch = None if args['no_pch'] else PrecompiledHeader()
+    plan = makePlan(processFiles(args), scanner, pch)
+    # The unity builds wrap the executor, to retry failed unity compiles
+    builds = []
+    unity = _check_unity(args.get('unity'))
+    for makefile in makefiles:
+        makeInstructionPlan(read_makefile(makefile, unity=unity), plan,
+                            builds)
+    if args['ninja']:
+        _make_with_ninja(plan, args)
+        scanner.save()
+        return
+    timings = TimingDatabase()
+    database = BuildDatabase(toolchain=(GCC_INFO, CYTHON_OUTPUT))
+    jobs = args['jobs']
+    distributed = None
+    if args['workers']:
+        distributed = DistributedCompiler(args['workers'],
+                                          token=args.get('worker_token'))
+        if jobs is None:
+            jobs = default_jobs() + distributed.getCapacity()
+
+    remote = None
+    if args['remote_cache'] and not args['no_cache']:
+        remote = RemoteCache(args['remote_cache'], mode=args['remote_mode'],
+                             token=args.get('remote_cache_token'))
+
+    wrappers = list(builds)
+    if not args['no_cache']:
+        wrappers.append(CythonCache(ArtifactCache(remote=remote), scanner))
+        wrappers.append(CompilerCache(ArtifactCache(remote=remote),
+                                      distributed))
+        wrappers.append(LinkCache(ArtifactCache(remote=remote)))
+    elif distributed:
+        wrappers.append(distributed)
+
+    executor = execute(plan, jobs=jobs,
+                       durations=timings.getDurations(), database=database,
+                       wrappers=wrappers,
+                       limits=_parse_stage_jobs(args['stage_jobs']),
+                       memory=timings.getMemory(),
+                       memory_budget=_parse_memory_budget(
+                           args['memory_budget']),
+                       max_load=args['max_load'],
+                       keep_going=args['keep_going'],
+                       timeout=_check_timeout('timeout', args['timeout']),
+                       stage_timeouts=_parse_stage_timeouts(
+                           args['stage_timeouts']),
+                       idle_timeout=_check_timeout('idle timeout',
+                                                   args['idle_timeout']),
+                       retries=args['retries'],
+                       print_commands=not args['concise'])
+    database.save()
+    scanner.save()
+    for build in builds:
+        build.save()
+    timings.recordAll({task: duration for task, duration
+                       in executor.durations.items()
+                       if task not in executor.failed})
+    timings.recordAllMemory(executor.memory)
+    timings.save()
+
+    for wrapper in wrappers:
+        if not hasattr(wrapper, 'cache'):
+            continue
+        if not args['concise']:
+            print("{} cache: {}".format(wrapper.name,
+                                        wrapper.cache.formatStats()))
+        wrapper.cache.save()
+
+    if remote:
+        remote.flush()
+        if not args['concise']:
+            print("Remote cache: {}".format(remote.formatStats()))
+
+    if distributed and not args['concise']:
+        print(distributed.formatStats())
+
+    if pch and pch.built and not args['concise']:
+        print("Precompiled header: {}".format(', '.join(pch.built)))
+
+    if not args['concise']:
+        if executor.durations:
+            print(executor.formatCriticalPath())
+            print(executor.formatStageUtilization())
+            if executor.memory_budget or executor.max_load:
+                print(executor.formatThrottling())
+            if args['stats']:
+                print(executor.formatResources())
+        else:
+            print('Everything is up to date')
+
+    if executor.failed:
+        message = executor.formatSummary()
+        if args['error']:
+            raise CytherError(message)
+        print(message)
+    elif executor.durations and not args['concise']:
+        print('Compilation complete')
+
+
+def worker(**kwargs):
+    """
+    Runs a build worker until interrupted
+    """
+    daemon = Worker(kwargs['listen'], jobs=kwargs['jobs'],
+                    token=kwargs.get('token'))
+    print("Cyther worker listening on {} ({} jobs)".format(
+        daemon.getAddress(), daemon.jobs))
+    if not kwargs.get('token') and not os.environ.get(TOKEN_ENVIRONMENT):
+        print("Worker token (set {} to it for 'cyther make --workers'): "
+              "{}".format(TOKEN_ENVIRONMENT, daemon.token))
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.shutdown()
+
+
+def cache_server(**kwargs):
+    """
+    Runs a remote artifact cache server until interrupted
+    """
+    directory = kwargs['directory']
+    if not directory:
+        directory = os.path.join(path(USER_CACHE_NAME, ISDIR, root=USER),
+                                 REMOTE_DIRECTORY)
+    server = CacheServer(directory, kwargs['listen'],
+                         verbose=kwargs['verbose'], token=kwargs.get('token'))
+    print("Cyther cache server listening on {} ({})".format(server.getURL(),
+                                                            directory))
+    if not kwargs.get('token') and \
+            not os.environ.get(CACHE_TOKEN_ENVIRONMENT):
+        print("Upload token (set {} to it for 'cyther make "
+              "--remote-cache'): {}".format(CACHE_TOKEN_ENVIRONMENT,
+                                            server.token))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.cache.evict()
 
 
 def build(**kwargs):
@@ -0,0 +1,139 @@
+"""
+This module holds the per-project build database. Instead of comparing
+modification times, a target is rebuilt only when the hash of everything that
+went into it (source contents, the full command line, the toolchain and the
+artifacts it was built from) changes
+"""
+
+import os
+import json
+import hashlib
+import threading
+
+from .project import assure_cache
+
+
+DATABASE_FILE_NAME = 'builds.json'
+
+CHUNK_SIZE = 1 << 16
+
+
+def hash_file(file_path):
+    """
+    Returns the hex digest of the contents of the given file
+    """
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_string(string):
+    return hashlib.sha1(string.encode('utf-8')).hexdigest()
+
+
+class BuildDatabase:
+    """
+    Holds the signature of every target built in a project, along with a
+    cache of file hashes keyed on (mtime, size) so that unchanged files are
+    never read twice. 'toolchain' is anything identifying the compilers used
+    (their version output, for example)
+    """
+    def __init__(self, project_path=None, toolchain=()):
+        self.__file_path = os.path.join(assure_cache(project_path),
+                                        DATABASE_FILE_NAME)
+        self.__toolchain = list(toolchain)
+        self.__lock = threading.Lock()
+        self.__targets = {}
+        self.__files = {}
+        self.load()
+
+    def load(self):
+        """
+        Loads the database, starting fresh if it is missing or unreadable
+        """
+        try:
+            with open(self.__file_path) as file:
+                data = json.load(file)
+            self.__targets = data['targets']
+            self.__files = data['files']
+        except (OSError, ValueError, KeyError):
+            self.__targets = {}
+            self.__files = {}
+
+    def save(self):
+        with self.__lock:
+            data = {'targets': self.__targets, 'files': self.__files}
+            with open(self.__file_path, 'w') as file:
+                json.dump(data, file, indent=1, sort_keys=True)
+
+    def getHash(self, file_path):
+        """
+        Returns the hash of a file's contents, or None if it doesn't exist.
+        The file is only read if its mtime or size changed since last time
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+
+        key = [stat.st_mtime_ns, stat.st_size]
+        with self.__lock:
+            entry = self.__files.get(file_path)
+        if entry and entry[:2] == key:
+            return entry[2]
+
+        digest = hash_file(file_path)
+        with self.__lock:
+            self.__files[file_path] = key + [digest]
+        return digest
+
+    def getSignature(self, inputs, commands):
+        """
+        Returns the hash of everything a target is built from
+        """
+        hashed_inputs = [[name, self.getHash(name)] for name in sorted(inputs)]
+        everything = [commands, self.__toolchain, hashed_inputs]
+        return hash_string(json.dumps(everything, sort_keys=True))
+
+    def isOutDated(self, target, inputs, commands):
+        """
+        Returns True if 'target' has to be rebuilt; it is missing, it was
+        changed since it was built, or the signature of its inputs changed.
+        The inputs discovered during the last build (see 'depfiles.py') are
+        part of the signature as well
+        """
+        with self.__lock:
+            entry = self.__targets.get(target)
+        if not entry:
+            return True
+
+        output_hash = self.getHash(target)
+        if output_hash is None or output_hash != entry['output']:
+            return True
+
+        inputs = list(inputs) + entry.get('discovered', [])
+        return self.getSignature(inputs, commands) != entry['signature']
+
+    def getDiscovered(self, target):
+        with self.__lock:
+            entry = self.__targets.get(target, {})
+        return list(entry.get('discovered', []))
+
+    def update(self, target, inputs, commands, discovered=()):
+        """
+        Records that 'target' was just built successfully out of 'inputs' and
+        the 'discovered' inputs, like the headers listed in a depfile
+        """
+        discovered = [name for name in discovered if name not in inputs]
+        signature = self.getSignature(list(inputs) + discovered, commands)
+        output_hash = self.getHash(target)
+        with self.__lock:
+            self.__targets[target] = {'signature': signature,
+                                      'output': output_hash,
+                                      'discovered': discovered}
+
+    def forget(self, target):
+        with self.__lock:
+            self.__targets.pop(target, None)
@@ -2,6 +2,7 @@
 import sys
 
 CACHE_NAME = "__cythercache__"
+USER_CACHE_NAME = '.cythercache'
 CONFIG_FILE_NAME = '.cyther'
 
 MAJOR = str(sys.version_info.major)
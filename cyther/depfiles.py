@@ -0,0 +1,127 @@
+"""
+This module handles the dependency files ('depfiles') that gcc writes with
+'-MMD -MF', which list every header a translation unit included. They let the
+build database know about inputs that no instruction mentions
+"""
+
+import os
+
+
+DEPFILE_EXTENSION = '.d'
+DEPFILE_FLAGS = ['-MMD', '-MF']
+
+# Flags that only affect the depfile, never the object itself
+_DEPFILE_SWITCHES = ('-MD', '-MMD', '-MP')
+_DEPFILE_OPTIONS = ('-MF', '-MT', '-MQ')
+
+
+def make_depfile_name(object_file_name):
+    return os.path.splitext(object_file_name)[0] + DEPFILE_EXTENSION
+
+
+def _split_words(string):
+    """
+    Splits the right hand side of a make rule into words, honoring the
+    backslash escaped spaces gcc writes for paths with spaces in them
+    """
+    words = []
+    current = []
+    index = 0
+    while index < len(string):
+        char = string[index]
+        if char == '\\' and index + 1 < len(string) and \
+                string[index + 1] in ' #':
+            current.append(string[index + 1])
+            index += 1
+        elif char == '$' and string[index + 1:index + 2] == '$':
+            current.append('$')
+            index += 1
+        elif char in ' \t':
+            if current:
+                words.append(''.join(current))
+                current = []
+        else:
+            current.append(char)
+        index += 1
+
+    if current:
+        words.append(''.join(current))
+    return words
+
+
+def parse_depfile_string(string):
+    """
+    Returns the prerequisites listed in the contents of a depfile, in order
+    and without duplicates
+    """
+    string = string.replace('\\\r\n', ' ').replace('\\\n', ' ')
+
+    prerequisites = []
+    for line in string.splitlines():
+        # Splits on the first ':' that isn't part of a windows drive letter
+        index = line.find(': ')
+        if index == -1:
+            if not line.rstrip().endswith(':'):
+                continue
+            index = len(line.rstrip()) - 1
+        for word in _split_words(line[index + 1:]):
+            if word not in prerequisites:
+                prerequisites.append(word)
+    return prerequisites
+
+
+def parse_depfile(file_path):
+    """
+    Returns the prerequisites listed in a depfile, or an empty list if it
+    doesn't exist
+    """
+    try:
+        with open(file_path) as file:
+            string = file.read()
+    except OSError:
+        return []
+    return parse_depfile_string(string)
+
+
+def get_depfile(command):
+    """
+    Returns the depfile a command writes (given with '-MF'), or None
+    """
+    if '-MF' in command:
+        index = command.index('-MF') + 1
+        if index < len(command):
+            return command[index]
+    return None
+
+
+def strip_depfile_flags(flags):
+    """
+    Returns the flags without the ones that only affect the depfile
+    """
+    stripped = []
+    skip = False
+    for flag in flags:
+        if skip:
+            skip = False
+        elif flag in _DEPFILE_OPTIONS:
+            skip = True
+        elif flag not in _DEPFILE_SWITCHES:
+            stripped.append(flag)
+    return stripped
+
+
+def discover_inputs(commands):
+    """
+    Returns the absolute paths of the inputs recorded by the depfiles the
+    given commands wrote (the primary sources included)
+    """
+    discovered = []
+    for command in commands:
+        depfile = get_depfile(command)
+        if not depfile:
+            continue
+        for prerequisite in parse_depfile(depfile):
+            file_path = os.path.normpath(os.path.abspath(prerequisite))
+            if file_path not in discovered:
+                discovered.append(file_path)
+    return discovered
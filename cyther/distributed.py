@@ -0,0 +1,540 @@
+"""
+This module spreads 'gcc -c' commands over build workers. A worker ('cyther
+worker') is a small daemon that compiles preprocessed sources sent over a TCP
+or a Unix socket and sends the objects back. The build machine still does the
+preprocessing, so workers need nothing but a compiler
+"""
+
+import os
+import hmac
+import json
+import secrets
+import shutil
+import time
+import socket
+import struct
+import tempfile
+import threading
+import subprocess
+import socketserver
+import multiprocessing
+
+from .launcher import Result, call
+from .cache import parse_compile_command
+from .depfiles import strip_depfile_flags, get_depfile
+
+
+DEFAULT_PORT = 7845
+DEFAULT_ADDRESS = 'localhost:{}'.format(DEFAULT_PORT)
+UNIX_PREFIX = 'unix:'
+
+# How long to wait on a worker before compiling locally instead, and how long
+# to leave a worker alone after it stopped answering
+DEFAULT_TIMEOUT = 60.0
+RETRY_INTERVAL = 30.0
+
+MAX_HEADER_SIZE = 1 << 20
+CHUNK_SIZE = 1 << 16
+
+ALLOWED_COMPILERS = ('gcc', 'cc', 'g++', 'c++', 'clang', 'clang++')
+
+# Flags that only matter to the preprocessor, with and without an argument
+PREPROCESSOR_OPTIONS = ('-I', '-D', '-U', '-include', '-imacros', '-isystem',
+                        '-iquote', '-idirafter')
+PREPROCESSOR_PREFIXES = ('-I', '-D', '-U')
+
+# A worker only accepts the flags that change the code generated. Anything
+# else could have it read or write files, or run other programs, for whoever
+# sends the job. The rejected prefixes win over the allowed ones
+ALLOWED_FLAGS = ('-pthread', '-w', '-pedantic', '-pedantic-errors')
+# Options whose paths are only rewritten into the output, never opened
+PATH_MAPPING_PREFIXES = ('-fdebug-prefix-map=',)
+ALLOWED_PREFIXES = ('-O', '-g', '-m', '-std=', '-W', '-D', '-U', '-f')
+REJECTED_PREFIXES = ('-Wa,', '-Wl,', '-Wp,', '-Xassembler', '-Xlinker',
+                     '-Xpreprocessor', '-save-temps', '-dumpdir', '-dumpbase',
+                     '-MF', '-MD', '-specs', '--specs', '-B', '@', '-o',
+                     '-wrapper', '-fdump-', '-fprofile', '-fplugin',
+                     '-fopt-info', '-fsave-optimization-record',
+                     '-fauto-profile', '-fcallgraph-info', '-fstack-usage')
+
+# Where the shared secret of workers and their clients comes from when it
+# isn't given
+TOKEN_ENVIRONMENT = 'CYTHER_WORKER_TOKEN'
+
+PREPROCESSED_EXTENSIONS = {'.c': '.i', '.cc': '.ii', '.cpp': '.ii',
+                           '.cxx': '.ii'}
+
+CONNECTION_CLOSED = "The connection was closed in the middle of a message"
+HEADER_TOO_LARGE = "Message header of {} bytes is too large"
+COMPILER_NOT_ALLOWED = "The worker doesn't run the compiler '{}'"
+COMPILER_NOT_FOUND = "The worker doesn't have the compiler '{}'"
+FLAG_NOT_ALLOWED = "The worker doesn't accept the flag '{}'"
+INVALID_TOKEN = "Invalid or missing worker token"
+UNKNOWN_REQUEST = "Unknown request type '{}'"
+NO_UNIX_SOCKETS = "Unix sockets are not available on this platform"
+
+
+def parse_address(address):
+    """
+    Returns the socket family and the address of a worker address, which is
+    either 'host:port' (or just 'host') or 'unix:/path/to/socket'
+    """
+    if address.startswith(UNIX_PREFIX):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise ValueError(NO_UNIX_SOCKETS)
+        return socket.AF_UNIX, address[len(UNIX_PREFIX):]
+    host, _, port = address.rpartition(':')
+    if not host:
+        return socket.AF_INET, (address, DEFAULT_PORT)
+    return socket.AF_INET, (host, int(port))
+
+
+def _receive_exactly(sock, size):
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, CHUNK_SIZE))
+        if not chunk:
+            raise ConnectionError(CONNECTION_CLOSED)
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_message(sock, header, payload=b''):
+    """
+    Sends a message; a json header, preceded by its length, and the payload
+    whose size the header gives
+    """
+    header = dict(header, size=len(payload))
+    data = json.dumps(header).encode('utf-8')
+    sock.sendall(struct.pack('!I', len(data)) + data)
+    if payload:
+        sock.sendall(payload)
+
+
+def receive_message(sock):
+    """
+    Returns the header and the payload of the next message
+    """
+    length, = struct.unpack('!I', _receive_exactly(sock, 4))
+    if length > MAX_HEADER_SIZE:
+        raise ValueError(HEADER_TOO_LARGE.format(length))
+    header = json.loads(_receive_exactly(sock, length).decode('utf-8'))
+    payload = _receive_exactly(sock, header.get('size', 0))
+    return header, payload
+
+
+def request(address, header, payload=b'', *, timeout=DEFAULT_TIMEOUT):
+    """
+    Sends one request to the worker at 'address' and returns its response
+    """
+    family, target = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(target)
+        send_message(sock, header, payload)
+        return receive_message(sock)
+
+
+def is_allowed_flag(flag):
+    """
+    Tells whether a worker accepts a compiler flag (see 'ALLOWED_PREFIXES')
+    """
+    if flag.startswith(REJECTED_PREFIXES):
+        return False
+    if flag in ALLOWED_FLAGS or flag.startswith(PATH_MAPPING_PREFIXES):
+        return True
+    if flag.startswith(('-W', '-f')):
+        # A warning or a code generation option; not one naming a file
+        name, _, value = flag.partition('=')
+        return len(name) > 2 and name[2].isalpha() and ',' not in name \
+            and os.sep not in value and '/' not in value
+    return flag.startswith(ALLOWED_PREFIXES)
+
+
+def get_token(token=None):
+    """
+    Returns the given worker token, or the one of the environment
+    """
+    if token is None:
+        token = os.environ.get(TOKEN_ENVIRONMENT) or None
+    return token
+
+
+def split_compile_flags(flags):
+    """
+    Splits the flags of a compile command into the ones the preprocessor
+    needs and the ones the compiler needs on the preprocessed source
+    """
+    preprocessor = []
+    compiler = []
+    flags = list(flags)
+    index = 0
+    while index < len(flags):
+        flag = flags[index]
+        if flag in PREPROCESSOR_OPTIONS:
+            preprocessor.extend(flags[index:index + 2])
+            index += 2
+            continue
+        if flag.startswith(PREPROCESSOR_PREFIXES):
+            preprocessor.append(flag)
+        else:
+            compiler.append(flag)
+            # Flags like '-std' change what the preprocessor does as well
+            preprocessor.append(flag)
+        index += 1
+    compiler = [flag for flag in strip_depfile_flags(compiler)
+                if flag != '-c']
+    return preprocessor, compiler
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            header, payload = receive_message(self.request)
+        except (OSError, ValueError):
+            return
+        response, data = self.server.worker.handle(header, payload)
+        try:
+            send_message(self.request, response, data)
+        except OSError:
+            pass
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class _UnixServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+        daemon_threads = True
+else:
+    _UnixServer = None
+
+
+class Worker:
+    """
+    The build worker daemon. It compiles at most 'jobs' sources at the same
+    time, and only with the 'compilers' and flags it allows. Port 0 picks a
+    free port (see 'getAddress').
+
+    Only the requests carrying 'token' are served. Without one (given, or
+    from 'TOKEN_ENVIRONMENT'), a random token is made up; clients have to be
+    told about it
+    """
+    def __init__(self, address=DEFAULT_ADDRESS, *, jobs=None,
+                 compilers=ALLOWED_COMPILERS, token=None):
+        if jobs is None:
+            jobs = multiprocessing.cpu_count()
+        token = get_token(token)
+        if token is None:
+            token = secrets.token_hex(16)
+        self.token = token
+        self.jobs = jobs
+        self.compilers = tuple(compilers)
+        self.completed = 0
+        self.__running = 0
+        self.__lock = threading.Lock()
+        self.__slots = threading.BoundedSemaphore(jobs)
+        self.__thread = None
+
+        family, target = parse_address(address)
+        if family == socket.AF_INET:
+            self.server = _TCPServer(target, _Handler)
+        else:
+            if os.path.exists(target):
+                os.remove(target)
+            self.server = _UnixServer(target, _Handler)
+        self.server.worker = self
+
+    def getAddress(self):
+        if self.server.address_family == socket.AF_INET:
+            host, port = self.server.server_address[:2]
+            return '{}:{}'.format(host, port)
+        return UNIX_PREFIX + self.server.server_address
+
+    def getStatus(self):
+        with self.__lock:
+            running = self.__running
+        return {'jobs': self.jobs, 'running': running,
+                'load': running / self.jobs, 'completed': self.completed}
+
+    def serve(self):
+        """
+        Serves until 'shutdown' is called
+        """
+        self.server.serve_forever()
+
+    def start(self):
+        """
+        Serves from a background thread, and returns the worker
+        """
+        self.__thread = threading.Thread(target=self.serve, daemon=True)
+        self.__thread.start()
+        return self
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.server.address_family != socket.AF_INET:
+            try:
+                os.remove(self.server.server_address)
+            except OSError:
+                pass
+
+    def handle(self, header, payload):
+        """
+        Returns the response header and payload to a request
+        """
+        token = header.get('token')
+        if not isinstance(token, str) or \
+                not hmac.compare_digest(token, self.token):
+            return {'error': INVALID_TOKEN}, b''
+        kind = header.get('type')
+        if kind == 'status':
+            return self.getStatus(), b''
+        elif kind == 'compile':
+            return self.compile(header, payload)
+        return {'error': UNKNOWN_REQUEST.format(kind)}, b''
+
+    def _check(self, compiler, flags):
+        if os.path.basename(compiler) not in self.compilers:
+            return COMPILER_NOT_ALLOWED.format(compiler)
+        if not shutil.which(compiler):
+            return COMPILER_NOT_FOUND.format(compiler)
+        for flag in flags:
+            if not isinstance(flag, str) or not is_allowed_flag(flag):
+                return FLAG_NOT_ALLOWED.format(flag)
+        return None
+
+    def compile(self, header, payload):
+        """
+        Compiles a preprocessed source, and returns the object. A request
+        the worker can't serve gets an 'error' instead of a 'returncode'
+        """
+        compiler = header.get('compiler', '')
+        flags = list(header.get('flags', []))
+        error = self._check(compiler, flags)
+        if error:
+            return {'error': error}, b''
+
+        extension = header.get('extension', '.i')
+        if extension not in PREPROCESSED_EXTENSIONS.values():
+            extension = '.i'
+
+        with self.__slots:
+            with self.__lock:
+                self.__running += 1
+            try:
+                with tempfile.TemporaryDirectory() as directory:
+                    source = os.path.join(directory, 'source' + extension)
+                    output = os.path.join(directory, 'source.o')
+                    with open(source, 'wb') as file:
+                        file.write(payload)
+                    result = call([compiler] + flags +
+                                  ['-c', '-o', output, source])
+                    data = b''
+                    if not result.returncode:
+                        with open(output, 'rb') as file:
+                            data = file.read()
+            finally:
+                with self.__lock:
+                    self.__running -= 1
+                    self.completed += 1
+
+        response = self.getStatus()
+        response.update(returncode=result.returncode, stdout=result.stdout,
+                        stderr=result.stderr)
+        return response, data
+
+
+class _WorkerState:
+    def __init__(self, address):
+        self.address = address
+        self.jobs = 0
+        self.load = 0.0
+        self.in_flight = 0
+        self.alive = False
+        self.failed_at = None
+        self.completed = 0
+        self.failures = 0
+        self.busy = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+class DistributedCompiler:
+    """
+    A wrapper for the 'Executor' (and a 'runner' for 'cache.CompilerCache')
+    that sends 'gcc -c' commands to workers. The source is preprocessed
+    locally (writing the depfile, if the command asks for one), and goes to
+    the least loaded worker. If every worker is busy, or the chosen one
+    doesn't answer, the command runs locally. Requests carry the 'token' of
+    the workers (see 'Worker')
+    """
+    name = 'Distributed'
+
+    def __init__(self, addresses, *, timeout=DEFAULT_TIMEOUT, token=None):
+        self.timeout = timeout
+        self.token = get_token(token)
+        self.local = 0
+        self.__lock = threading.Lock()
+        self.__workers = [_WorkerState(address) for address in addresses]
+        for worker in self.__workers:
+            self._register(worker)
+
+    def _register(self, worker):
+        """
+        Asks a worker for its status. Returns whether it answered
+        """
+        try:
+            status, _ = request(worker.address, {'type': 'status',
+                                                 'token': self.token},
+                                timeout=self.timeout)
+            if 'error' in status:
+                raise ValueError(status['error'])
+        except (OSError, ValueError):
+            worker.alive = False
+            worker.failed_at = time.monotonic()
+            return False
+        worker.jobs = max(1, int(status.get('jobs', 1)))
+        worker.load = status.get('load', 0.0)
+        worker.alive = True
+        return True
+
+    def getCapacity(self):
+        """
+        Returns the number of jobs the live workers can take at once
+        """
+        return sum(worker.jobs for worker in self.__workers if worker.alive)
+
+    def wraps(self, command):
+        return parse_compile_command(command) is not None
+
+    def _choose(self):
+        """
+        Reserves and returns the least loaded worker with a free slot, or
+        None if there is none
+        """
+        now = time.monotonic()
+        with self.__lock:
+            candidates = []
+            for worker in self.__workers:
+                if not worker.alive:
+                    if worker.failed_at is None or \
+                            now - worker.failed_at < RETRY_INTERVAL:
+                        continue
+                    worker.failed_at = now
+                    candidates.append((0.0, worker.completed, worker))
+                elif worker.in_flight < worker.jobs:
+                    score = max(worker.in_flight / worker.jobs, worker.load)
+                    candidates.append((score, worker.completed, worker))
+            if not candidates:
+                return None
+            worker = min(candidates, key=lambda item: item[:2])[2]
+            worker.in_flight += 1
+            return worker
+
+    def preprocess(self, command):
+        """
+        Returns the preprocessed source of a compile command (None if it
+        failed) with the flags left for the compiler
+        """
+        flags, source, output = parse_compile_command(command)
+        preprocessor_flags, compiler_flags = split_compile_flags(flags)
+        depfile = get_depfile(flags)
+        preprocessor_flags = strip_depfile_flags(preprocessor_flags)
+        if depfile:
+            preprocessor_flags += ['-MMD', '-MF', depfile, '-MT', output]
+        process = subprocess.Popen([command[0], '-E'] + preprocessor_flags +
+                                   [source], stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        stdout, _ = process.communicate()
+        if process.returncode:
+            return None, compiler_flags
+        return stdout, compiler_flags
+
+    def _send(self, worker, command, preprocessed, flags):
+        _, source, output = parse_compile_command(command)
+        extension = PREPROCESSED_EXTENSIONS.get(
+            os.path.splitext(source)[1], '.i')
+        header = {'type': 'compile', 'compiler': command[0], 'flags': flags,
+                  'extension': extension, 'token': self.token}
+        start = time.perf_counter()
+        response, data = request(worker.address, header, preprocessed,
+                                 timeout=self.timeout)
+        elapsed = time.perf_counter() - start
+        if 'error' in response:
+            raise ValueError(response['error'])
+
+        if not response.get('returncode'):
+            temporary = output + '.part'
+            with open(temporary, 'wb') as file:
+                file.write(data)
+            os.replace(temporary, output)
+
+        with self.__lock:
+            worker.load = response.get('load', worker.load)
+            worker.completed += 1
+            worker.busy += elapsed
+            worker.bytes_sent += len(preprocessed)
+            worker.bytes_received += len(data)
+        return Result(response.get('returncode', 1),
+                      response.get('stdout', ''), response.get('stderr', ''))
+
+    def call(self, command, preprocessed=None):
+        """
+        Compiles on a worker, falling back to a local compile. The source is
+        preprocessed here, unless its 'preprocessed' output (which wrote the
+        depfile, if any) is given
+        """
+        worker = self._choose()
+        if worker is not None:
+            if preprocessed is None:
+                preprocessed, flags = self.preprocess(command)
+            else:
+                flags = split_compile_flags(
+                    parse_compile_command(command)[0])[1]
+            try:
+                if preprocessed is not None:
+                    result = self._send(worker, command, preprocessed, flags)
+                    with self.__lock:
+                        worker.alive = True
+                    return result
+            except (OSError, ValueError):
+                with self.__lock:
+                    worker.alive = False
+                    worker.failed_at = time.monotonic()
+                    worker.failures += 1
+            finally:
+                with self.__lock:
+                    worker.in_flight -= 1
+
+        with self.__lock:
+            self.local += 1
+        return call(command)
+
+    def getStats(self):
+        """
+        Returns, for every worker, its address, the jobs it completed, its
+        throughput (jobs per busy second), the failures and whether it is
+        alive
+        """
+        stats = []
+        with self.__lock:
+            for worker in self.__workers:
+                rate = worker.completed / worker.busy if worker.busy else 0.0
+                stats.append((worker.address, worker.completed, rate,
+                              worker.failures, worker.alive))
+        return stats
+
+    def formatStats(self):
+        lines = ["Workers ({} jobs compiled locally):".format(self.local)]
+        for address, completed, rate, failures, alive in self.getStats():
+            state = '' if alive else ', unreachable'
+            lines.append("\t{}: {} jobs, {:.2f} jobs/s, {} failures{}".format(
+                address, completed, rate, failures, state))
+        return '\n'.join(lines)
@@ -0,0 +1,819 @@
+"""
+This module holds the machinery to execute a graph of tasks (such as the one
+'generateBatches' orders) concurrently. Each task is started as soon as its
+own dependencies are finished, instead of waiting for a whole batch to finish
+"""
+
+import os
+import sys
+import time
+import heapq
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .tools import generateBatches
+from .launcher import Result, ProcessTracker, call, track, set_timeouts
+from .depfiles import discover_inputs
+
+
+NOT_ENOUGH_JOBS = "The number of jobs must be at least 1, not '{}'"
+NOT_ENOUGH_STAGE_JOBS = "The number of jobs of stage '{}' must be at least " \
+                        "1, not '{}'"
+
+NOT_ENOUGH_MEMORY = "The memory budget must be positive, not '{}'"
+NOT_ENOUGH_LOAD = "The maximum load must be positive, not '{}'"
+NOT_ENOUGH_TIME = "The {} must be positive, not '{}'"
+NOT_ENOUGH_RETRIES = "The number of retries can't be negative, not '{}'"
+
+# The estimate used for a task that has never been timed before
+DEFAULT_DURATION = 1.0
+
+# The memory estimate of a task that has never been measured before is a
+# fixed amount, plus an amount proportional to the size of its inputs. A
+# compiler at -O3 needs a lot more memory than the size of the C it compiles
+BASE_MEMORY = 64 * 2 ** 20
+MEMORY_PER_INPUT_BYTE = 64
+
+# How often to check the load average again while it keeps tasks waiting
+LOAD_POLL_INTERVAL = 0.5
+
+# A command killed outright (by the OOM killer, usually) or that ran out of
+# memory is worth running again once the build has freed some. The delay
+# before a retry doubles with each one
+SIGKILL = getattr(signal, 'SIGKILL', 9)
+OUT_OF_MEMORY_MESSAGES = ('Cannot allocate memory', 'out of memory',
+                          'virtual memory exhausted', 'MemoryError')
+RETRY_DELAY = 1.0
+
+# How many tasks a line of the summary names before just counting them
+SUMMARY_NAMES = 5
+
+# How the resources a command used are described; mostly on the CPU, mostly
+# waiting (on the disk or the network), or needing a lot of memory
+CPU_BOUND = 0.8
+WAITING = 0.5
+MEMORY_HEAVY = 2 ** 30
+STATS_TARGETS = 10
+
+RESOURCE_NAMES = ('wall_time', 'user_time', 'system_time')
+
+MEMINFO_PATH = '/proc/meminfo'
+
+
+def default_jobs():
+    """
+    The default size of the worker pool; one job for every core available
+    """
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def available_memory():
+    """
+    Returns how much memory (in bytes) the system can give to new processes
+    without swapping, or None if it can't be told
+    """
+    try:
+        with open(MEMINFO_PATH) as file:
+            for line in file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def load_average():
+    """
+    Returns the load average of the last minute, or None where there is none
+    """
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+
+def _input_size(inputs):
+    size = 0
+    for file_path in inputs:
+        try:
+            size += os.path.getsize(file_path)
+        except OSError:
+            pass
+    return size
+
+
+def describe_resources(wall_time, cpu_time, peak_memory):
+    """
+    Tells what bounded commands that used these resources
+    """
+    labels = []
+    if wall_time and cpu_time is not None:
+        ratio = cpu_time / wall_time
+        if ratio >= CPU_BOUND:
+            labels.append('CPU-bound')
+        elif ratio < WAITING:
+            labels.append('waiting on I/O')
+    if peak_memory and peak_memory >= MEMORY_HEAVY:
+        labels.append('memory-heavy')
+    return ', '.join(labels)
+
+
+def _format_resources(resources):
+    wall_time = resources['wall_time']
+    cpu_time = resources['user_time'] + resources['system_time'] \
+        if resources['user_time'] is not None else None
+    parts = ["{:.2f}s wall".format(wall_time)]
+    if cpu_time is not None:
+        parts.append("{:.2f}s user, {:.2f}s sys".format(
+            resources['user_time'], resources['system_time']))
+        if wall_time:
+            parts.append("{:.0f}% CPU".format(100 * cpu_time / wall_time))
+    if resources['peak_memory']:
+        parts.append("peak {:.0f} MiB".format(
+            resources['peak_memory'] / 2 ** 20))
+    if resources['signals']:
+        parts.append("{} killed by a signal".format(resources['signals']))
+    if resources['timeouts']:
+        parts.append("{} timed out".format(resources['timeouts']))
+    if resources['hung']:
+        parts.append("{} hung".format(resources['hung']))
+    if resources['retries']:
+        parts.append("{} retries".format(resources['retries']))
+    description = describe_resources(wall_time, cpu_time,
+                                     resources['peak_memory'])
+    if description:
+        parts.append(description)
+    return ', '.join(parts)
+
+
+def is_transient_failure(result):
+    """
+    Tells whether a failed command could succeed if it was run again
+    """
+    if not result.returncode or result.timed_out or result.hung:
+        return False
+    if result.signal == SIGKILL:
+        return True
+    stderr = result.stderr
+    return any(message in stderr for message in OUT_OF_MEMORY_MESSAGES)
+
+
+def _copy_tasks(tasks):
+    return {task: list(dependencies) for task, dependencies in tasks.items()}
+
+
+class Executor:
+    """
+    Runs the actions of a task graph on a bounded pool of workers. 'tasks' is
+    the same dictionary of task -> dependencies that 'generateBatches' takes,
+    and 'actions' maps a task to either a list of commands (run one after the
+    other, in the same worker) or a callable that returns a 'Result'. Tasks
+    without an action are considered done as soon as they are ready.
+
+    'durations' holds the expected duration of each task (see 'timings.py').
+    Of the tasks that are ready, the one with the longest remaining path to
+    the final targets is always started first.
+
+    If a 'database' (see 'database.py') is given, tasks whose commands and
+    inputs didn't change since they were last built are not run again. The
+    'phony' tasks aren't files; they always run, and aren't inputs of their
+    dependents.
+
+    'wrappers' are objects with a 'wraps(command)' and a 'call(command)'
+    method (like 'cache.CompilerCache'). The first wrapper that wraps a
+    command gets to run it instead of 'launcher.call'.
+
+    'stages' maps a task to the stage it belongs to (cython, compile, link),
+    and 'limits' maps a stage to the maximum number of its tasks that may run
+    at the same time, on top of the overall 'jobs'.
+
+    'memory' holds the peak memory (in bytes) each task reached the last time
+    it ran. With a 'memory_budget', tasks are only started while the memory
+    expected of the running ones stays within it; the task next in line waits
+    for memory to be freed rather than being overtaken. With a 'max_load', no
+    task is started while the load average is that high. Either way, a task
+    is always started when nothing else is running.
+
+    With 'keep_going', a failure only skips the tasks downstream of it.
+    Otherwise the build stops at the first failure; the commands running are
+    terminated (along with the processes they started) and nothing else is
+    started.
+
+    A command running for longer than 'timeout' seconds (or the one of its
+    stage in 'stage_timeouts') is terminated, along with the processes it
+    started, and so is a command that goes 'idle_timeout' seconds without
+    any output or CPU progress. A command failing in a way that could be
+    transient (see 'is_transient_failure') is run again up to 'retries'
+    times, waiting 'retry_delay' seconds before the first retry and twice as
+    long before each of the next ones
+    """
+    def __init__(self, tasks, givens, actions, *, jobs=None, durations=None,
+                 database=None, wrappers=(), stages=None, limits=None,
+                 phony=(), memory=None, memory_budget=None, max_load=None,
+                 keep_going=True, timeout=None, stage_timeouts=None,
+                 idle_timeout=None, retries=0, retry_delay=RETRY_DELAY,
+                 print_commands=False, print_result=True):
+        givens = set(givens)
+
+        # Raises a helpful error on circular or missing dependencies
+        generateBatches(_copy_tasks(tasks), givens)
+
+        if jobs is None:
+            jobs = default_jobs()
+        elif jobs < 1:
+            raise ValueError(NOT_ENOUGH_JOBS.format(jobs))
+
+        limits = dict(limits or {})
+        for stage, limit in limits.items():
+            if limit < 1:
+                raise ValueError(NOT_ENOUGH_STAGE_JOBS.format(stage, limit))
+
+        if memory_budget is not None and memory_budget <= 0:
+            raise ValueError(NOT_ENOUGH_MEMORY.format(memory_budget))
+        if max_load is not None and max_load <= 0:
+            raise ValueError(NOT_ENOUGH_LOAD.format(max_load))
+
+        stage_timeouts = dict(stage_timeouts or {})
+        named_timeouts = [('timeout', timeout), ('idle timeout', idle_timeout)]
+        named_timeouts += [("timeout of stage '{}'".format(stage), seconds)
+                           for stage, seconds in stage_timeouts.items()]
+        for name, seconds in named_timeouts:
+            if seconds is not None and seconds <= 0:
+                raise ValueError(NOT_ENOUGH_TIME.format(name, seconds))
+        if retries < 0:
+            raise ValueError(NOT_ENOUGH_RETRIES.format(retries))
+
+        self.jobs = jobs
+        self.stages = dict(stages or {})
+        self.limits = limits
+        self.memory_budget = memory_budget
+        self.max_load = max_load
+        self.keep_going = keep_going
+        self.timeout = timeout
+        self.stage_timeouts = stage_timeouts
+        self.idle_timeout = idle_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.print_commands = print_commands
+        self.print_result = print_result
+
+        self.database = database
+        self.wrappers = list(wrappers)
+        self.phony = set(phony)
+
+        self.__actions = actions
+        self.__inputs = {task: [name for name in inputs
+                                if name not in self.phony]
+                         for task, inputs in tasks.items()}
+        self.__dependencies = {}
+        self.__dependents = {task: [] for task in tasks}
+        for task, dependencies in tasks.items():
+            needed = [dep for dep in dependencies if dep not in givens]
+            self.__dependencies[task] = needed
+            for dependency in needed:
+                self.__dependents[dependency].append(task)
+
+        self.__priorities = self._computePriorities(durations or {})
+        self.__memory = dict(memory or {})
+        self.__memory_ratio = self._computeMemoryRatio()
+        self.__estimates = {}
+
+        self.results = {}
+        self.failed = []
+        self.skipped = []
+        self.cancelled = []
+        self.not_started = []
+        self.timed_out = []
+        self.hung = []
+        self.retried = {}
+        self.up_to_date = []
+        self.durations = {}
+        self.memory = {}
+        self.peak_estimate = 0
+        self.memory_waits = 0
+        self.load_waits = 0
+        self.__started = {}
+        self.__finished = {}
+        self.__wall_time = 0.0
+        self.__tracker = ProcessTracker()
+        self.__stopped = threading.Event()
+
+    def getDependents(self, task, *, transitive=False):
+        """
+        Returns the tasks that directly depend on 'task', or every task
+        downstream of it if 'transitive' is specified
+        """
+        if not transitive:
+            return list(self.__dependents[task])
+
+        found = []
+        to_visit = list(self.__dependents[task])
+        while to_visit:
+            dependent = to_visit.pop()
+            if dependent not in found:
+                found.append(dependent)
+                to_visit.extend(self.__dependents[dependent])
+        return found
+
+    def _computePriorities(self, durations):
+        """
+        The priority of a task is the length (in expected seconds) of the
+        longest path from the task to any final target
+        """
+        if durations:
+            default = sum(durations.values()) / len(durations)
+        else:
+            default = DEFAULT_DURATION
+
+        priorities = {}
+        batches = generateBatches(_copy_tasks(self.__dependencies), set())
+        for batch in reversed(batches):
+            for task in batch:
+                downstream = [priorities[dependent]
+                              for dependent in self.__dependents[task]]
+                own = durations.get(task, default) \
+                    if task in self.__actions else 0.0
+                longest = max(downstream) if downstream else 0.0
+                priorities[task] = own + longest
+        return priorities
+
+    def getPriority(self, task):
+        return self.__priorities[task]
+
+    def _computeMemoryRatio(self):
+        """
+        Learns how much memory the measured tasks needed per byte of input,
+        taking the median so that an outlier doesn't skew every estimate
+        """
+        ratios = []
+        for task, peak_memory in self.__memory.items():
+            size = _input_size(self.__inputs.get(task, []))
+            if size:
+                ratios.append(max(peak_memory - BASE_MEMORY, 0) / size)
+        if not ratios:
+            return MEMORY_PER_INPUT_BYTE
+        ratios.sort()
+        return ratios[len(ratios) // 2]
+
+    def estimateMemory(self, task):
+        """
+        Returns the memory (in bytes) the task is expected to need; its last
+        measured peak, or else an estimate from the size of its inputs
+        """
+        if task not in self.__estimates:
+            if not self.__actions.get(task):
+                estimate = 0
+            elif task in self.__memory:
+                estimate = self.__memory[task]
+            else:
+                size = _input_size(self.__inputs[task])
+                estimate = int(BASE_MEMORY + self.__memory_ratio * size)
+            self.__estimates[task] = estimate
+        return self.__estimates[task]
+
+    def _isUpToDate(self, task, action):
+        if not self.database or callable(action) or task in self.phony:
+            return False
+        inputs = self.__inputs[task]
+        return not self.database.isOutDated(task, inputs, action)
+
+    def _call(self, command):
+        for wrapper in self.wrappers:
+            if wrapper.wraps(command):
+                return wrapper.call(command)
+        return call(command)
+
+    def getTimeout(self, task):
+        return self.stage_timeouts.get(self.stages.get(task), self.timeout)
+
+    def _callWithRetries(self, command):
+        response = self._call(command)
+        retries = 0
+        delay = self.retry_delay
+        while retries < self.retries and is_transient_failure(response) \
+                and not self.isCancelled():
+            # Waking up early when the build is cancelled
+            if self.__stopped.wait(delay):
+                break
+            retries += 1
+            delay *= 2
+            response = self._call(command)
+        response.retries = retries
+        return response
+
+    def _runCommands(self, commands):
+        """
+        Runs the commands of a task one after the other, stopping at the
+        first one that fails, and bundles their output
+        """
+        result = Result()
+        for command in commands:
+            response = self._callWithRetries(command)
+            result.extendInformation(response)
+            if response.returncode:
+                result.returncode = response.returncode
+                break
+        return result
+
+    def _runTask(self, task):
+        track(self.__tracker)
+        set_timeouts(self.getTimeout(task), self.idle_timeout)
+        try:
+            return self._timeTask(task)
+        finally:
+            track(None)
+            set_timeouts()
+
+    def _timeTask(self, task):
+        start = time.perf_counter()
+        action = self.__actions.get(task)
+        if not action:
+            result = Result()
+        elif self._isUpToDate(task, action):
+            self.up_to_date.append(task)
+            result = Result()
+        else:
+            self._announce(action)
+            if callable(action):
+                result = action()
+            else:
+                result = self._runCommands(action)
+
+            if self.database and not callable(action) and \
+                    task not in self.phony:
+                if result.returncode:
+                    self.database.forget(task)
+                else:
+                    self.database.update(task, self.__inputs[task], action,
+                                         discover_inputs(action))
+        end = time.perf_counter()
+        return result, start, end
+
+    def _announce(self, action):
+        if self.print_commands and not callable(action):
+            for command in action:
+                print(' '.join(command).strip())
+
+    def _report(self, task, result):
+        if self.print_result and result.getOutput().strip():
+            stream = sys.stderr if result.returncode else sys.stdout
+            print(result.getOutput(), file=stream)
+
+    def _skipDownstream(self, task):
+        for dependent in self.getDependents(task, transitive=True):
+            if dependent not in self.results:
+                self.results[dependent] = None
+                self.skipped.append(dependent)
+
+    def cancel(self):
+        """
+        Stops the build; terminates the commands running and starts nothing
+        else. Returns the number of commands terminated
+        """
+        self.__stopped.set()
+        return self.__tracker.cancel()
+
+    def isCancelled(self):
+        return self.__tracker.cancelled
+
+    def formatSummary(self):
+        """
+        Returns a string describing what failed, and what was cancelled or
+        skipped because of it ('' if everything was built)
+        """
+        def names(tasks):
+            listed = ', '.join(tasks[:SUMMARY_NAMES])
+            if len(tasks) > SUMMARY_NAMES:
+                listed += " and {} more".format(len(tasks) - SUMMARY_NAMES)
+            return listed
+
+        lines = []
+        if self.failed:
+            lines.append("Failed to build: " + names(self.failed))
+        if self.timed_out:
+            lines.append("Timed out: " + names(self.timed_out))
+        if self.hung:
+            lines.append("Hung: " + names(self.hung))
+        if self.cancelled:
+            lines.append("Cancelled while running: " +
+                         names(self.cancelled))
+        if self.skipped:
+            lines.append("Skipped, depending on a failure: " +
+                         names(self.skipped))
+        if self.not_started:
+            lines.append("Not started: " + names(self.not_started))
+        return '\n'.join(lines)
+
+    def _pushReady(self, ready, task):
+        heapq.heappush(ready, (-self.__priorities[task], task))
+
+    def _hasCapacity(self, task, running_stages):
+        stage = self.stages.get(task)
+        limit = self.limits.get(stage)
+        return limit is None or running_stages.get(stage, 0) < limit
+
+    def _fitsMemory(self, task, running_memory, running_count):
+        if self.memory_budget is None or not running_count:
+            return True
+        return running_memory + self.estimateMemory(task) <= \
+            self.memory_budget
+
+    def _isOverloaded(self, running_count):
+        if self.max_load is None or not running_count:
+            return False
+        load = load_average()
+        return load is not None and load >= self.max_load
+
+    def _selectReady(self, ready, running_stages, running_memory=0,
+                     running_count=0):
+        """
+        Chooses the next task to launch out of the ready ones; the one with
+        the longest path ahead of it whose stage isn't at its limit. Returns
+        None if no ready task can be started yet
+        """
+        deferred = []
+        selected = None
+        while ready:
+            item = heapq.heappop(ready)
+            if not self._hasCapacity(item[1], running_stages):
+                deferred.append(item)
+            elif not self._fitsMemory(item[1], running_memory,
+                                      running_count):
+                # Letting smaller tasks overtake it could starve it forever
+                self.memory_waits += 1
+                deferred.append(item)
+                break
+            else:
+                selected = item[1]
+                break
+
+        for item in deferred:
+            heapq.heappush(ready, item)
+        return selected
+
+    def getStageUtilization(self):
+        """
+        Returns, for every stage of the last run, a tuple of (number of tasks
+        run, busy seconds, utilization). The utilization is the busy time
+        over the time the stage's slots were available during the build
+        """
+        utilization = {}
+        for task, duration in self.durations.items():
+            stage = self.stages.get(task)
+            count, busy, _ = utilization.get(stage, (0, 0.0, 0.0))
+            utilization[stage] = (count + 1, busy + duration, 0.0)
+
+        for stage, (count, busy, _) in utilization.items():
+            slots = min(self.limits.get(stage, self.jobs), self.jobs)
+            available = slots * self.__wall_time
+            ratio = busy / available if available else 0.0
+            utilization[stage] = (count, busy, ratio)
+        return utilization
+
+    def formatStageUtilization(self):
+        """
+        Returns a string describing the utilization of each stage
+        """
+        lines = ["Stage utilization ({:.2f}s):".format(self.__wall_time)]
+        utilization = self.getStageUtilization()
+        for stage in sorted(utilization, key=str):
+            count, busy, ratio = utilization[stage]
+            limit = self.limits.get(stage, self.jobs)
+            lines.append("\t{}: {} tasks, {:.2f}s busy, {:.0f}% of {} "
+                         "slot(s)".format(stage or 'other', count, busy,
+                                          100 * ratio, min(limit, self.jobs)))
+        return '\n'.join(lines)
+
+    def formatThrottling(self):
+        """
+        Returns a string describing how the memory budget and the load
+        average held the build back
+        """
+        parts = []
+        if self.memory_budget is not None:
+            parts.append("expected peak of {:.0f} MiB out of {:.0f} MiB, "
+                         "waited {} time(s) for memory".format(
+                             self.peak_estimate / 2 ** 20,
+                             self.memory_budget / 2 ** 20,
+                             self.memory_waits))
+        if self.max_load is not None:
+            parts.append("waited {} time(s) for the load to drop below "
+                         "{}".format(self.load_waits, self.max_load))
+        return "Throttling: " + '; '.join(parts)
+
+    def getResources(self, *, by_stage=True):
+        """
+        Returns the resources the commands run used, summed up per stage (or
+        per target); a dictionary of dictionaries with the number of 'tasks',
+        their 'wall_time', 'user_time', 'system_time' (None if unknown), the
+        largest 'peak_memory', how many 'signals' ended a command, how many
+        'timeouts' and 'hung' commands were terminated, and the 'retries'
+        """
+        resources = {}
+        for task in self.durations:
+            result = self.results.get(task)
+            if result is None or result.wall_time is None:
+                continue
+            key = self.stages.get(task) if by_stage else task
+            entry = resources.setdefault(key, {
+                'tasks': 0, 'wall_time': 0.0, 'user_time': None,
+                'system_time': None, 'peak_memory': None, 'signals': 0,
+                'timeouts': 0, 'hung': 0, 'retries': 0})
+            entry['tasks'] += 1
+            for name in RESOURCE_NAMES:
+                value = getattr(result, name)
+                if value is not None:
+                    entry[name] = (entry[name] or 0.0) + value
+            if result.peak_memory is not None:
+                entry['peak_memory'] = max(entry['peak_memory'] or 0,
+                                           result.peak_memory)
+            if result.signal is not None:
+                entry['signals'] += 1
+            entry['timeouts'] += result.timed_out
+            entry['hung'] += result.hung
+            entry['retries'] += result.retries
+        return resources
+
+    def formatResources(self):
+        """
+        Returns a string describing the resources used per stage, and by the
+        targets that took the longest
+        """
+        lines = ["Resources by stage:"]
+        by_stage = self.getResources()
+        for stage in sorted(by_stage, key=str):
+            lines.append("\t{}: {} tasks, {}".format(
+                stage or 'other', by_stage[stage]['tasks'],
+                _format_resources(by_stage[stage])))
+
+        by_target = self.getResources(by_stage=False)
+        slowest = sorted(by_target, key=lambda task:
+                         by_target[task]['wall_time'], reverse=True)
+        lines.append("Resources by target (slowest first):")
+        for task in slowest[:STATS_TARGETS]:
+            lines.append("\t{}  {}".format(_format_resources(by_target[task]),
+                                            task))
+        if len(slowest) > STATS_TARGETS:
+            lines.append("\t... and {} more".format(
+                len(slowest) - STATS_TARGETS))
+        return '\n'.join(lines)
+
+    def getCriticalPath(self):
+        """
+        Returns the chain of tasks that bounded the latency of the last run,
+        by following, from the last task to finish, the dependency that
+        finished the latest
+        """
+        if not self.__finished:
+            return []
+
+        task = max(self.__finished, key=self.__finished.get)
+        path = [task]
+        while True:
+            finished = [dep for dep in self.__dependencies[task]
+                        if dep in self.__finished]
+            if not finished:
+                break
+            task = max(finished, key=self.__finished.get)
+            path.append(task)
+        path.reverse()
+        return path
+
+    def formatCriticalPath(self):
+        """
+        Returns a string describing the critical path of the last run
+        """
+        path = self.getCriticalPath()
+        if not path:
+            return "Critical path: (nothing was run)"
+
+        total = self.__finished[path[-1]] - self.__started[path[0]]
+        lines = ["Critical path ({:.2f}s):".format(total)]
+        for task in path:
+            duration = self.__finished[task] - self.__started[task]
+            lines.append("\t{:.2f}s  {}".format(duration, task))
+        return '\n'.join(lines)
+
+    def run(self):
+        """
+        Executes every task, respecting the dependencies, and returns a
+        dictionary of task -> 'Result' (None if the task was skipped because
+        something it depends on failed)
+        """
+        waiting_on = {task: len(dependencies)
+                      for task, dependencies in self.__dependencies.items()}
+        ready = []
+        for task, count in waiting_on.items():
+            if not count:
+                self._pushReady(ready, task)
+
+        build_start = time.perf_counter()
+        try:
+            self._run(ready, waiting_on)
+        finally:
+            self.__wall_time = time.perf_counter() - build_start
+        return self.results
+
+    def _run(self, ready, waiting_on):
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            try:
+                self._schedule(pool, ready, waiting_on)
+            except KeyboardInterrupt:
+                # Otherwise the pool would wait for the commands to finish
+                self.cancel()
+                raise
+
+        for task in self.__dependencies:
+            if task not in self.results:
+                self.results[task] = None
+                self.not_started.append(task)
+
+    def _schedule(self, pool, ready, waiting_on):
+        """
+        Launches the ready tasks as capacity allows, until the ones launched
+        are all done
+        """
+        running_stages = {}
+        running_memory = 0
+        running = {}
+        while ready or running:
+            if self.isCancelled():
+                ready = []
+            overloaded = False
+            while ready and len(running) < self.jobs:
+                if self._isOverloaded(len(running)):
+                    self.load_waits += 1
+                    overloaded = True
+                    break
+                task = self._selectReady(ready, running_stages,
+                                         running_memory, len(running))
+                if task is None:
+                    break
+                stage = self.stages.get(task)
+                running_stages[stage] = running_stages.get(stage, 0) + 1
+                running_memory += self.estimateMemory(task)
+                self.peak_estimate = max(self.peak_estimate,
+                                         running_memory)
+                running[pool.submit(self._runTask, task)] = task
+
+            # The load average has to be polled, nothing signals it
+            timeout = LOAD_POLL_INTERVAL if overloaded else None
+            done, _ = wait(running, timeout=timeout,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                running_stages[self.stages.get(task)] -= 1
+                running_memory -= self.estimateMemory(task)
+                result, start, end = future.result()
+                self.results[task] = result
+                self.__started[task] = start
+                self.__finished[task] = end
+                if result.retries:
+                    self.retried[task] = result.retries
+                if result.returncode and self.isCancelled():
+                    self.cancelled.append(task)
+                    continue
+
+                if self.__actions.get(task) and \
+                        task not in self.up_to_date:
+                    self.durations[task] = end - start
+                    if result.peak_memory:
+                        self.memory[task] = result.peak_memory
+                self._report(task, result)
+
+                if result.returncode:
+                    self.failed.append(task)
+                    if result.timed_out:
+                        self.timed_out.append(task)
+                    if result.hung:
+                        self.hung.append(task)
+                    self._skipDownstream(task)
+                    if not self.keep_going:
+                        self.cancel()
+                    continue
+
+                for dependent in self.__dependents[task]:
+                    waiting_on[dependent] -= 1
+                    if not waiting_on[dependent] and \
+                            dependent not in self.results:
+                        self._pushReady(ready, dependent)
+
+
+def execute(plan, **kwargs):
+    """
+    Executes a 'Commands' plan concurrently. Takes the same keyword arguments
+    as 'Executor'
+    """
+    executor = Executor(plan.getTasks(), plan.getGivens(), plan.getActions(),
+                        stages=plan.getStages(), phony=plan.getPhony(),
+                        **kwargs)
+    executor.run()
+    return executor
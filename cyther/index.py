@@ -0,0 +1,251 @@
+"""
+This module keeps a persistent index of the file names found in each
+directory, in the user's artifact cache, so that 'searcher.find' doesn't have
+to walk a whole drive every time. Like 'locate', the saved index is trusted
+until it gets old; it is then refreshed incrementally, by a pool of threads
+(see 'walker.parallel_walk'). Only the directories whose modification time
+changed are listed again, the others cost a 'stat'
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+
+from .pathway import path, USER, ISDIR
+from .definitions import USER_CACHE_NAME
+from .walker import parallel_walk, _scan
+
+
+INDEX_FILE_NAME = 'index.json'
+INDEX_VERSION = 1
+
+# The names of the files of a directory are kept as a single string, between
+# separators that can't be part of a name; searching it takes a single
+# substring test, and loading it a single string
+NAME_SEPARATOR = '/'
+
+# A root refreshed longer ago than this (in seconds) is refreshed again
+# before being searched
+MAX_AGE = 60 * 60
+
+# A directory modified this recently (in nanoseconds) could be modified again
+# without its timestamp changing, so it isn't trusted on the next refresh
+MTIME_GRANULARITY = 10 ** 9
+
+# Virtual file systems whose contents change all the time, and hold nothing
+# a build needs
+PRUNED_PATHS = ('/proc', '/sys', '/dev', '/run') if os.name != 'nt' else ()
+
+
+def _is_under(directory, root):
+    if directory == root:
+        return True
+    return directory.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def _is_pruned(directory):
+    return any(_is_under(directory, pruned) for pruned in PRUNED_PATHS)
+
+
+def _list_directory(directory):
+    """
+    Returns the names of the files of a directory (joined, see
+    'NAME_SEPARATOR'), and of the directories to descend into; like
+    'walker.walk', symbolic links to directories are listed but not followed
+    """
+    listing = _scan(directory, False, None)
+    if listing is None:
+        return NAME_SEPARATOR, []
+    dirnames, filenames, links = listing
+    files = NAME_SEPARATOR.join(filenames)
+    return NAME_SEPARATOR + files + NAME_SEPARATOR, \
+        [name for name in dirnames if name not in links]
+
+
+class FileIndex:
+    """
+    Maps every directory under the roots indexed to its modification time,
+    the names of its files and its subdirectories, in a file inside of the
+    user's artifact cache
+    """
+    def __init__(self, file_path=None, *, max_age=MAX_AGE):
+        if not file_path:
+            file_path = os.path.join(path(USER_CACHE_NAME, ISDIR, root=USER),
+                                     INDEX_FILE_NAME)
+        self.file_path = file_path
+        self.max_age = max_age
+        self.stats = {'listed': 0, 'reused': 0}
+        self.__roots = {}
+        self.__directories = {}
+        self.__lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """
+        Loads the index, starting fresh if the file is missing, unreadable
+        or from another version
+        """
+        try:
+            with open(self.file_path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            data = {}
+        if data.get('version') != INDEX_VERSION:
+            data = {}
+        self.__roots = data.get('roots', {})
+        self.__directories = data.get('directories', {})
+
+    def save(self):
+        data = {'version': INDEX_VERSION, 'roots': self.__roots,
+                'directories': self.__directories}
+        directory = os.path.dirname(self.file_path)
+        os.makedirs(directory, exist_ok=True)
+        # Another build could be reading it at the same time
+        handle, temporary = tempfile.mkstemp(dir=directory)
+        with os.fdopen(handle, 'w') as file:
+            json.dump(data, file)
+        os.replace(temporary, self.file_path)
+
+    def getRoots(self):
+        return dict(self.__roots)
+
+    def isIndexed(self, root):
+        """
+        Tells whether 'root' is under a root indexed
+        """
+        root = os.path.realpath(root)
+        return any(_is_under(root, indexed) for indexed in self.__roots)
+
+    def isFresh(self, root):
+        """
+        Tells whether 'root' is under a root refreshed less than 'max_age'
+        seconds ago, and can be searched as is
+        """
+        root = os.path.realpath(root)
+        now = time.time()
+        return any(_is_under(root, indexed) and now - when < self.max_age
+                   for indexed, when in self.__roots.items())
+
+    def refresh(self, root, *, rescan=False, workers=None):
+        """
+        Brings the index of 'root' up to date, with 'workers' threads. Only
+        the directories whose modification time changed are listed again,
+        unless 'rescan' is specified. Returns whether anything changed
+        """
+        # Indexed by the directories themselves, not the links to them
+        root = os.path.realpath(root)
+        recent = time.time_ns() - MTIME_GRANULARITY
+        directories = self.__directories
+        refreshed = {}
+        listed = []
+        lock = threading.Lock()
+
+        def scan(directory):
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                return None
+            entry = directories.get(directory)
+            stat = 'reused'
+            if rescan or entry is None or entry[0] != mtime:
+                files, subdirectories = _list_directory(directory)
+                entry = [mtime if mtime < recent else None, files,
+                         subdirectories]
+                stat = 'listed'
+            with lock:
+                refreshed[directory] = entry
+                self.stats[stat] += 1
+                if stat == 'listed':
+                    listed.append(directory)
+            return list(entry[2]), [], ()
+
+        def prune(directory, dirnames):
+            dirnames[:] = [name for name in dirnames if not
+                           _is_pruned(os.path.join(directory, name))]
+
+        for _ in parallel_walk(root, workers=workers, prune=prune,
+                               scan=scan):
+            pass
+
+        changed = bool(listed)
+        # Whatever wasn't reached anymore was removed
+        for directory in list(directories):
+            if directory not in refreshed and _is_under(directory, root):
+                del directories[directory]
+                changed = True
+        directories.update(refreshed)
+
+        for indexed in list(self.__roots):
+            if indexed != root and _is_under(indexed, root):
+                del self.__roots[indexed]
+        self.__roots[root] = time.time()
+        return changed
+
+    def update(self, roots, *, rescan=False, workers=None):
+        """
+        Refreshes the 'roots' that aren't fresh (all of them with 'rescan';
+        see 'refresh'), and saves the index if any was
+        """
+        with self.__lock:
+            refreshed = False
+            for root in roots:
+                if rescan or not self.isFresh(root):
+                    self.refresh(root, rescan=rescan, workers=workers)
+                    refreshed = True
+            if refreshed:
+                self.save()
+
+    def getDirectories(self, roots=None):
+        """
+        Returns the (directory, files) of the directories indexed under
+        'roots' (all of them by default), sorted by directory. 'files' is
+        meant for 'getNames'. The directories under a root reached through a
+        symbolic link are spelled through the link
+        """
+        if roots is None:
+            return sorted((directory, files) for directory, (_, files, _)
+                          in self.__directories.items())
+        directories = {}
+        for root in roots:
+            root = os.path.abspath(root)
+            real = os.path.realpath(root)
+            for directory, (_, files, _) in self.__directories.items():
+                if not _is_under(directory, real):
+                    continue
+                if real != root:
+                    directory = os.path.normpath(os.path.join(
+                        root, os.path.relpath(directory, real)))
+                directories[directory] = files
+        return sorted(directories.items())
+
+    @staticmethod
+    def getNames(files, names):
+        """
+        Returns which of 'names' are in the 'files' of a directory
+        """
+        return {name for name in names
+                if NAME_SEPARATOR + name + NAME_SEPARATOR in files}
+
+    def lookup(self, name, roots=None):
+        """
+        Returns the directories holding a file called 'name', under 'roots'
+        if specified
+        """
+        return [directory for directory, files
+                in self.getDirectories(roots)
+                if self.getNames(files, (name,))]
+
+
+_index = None
+
+
+def get_index():
+    """
+    Returns the 'FileIndex' of the user, loaded once per process
+    """
+    global _index
+    if _index is None:
+        _index = FileIndex()
+    return _index
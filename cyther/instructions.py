@@ -5,8 +5,13 @@ process basic instructions, whether they originate from an api usage or from
 the terminal. This is where both functionalities merge. Serious error checking.
 """
 
+import os
+
 from .pathway import File
 from .parser import parseString
+from .cache import C_SOURCE_EXTENSIONS
+from .unity import UnityBuild
+from .commands import Commands
 
 
 INCORRECT_INSTRUCTION_INIT = "Instruction doesn't accept arguments " \
@@ -35,6 +40,16 @@ class Instruction:
         self.output_format = None
         self.build_directory = None
 
+        # The number of unity files to compile C targets in, None if off,
+        # and the keyword arguments of its 'UnityBuild'
+        self.unity_chunks = None
+        self.unity_options = {}
+
+        # Commands building the output directly (from a makefile, say), and
+        # whether the output is a name rather than a file
+        self.commands = []
+        self.phony = False
+
         if init:
             if isinstance(init, str):
                 ret = parseString(init)
@@ -81,6 +96,47 @@ class Instruction:
         # The build directory
         return
 
+    def scanDependencies(self, scanner, instructions=()):
+        """
+        Fills the dependencies by scanning the input with a
+        'DependencyScanner'. The '.pxd' and '.pxi' files it depends on are
+        given dependencies, and the inputs of the other 'instructions' whose
+        '.pxd' it cimports are buildable dependencies
+        """
+        source = str(self.input)
+        sources = [str(instruction.input) for instruction in instructions]
+        buildables, givens = scanner.getBuildDependencies(source, sources)
+        self.setBuildableDependencies(buildables)
+        self.setGivenDependencies(givens)
+
+    def setUnity(self, chunks=1, **options):
+        """
+        Opts into a unity build (see 'unity.py') for a target made of several
+        C files, concatenated into 'chunks' unity files. None turns it off.
+        'options' are keyword arguments of 'UnityBuild' (like the compiler
+        and its flags)
+        """
+        self.unity_chunks = chunks
+        self.unity_options = options
+
+    def makeUnityBuild(self, **kwargs):
+        """
+        Returns the 'UnityBuild' of this instruction, out of its input and
+        the C files among its buildable dependencies. Takes the same keyword
+        arguments as 'UnityBuild', over the ones given to 'setUnity'
+        """
+        sources = [str(self.input)]
+        for dependency in self.buildable_dependencies:
+            if os.path.splitext(str(dependency))[1] in C_SOURCE_EXTENSIONS:
+                sources.append(str(dependency))
+        options = dict(self.unity_options, **kwargs)
+        return UnityBuild(sources, str(self.output),
+                          chunks=self.unity_chunks or 1,
+                          build_directory=self.build_directory, **options)
+
+    def setCommands(self, commands):
+        self.commands = commands
+
     def setBuildableDependencies(self, dependencies):
         self.buildable_dependencies = dependencies
 
@@ -97,6 +153,31 @@ class Instruction:
         self.output = File(output_name, **kwargs)
 
 
+def makeInstructionPlan(instructions, plan=None, builds=None):
+    """
+    Adds instructions that carry their own commands (see 'makefile.py') to
+    a 'Commands' plan, a new one if None, and returns it. The instructions
+    in unity mode add the plan of their 'UnityBuild' instead; the builds are
+    appended to 'builds', as they have to wrap the 'Executor' running the
+    plan (and be saved after it)
+    """
+    if plan is None:
+        plan = Commands()
+    for instruction in instructions:
+        if instruction.unity_chunks:
+            build = instruction.makeUnityBuild()
+            plan.extend(build.getPlan())
+            if builds is not None:
+                builds.append(build)
+            continue
+        plan.addTask(str(instruction.output), instruction.commands,
+                     dependencies=[str(dependency) for dependency
+                                   in instruction.buildable_dependencies],
+                     givens=[str(dependency) for dependency
+                             in instruction.given_dependencies],
+                     phony=instruction.phony)
+    return plan
+
 
 class InstructionManager:
     def parseInstruction(self, instruction):
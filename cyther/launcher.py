@@ -4,9 +4,23 @@ This module contains definitions for launching sets of commands into a
 subprocess and handling its output correctly and efficiently
 """
 
+import os
+import time
+import queue
+import atexit
+import codecs
+import shutil
+import signal
+import asyncio
+import hashlib
+import tempfile
+import functools
+import itertools
 import subprocess
+import collections
 import traceback
 import sys
+import threading
 import multiprocessing
 
 from .extractor import extract, extractVersion
@@ -14,15 +28,193 @@ from .extractor import extract, extractVersion
 import dill
 
 
+# 'ru_maxrss' is in kilobytes, except on macOS where it is in bytes
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+# How long a cancelled process tree gets to exit before it is killed
+KILL_GRACE = 2.0
+
+READ_SIZE = 1 << 16
+
+# How often to check whether a process whose outputs are closed has exited
+REAP_INTERVAL = 0.001
+MAX_REAP_INTERVAL = 0.05
+
+TIMED_OUT = "\nTimed out after {} seconds"
+HUNG = "\nNo output or CPU progress for {} seconds, assumed to hang"
+
+# How often the watchdog checks on a command, at most
+WATCHDOG_INTERVAL = 1.0
+
+PROC_PATH = '/proc'
+
+# How much of an output is kept in memory, half from its start and half from
+# its end. The middle goes to a temporary file
+DEFAULT_OUTPUT_CAP = 8 * 2 ** 20
+OMITTED = "\n[... {} bytes of output omitted ...]\n"
+
+SEPARATOR = '\r\n'
+
+# How many functions the workers of a 'WorkerPool' keep unpickled
+MAX_CACHED_FUNCTIONS = 32
+
+
+class OutputBuffer:
+    """
+    Holds the output of a process as the chunks of bytes it was read in. Past
+    'cap' bytes (None for no cap), only the first and last halves of it are
+    kept in memory and the rest is spilled to a temporary file. It is only
+    decoded when its text is asked for
+    """
+    def __init__(self, encoding='utf-8', cap=DEFAULT_OUTPUT_CAP):
+        self.encoding = encoding
+        self.cap = cap
+        self.size = 0
+        self.omitted = 0
+        self.__head = []
+        self.__head_size = 0
+        self.__tail = collections.deque()
+        self.__tail_size = 0
+        self.__spill = None
+        self.__text = None
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return bool(self.size)
+
+    def write(self, data):
+        if not data:
+            return
+        self.size += len(data)
+        self.__text = None
+        if self.cap is None:
+            self.__head.append(data)
+            return
+
+        room = self.cap // 2 - self.__head_size
+        if room > 0:
+            self.__head.append(data[:room])
+            self.__head_size += len(data[:room])
+            data = data[room:]
+            if not data:
+                return
+
+        self.__tail.append(data)
+        self.__tail_size += len(data)
+        excess = self.__tail_size - (self.cap - self.cap // 2)
+        while excess > 0:
+            chunk = self.__tail.popleft()
+            if len(chunk) > excess:
+                self.__tail.appendleft(chunk[excess:])
+                chunk = chunk[:excess]
+            self._spill(chunk)
+            self.__tail_size -= len(chunk)
+            excess -= len(chunk)
+
+    def _spill(self, chunk):
+        if self.__spill is None:
+            self.__spill = tempfile.TemporaryFile()
+        self.__spill.write(chunk)
+        self.omitted += len(chunk)
+
+    def iterChunks(self):
+        """
+        Yields every byte of the output, the spilled ones included
+        """
+        yield from self.__head
+        if self.__spill is not None:
+            self.__spill.seek(0)
+            for chunk in iter(lambda: self.__spill.read(READ_SIZE), b''):
+                yield chunk
+            self.__spill.seek(0, os.SEEK_END)
+        yield from self.__tail
+
+    def getText(self):
+        """
+        Returns the decoded output, with a note in place of what was spilled
+        """
+        if self.__text is None:
+            text = b''.join(self.__head).decode(self.encoding, 'replace')
+            if self.omitted:
+                text += OMITTED.format(self.omitted)
+            self.__text = text + b''.join(self.__tail).decode(self.encoding,
+                                                              'replace')
+        return self.__text
+
+    def __str__(self):
+        return self.getText()
+
+
+def _join_output(parts):
+    """
+    Joins the pieces of an aggregated output; strings, 'OutputBuffer's and
+    the pieces of other results, each one after a separator when not empty
+    """
+    pieces = []
+    for index, part in enumerate(parts):
+        if isinstance(part, tuple):
+            part = _join_output(part)
+        elif not isinstance(part, str):
+            part = part.getText()
+        if index and part:
+            pieces.append(SEPARATOR)
+        pieces.append(part)
+    return ''.join(pieces)
+
+
 class Result:
     """
     A class to hold the results of a command call. Holds stderr and stdout
-    Contains useful functions to process them
+    Contains useful functions to process them. 'timed_out' tells whether the
+    process was terminated for taking too long.
+
+    'hung' tells whether the watchdog terminated it for making no progress,
+    and 'retries' how many times it was run again after a transient failure.
+
+    The resources it used are kept as well, each None when it couldn't be
+    measured: 'wall_time', 'user_time' and 'system_time' (in seconds),
+    'peak_memory' (its peak resident memory, in bytes) and 'signal' (the
+    number of the signal that ended it).
+
+    The outputs can be strings or 'OutputBuffer's, and are only decoded and
+    joined together when they are read
     """
-    def __init__(self, returncode=0, stdout='', stderr=''):
+    def __init__(self, returncode=0, stdout='', stderr='', peak_memory=None):
         self.returncode = returncode
         self.stdout = stdout
         self.stderr = stderr
+        self.peak_memory = peak_memory
+        self.wall_time = None
+        self.user_time = None
+        self.system_time = None
+        self.signal = None
+        self.timed_out = False
+        self.hung = False
+        self.retries = 0
+
+    @property
+    def stdout(self):
+        if self.__stdout_text is None:
+            self.__stdout_text = _join_output(self.__stdout)
+        return self.__stdout_text
+
+    @stdout.setter
+    def stdout(self, stdout):
+        self.__stdout = [stdout or '']
+        self.__stdout_text = None
+
+    @property
+    def stderr(self):
+        if self.__stderr_text is None:
+            self.__stderr_text = _join_output(self.__stderr)
+        return self.__stderr_text
+
+    @stderr.setter
+    def stderr(self, stderr):
+        self.__stderr = [stderr or '']
+        self.__stderr_text = None
 
     def __str__(self):
         return self.getOutput()
@@ -51,6 +243,36 @@ class Result:
         """
         return self.stderr
 
+    def getParts(self, name):
+        """
+        Returns the pieces the output 'name' (stdout or stderr) is made of
+        """
+        return list(self.__stdout if name == 'stdout' else self.__stderr)
+
+    def writeOutput(self, file):
+        """
+        Writes the whole output of every command to a binary file, what was
+        spilled to disk included. Strings are written out as utf-8
+        """
+        def write(parts, first):
+            for part in parts:
+                if isinstance(part, tuple):
+                    first = write(part, first)
+                    continue
+                if isinstance(part, str):
+                    chunks = [part.encode('utf-8')] if part else []
+                else:
+                    chunks = part.iterChunks() if part else []
+                for index, chunk in enumerate(chunks):
+                    if not index and not first:
+                        file.write(SEPARATOR.encode('utf-8'))
+                    file.write(chunk)
+                    first = False
+            return first
+
+        write(self.__stdout, True)
+        write(self.__stderr, True)
+
     def getOutput(self):
         """
         Returns the combined output of stdout and stderr
@@ -64,12 +286,159 @@ class Result:
     def extendInformation(self, response):
         """
         This extends the objects stdout and stderr by
-        'response's stdout and stderr
+        'response's stdout and stderr. Only references to them are kept, so
+        long chains of results don't copy their outputs over and over
+        """
+        self.__stdout.append(tuple(response.getParts('stdout')))
+        self.__stdout_text = None
+        self.__stderr.append(tuple(response.getParts('stderr')))
+        self.__stderr_text = None
+        if response.peak_memory is not None:
+            self.peak_memory = max(self.peak_memory or 0,
+                                   response.peak_memory)
+        for name in ('wall_time', 'user_time', 'system_time'):
+            value = getattr(response, name)
+            if value is not None:
+                setattr(self, name, (getattr(self, name) or 0.0) + value)
+        if response.signal is not None:
+            self.signal = response.signal
+        self.timed_out = self.timed_out or response.timed_out
+        self.hung = self.hung or response.hung
+        self.retries += response.retries
+
+    def getCPUTime(self):
+        """
+        Returns the user and system CPU time used, or None if unknown
+        """
+        if self.user_time is None:
+            return None
+        return self.user_time + (self.system_time or 0.0)
+
+
+def _group_options():
+    """
+    The options that start a process in a group of its own, so that it can
+    be terminated along with its own children (gcc's cc1, as, ...)
+    """
+    if os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+
+def _signal_tree(process, kill):
+    if process.returncode is not None:
+        return
+    try:
+        if os.name == 'nt':
+            command = ['taskkill', '/T', '/PID', str(process.pid)]
+            if kill:
+                command.insert(1, '/F')
+            subprocess.call(command, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(process.pid, signal.SIGKILL if kill else signal.SIGTERM)
+    except OSError:
+        pass
+
+
+def terminate_tree(process, grace=KILL_GRACE):
+    """
+    Terminates a process started in a group of its own and everything it
+    started, and kills them if they are still around after 'grace' seconds
+    """
+    _signal_tree(process, False)
+    timer = threading.Timer(grace, _signal_tree, (process, True))
+    timer.daemon = True
+    timer.start()
+
+
+class ProcessTracker:
+    """
+    Keeps track of the processes launched by 'call' from the threads that
+    track them (see 'track'), so that they can all be cancelled at once. Once
+    cancelled, processes started afterwards are terminated right away
+    """
+    def __init__(self):
+        self.cancelled = False
+        self.__lock = threading.Lock()
+        self.__processes = set()
+
+    def add(self, process):
+        with self.__lock:
+            self.__processes.add(process)
+            cancelled = self.cancelled
+        if cancelled:
+            terminate_tree(process)
+
+    def discard(self, process):
+        with self.__lock:
+            self.__processes.discard(process)
+
+    def cancel(self):
+        """
+        Terminates every process running, and returns how many there were
         """
-        if response.stdout:
-            self.stdout += '\r\n' + response.stdout
-        if response.stderr:
-            self.stderr += '\r\n' + response.stderr
+        with self.__lock:
+            self.cancelled = True
+            processes = list(self.__processes)
+        for process in processes:
+            terminate_tree(process)
+        return len(processes)
+
+
+# Per thread; the 'ProcessTracker' of 'track', and the event loop of 'call'
+_tracking = threading.local()
+
+
+def get_tracker():
+    return getattr(_tracking, 'tracker', None)
+
+
+def track(tracker):
+    """
+    Has the processes that 'call' launches from the current thread be tracked
+    by 'tracker' (None to stop tracking them)
+    """
+    _tracking.tracker = tracker
+
+
+def get_timeouts():
+    return getattr(_tracking, 'timeouts', (None, None))
+
+
+def set_timeouts(timeout=None, idle_timeout=None):
+    """
+    Sets the 'timeout' and 'idle_timeout' (see 'call_async') that the calls
+    made from the current thread use when they aren't given their own
+    """
+    _tracking.timeouts = (timeout, idle_timeout)
+
+
+def group_cpu_time(group):
+    """
+    Returns the CPU time (in seconds) used so far by the processes of a
+    process group, the children they reaped included. Returns None where
+    '/proc' can't tell
+    """
+    try:
+        ticks = os.sysconf('SC_CLK_TCK')
+        names = os.listdir(PROC_PATH)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+    total = 0
+    for name in names:
+        if not name.isdigit():
+            continue
+        try:
+            with open(os.path.join(PROC_PATH, name, 'stat')) as file:
+                # The name of the command can hold spaces and parentheses
+                fields = file.read().rpartition(')')[2].split()
+        except OSError:
+            continue
+        if len(fields) > 14 and int(fields[2]) == group:
+            total += sum(int(field) for field in fields[11:15])
+    return total / ticks
 
 
 def _get_encodings():
@@ -86,27 +455,13 @@ def _print_commands(*several_commands):
         print(' '.join(commands).strip())
 
 
-def _extract_output(process, print_result, raise_exception):
-    stdout_bytes, stderr_bytes = process.communicate()
-    stdout_encoding, stderr_encoding = _get_encodings()
-    stdout = stdout_bytes.decode(stdout_encoding)
-    stderr = stderr_bytes.decode(stderr_encoding)
-    result = Result(process.returncode, stdout, stderr)
-
-    if print_result and not raise_exception:
-        if stdout:
-            print(stdout, file=sys.stdout)
-        if stderr:
-            print(stderr, file=sys.stderr)
-    return result
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
 
 
-# TODO An option to raise a Exception as well? Is that useful?
-def call(commands, *, print_result=False, raise_exception=False,
-         print_commands=False):
-    """
-    Will call a set of commands and wrangle the output how you choose
-    """
+def _check_commands(commands):
     if isinstance(commands, str):
         commands = commands.split()
 
@@ -114,13 +469,197 @@ def call(commands, *, print_result=False, raise_exception=False,
             isinstance(commands, list)):
         raise ValueError("Function 'call' does not accept a 'commands'"
                          "argument of type '{}'".format(type(commands)))
+    return commands
+
+
+class _LineDecoder:
+    """
+    Decodes the output of a process as it arrives, keeping multi-byte
+    characters split between two reads intact, and hands every complete line
+    (without its line ending) to 'callback'
+    """
+    def __init__(self, encoding, callback):
+        self.__decoder = codecs.getincrementaldecoder(encoding)('replace')
+        self.__callback = callback
+        self.__partial = ''
+
+    def feed(self, data, final=False):
+        text = self.__decoder.decode(data, final)
+        if not text:
+            return
+
+        lines = (self.__partial + text).split('\n')
+        self.__partial = lines.pop()
+        for line in lines:
+            self.__callback(line[:-1] if line.endswith('\r') else line)
+
+    def close(self):
+        self.feed(b'', final=True)
+        if self.__partial:
+            self.__callback(self.__partial)
+            self.__partial = ''
+
+
+async def _pump(reader, buffer, callback):
+    """
+    Reads an output into an 'OutputBuffer', only decoding it as it arrives
+    when there's a callback for its lines
+    """
+    decoder = _LineDecoder(buffer.encoding, callback) if callback else None
+    while True:
+        data = await reader.read(READ_SIZE)
+        if not data:
+            break
+        buffer.write(data)
+        if decoder:
+            decoder.feed(data)
+    if decoder:
+        decoder.close()
+
 
+async def _spawn(commands, options):
+    """
+    Starts a process with its outputs read by the running event loop.
+    Returns the process and the 'StreamReader's of its stdout and stderr
+    """
+    if not hasattr(os, 'wait4'):
+        process = await asyncio.create_subprocess_exec(
+            *commands, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            **options)
+        return process, process.stdout, process.stderr
+
+    # Started by hand, so that asyncio doesn't reap it without 'os.wait4'
+    loop = asyncio.get_event_loop()
+    process = subprocess.Popen(commands, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, **options)
+    readers = []
+    for pipe in (process.stdout, process.stderr):
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        readers.append(reader)
+    return process, readers[0], readers[1]
+
+
+async def _wait_exit(pid):
+    """
+    Waits for a process to exit without reaping it, where a pidfd can tell
+    when it did. Elsewhere '_reap' polls
+    """
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return
+
+    loop = asyncio.get_event_loop()
+    exited = loop.create_future()
+    loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+
+
+async def _reap(process):
+    """
+    Waits for a process to exit, and returns its resource usage when
+    'os.wait4' can tell it; it also covers the processes it waited for, like
+    gcc's cc1. The outputs are closed by then, so the wait is short
+    """
+    if not hasattr(os, 'wait4'):
+        await process.wait()
+        return None
+
+    await _wait_exit(process.pid)
+    delay = REAP_INTERVAL
+    while True:
+        try:
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        except ChildProcessError:
+            if process.returncode is None:
+                process.returncode = 1
+            return None
+        if pid:
+            process.returncode = _exit_code(status)
+            return usage
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, MAX_REAP_INTERVAL)
+
+
+async def _supervise(task, process, buffers, timeout, idle_timeout):
+    """
+    Waits for 'task' (the reading and reaping of 'process') to be done. The
+    process is terminated when it runs for longer than 'timeout', or when it
+    goes 'idle_timeout' seconds without writing anything or using the CPU.
+    Where the CPU time can't be measured, a silent process could just be
+    busy, so it is only ever terminated for its timeout. Returns the message
+    to add to its stderr when it was terminated
+    """
+    start = last_progress = time.perf_counter()
+    last_output = 0
+    last_cpu = None
+    while True:
+        delays = []
+        if timeout is not None:
+            delays.append(max(start + timeout - time.perf_counter(), 0))
+        if idle_timeout is not None:
+            delays.append(min(WATCHDOG_INTERVAL, idle_timeout / 2))
+        done, _ = await asyncio.wait([task], timeout=min(delays)
+                                     if delays else None)
+        if done:
+            return None
+
+        now = time.perf_counter()
+        if timeout is not None and now - start >= timeout:
+            terminate_tree(process)
+            return TIMED_OUT.format(timeout)
+
+        output = sum(len(buffer) for buffer in buffers)
+        cpu = group_cpu_time(process.pid)
+        if cpu is None:
+            idle_timeout = None
+            continue
+        if output != last_output or cpu != last_cpu:
+            last_progress = now
+            last_output = output
+            last_cpu = cpu
+        elif now - last_progress >= idle_timeout:
+            terminate_tree(process)
+            return HUNG.format(idle_timeout)
+
+
+async def call_async(commands, *, on_stdout=None, on_stderr=None,
+                     timeout=None, idle_timeout=None,
+                     output_cap=DEFAULT_OUTPUT_CAP, print_result=False,
+                     raise_exception=False, print_commands=False):
+    """
+    The coroutine behind 'call'. Runs a command without blocking the event
+    loop, handing each line of its stdout and stderr to 'on_stdout' and
+    'on_stderr' as soon as it is written. Each output keeps 'output_cap'
+    bytes in memory at most (see 'OutputBuffer').
+
+    After 'timeout' seconds the command is terminated, along with the
+    processes it started, and the 'Result' has 'timed_out' set. Likewise, a
+    watchdog terminates it when it goes 'idle_timeout' seconds without any
+    output or CPU progress, and the 'Result' has 'hung' set. Both default to
+    the ones of the thread (see 'set_timeouts')
+    """
+    commands = _check_commands(commands)
     if raise_exception:
         print_result = False
+    default_timeout, default_idle_timeout = get_timeouts()
+    if timeout is None:
+        timeout = default_timeout
+    if idle_timeout is None:
+        idle_timeout = default_idle_timeout
+    tracker = get_tracker()
+    grouped = tracker is not None or timeout is not None or \
+        idle_timeout is not None
+    start = time.perf_counter()
     try:
-        process = subprocess.Popen(commands,
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
+        process, stdout, stderr = await _spawn(
+            commands, _group_options() if grouped else {})
         if print_commands:
             _print_commands(commands)
 
@@ -132,7 +671,51 @@ def call(commands, *, print_result=False, raise_exception=False,
             print(output, file=sys.stderr)
 
     else:
-        result = _extract_output(process, print_result, raise_exception)
+        if tracker:
+            tracker.add(process)
+        stdout_encoding, stderr_encoding = _get_encodings()
+        stdout_buffer = OutputBuffer(stdout_encoding, output_cap)
+        stderr_buffer = OutputBuffer(stderr_encoding, output_cap)
+
+        async def communicate():
+            await asyncio.gather(_pump(stdout, stdout_buffer, on_stdout),
+                                 _pump(stderr, stderr_buffer, on_stderr))
+            return await _reap(process)
+
+        task = asyncio.ensure_future(communicate())
+        try:
+            message = await _supervise(task, process,
+                                       (stdout_buffer, stderr_buffer),
+                                       timeout, idle_timeout)
+            usage = await task
+        except asyncio.CancelledError:
+            if grouped:
+                terminate_tree(process)
+            elif process.returncode is None:
+                process.kill()
+            raise
+        finally:
+            if tracker:
+                tracker.discard(process)
+
+        if message:
+            stderr_buffer.write(message.encode(stderr_encoding))
+        result = Result(process.returncode, stdout_buffer, stderr_buffer)
+        result.timed_out = message == TIMED_OUT.format(timeout)
+        result.hung = message == HUNG.format(idle_timeout)
+        result.wall_time = time.perf_counter() - start
+        if usage is not None:
+            result.peak_memory = usage.ru_maxrss * RSS_UNIT
+            result.user_time = usage.ru_utime
+            result.system_time = usage.ru_stime
+        if process.returncode < 0:
+            result.signal = -process.returncode
+
+        if print_result and not raise_exception:
+            if result.stdout:
+                print(result.stdout, file=sys.stdout)
+            if result.stderr:
+                print(result.stderr, file=sys.stderr)
 
     if raise_exception and (result.returncode == 1):
         message = "An error occurred in an external process:\n\n{}"
@@ -140,26 +723,120 @@ def call(commands, *, print_result=False, raise_exception=False,
     return result
 
 
-# TODO Should I pass on the argument 'raise_exception' to call?
-# TODO This can be done with '**kwargs'
-def multiCall(*commands, dependent=True, bundle=False,
-              print_result=False, print_commands=False):
+async def gather_calls(several_commands, *, jobs=None, on_stdout=None,
+                       on_stderr=None, **kwargs):
+    """
+    Runs several commands concurrently from the running event loop, at most
+    'jobs' at a time, and returns their 'Result's in order. The callbacks
+    get the index of the command along with each line. Takes the same
+    keyword arguments as 'call_async' ('timeout' applies to each command)
+    """
+    semaphore = asyncio.Semaphore(jobs) if jobs else None
+
+    def bind(callback, index):
+        return functools.partial(callback, index) if callback else None
+
+    async def run(index, commands):
+        coroutine = call_async(commands, on_stdout=bind(on_stdout, index),
+                               on_stderr=bind(on_stderr, index), **kwargs)
+        if not semaphore:
+            return await coroutine
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*[run(index, commands) for index, commands
+                                  in enumerate(several_commands)])
+
+
+def _get_loop():
+    """
+    Returns the event loop 'call' uses from the current thread, kept around
+    so that every call doesn't pay for setting one up
+    """
+    loop = getattr(_tracking, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _tracking.loop = loop
+    return loop
+
+
+def _run_coroutine(coroutine):
+    """
+    Runs a coroutine to completion on the event loop of the thread. From a
+    thread that already runs an event loop, it is run from another thread
+    instead
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        outcome = {}
+
+        def run():
+            try:
+                outcome['result'] = _run_coroutine(coroutine)
+            except BaseException as error:
+                outcome['error'] = error
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome['result']
+
+    return _get_loop().run_until_complete(coroutine)
+
+
+# TODO An option to raise a Exception as well? Is that useful?
+def call(commands, *, print_result=False, raise_exception=False,
+         print_commands=False, timeout=None, idle_timeout=None,
+         output_cap=DEFAULT_OUTPUT_CAP):
     """
-    Calls the function 'call' multiple times, given sets of commands
+    Will call a set of commands and wrangle the output how you choose
     """
+    commands = _check_commands(commands)
+    return _run_coroutine(call_async(commands, timeout=timeout,
+                                     idle_timeout=idle_timeout,
+                                     output_cap=output_cap,
+                                     print_result=print_result,
+                                     raise_exception=raise_exception,
+                                     print_commands=print_commands))
+
+
+async def _multi_call(commands, dependent, print_result, print_commands,
+                      timeout, idle_timeout):
     results = []
     dependent_failed = False
 
     for command in commands:
         if not dependent_failed:
-            response = call(command, print_result=print_result,
-                            print_commands=print_commands)
+            response = await call_async(command, timeout=timeout,
+                                        idle_timeout=idle_timeout,
+                                        print_result=print_result,
+                                        print_commands=print_commands)
             # TODO Will an error ever return a code other than '1'?
             if (response.returncode == 1) and dependent:
                 dependent_failed = True
         else:
             response = None
         results.append(response)
+    return results
+
+
+# TODO Should I pass on the argument 'raise_exception' to call?
+# TODO This can be done with '**kwargs'
+def multiCall(*commands, dependent=True, bundle=False,
+              print_result=False, print_commands=False, timeout=None,
+              idle_timeout=None):
+    """
+    Calls the function 'call' multiple times, given sets of commands. Each
+    command gets its own 'timeout' and 'idle_timeout' (see 'call_async')
+    """
+    results = _run_coroutine(_multi_call(commands, dependent, print_result,
+                                         print_commands, timeout,
+                                         idle_timeout))
 
     if bundle:
         result = Result()
@@ -177,25 +854,192 @@ def multiCall(*commands, dependent=True, bundle=False,
     return processed_response
 
 
-def _run_pickled(pickled):
-    function, item = dill.loads(pickled)
-    return function(item)
+# The functions the worker processes already unpickled, by digest
+_functions = collections.OrderedDict()
+
+# Where a worker process finds the functions it wasn't given yet
+_functions_directory = None
+
+
+def _init_worker(directory):
+    global _functions_directory
+    _functions_directory = directory
+
+
+def _run_chunk(key, pickled_items):
+    """
+    Runs in a worker process; applies the function to a chunk of (index,
+    item) pairs. Only the digest of the function comes with the chunk; the
+    worker loads the function from the directory of the pool the first time
+    it sees it
+    """
+    function = _functions.get(key)
+    if function is None:
+        with open(os.path.join(_functions_directory, key), 'rb') as file:
+            function = dill.load(file)
+        _functions[key] = function
+        while len(_functions) > MAX_CACHED_FUNCTIONS:
+            _functions.popitem(last=False)
+    return [(index, function(item)) for index, item
+            in dill.loads(pickled_items)]
+
+
+class WorkerPool:
+    """
+    A long-lived pool of 'workers' processes (one per core by default) that
+    can be shared by many calls. Functions and items are pickled with dill,
+    so lambdas and closures work; a function is pickled once per call and
+    unpickled once per worker.
+
+    The chunks of items only carry the digest of the function. The function
+    itself is written once to a directory the workers are given when they
+    start ('function_writes' counts the writes), and each worker reads it
+    from there the first time. The processes are started on first use
+    """
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.function_writes = 0
+        self.__pool = None
+        self.__directory = None
+        self.__lock = threading.Lock()
+
+    def _getPool(self):
+        with self.__lock:
+            if self.__pool is None:
+                self.__directory = tempfile.mkdtemp(prefix='cyther-pool-')
+                self.__pool = multiprocessing.Pool(
+                    self.workers, initializer=_init_worker,
+                    initargs=(self.__directory,))
+            return self.__pool, self.__directory
+
+    def _register(self, directory, key, pickled_function):
+        """
+        Makes the function available to the workers, unless it already is
+        """
+        file_path = os.path.join(directory, key)
+        if os.path.exists(file_path):
+            return
+        # Workers never see half a function
+        handle, temporary = tempfile.mkstemp(dir=directory)
+        with os.fdopen(handle, 'wb') as file:
+            file.write(pickled_function)
+        os.replace(temporary, file_path)
+        with self.__lock:
+            self.function_writes += 1
+
+    def _imap(self, function, iterable, chunksize, max_pending):
+        """
+        Yields (index, result) pairs as chunks complete. At most
+        'max_pending' chunks are given to the workers at once; the rest of
+        'iterable' is only consumed as they complete
+        """
+        pool, directory = self._getPool()
+        pickled_function = dill.dumps(function)
+        key = hashlib.sha1(pickled_function).hexdigest()
+        self._register(directory, key, pickled_function)
+        if max_pending is None:
+            max_pending = 2 * (self.workers or _cpu_count())
+
+        completed = queue.Queue()
+        items = enumerate(iterable)
+        pending = 0
+        exhausted = False
+        while True:
+            while not exhausted and pending < max_pending:
+                chunk = list(itertools.islice(items, chunksize))
+                if not chunk:
+                    exhausted = True
+                    break
+                pool.apply_async(_run_chunk, (key, dill.dumps(chunk)),
+                                 callback=completed.put,
+                                 error_callback=completed.put)
+                pending += 1
+            if not pending:
+                return
+
+            outcome = completed.get()
+            pending -= 1
+            if isinstance(outcome, BaseException):
+                raise outcome
+            yield from outcome
+
+    def imap_unordered(self, function, iterable, *, chunksize=1,
+                       max_pending=None):
+        """
+        Yields the results of 'function' over 'iterable' in the order they
+        complete
+        """
+        for _, result in self._imap(function, iterable, chunksize,
+                                    max_pending):
+            yield result
+
+    def map(self, function, iterable, *, chunksize=None):
+        """
+        Returns the results of 'function' over 'iterable', in order
+        """
+        items = list(iterable)
+        if chunksize is None:
+            # Like 'multiprocessing.Pool.map', about four chunks per worker
+            workers = self.workers or _cpu_count()
+            chunksize = max(1, -(-len(items) // (4 * workers)))
+        results = [None] * len(items)
+        for index, result in self._imap(function, items, chunksize, None):
+            results[index] = result
+        return results
+
+    def close(self):
+        """
+        Lets the workers finish what they were given and stops them
+        """
+        with self.__lock:
+            pool, self.__pool = self.__pool, None
+            directory, self.__directory = self.__directory, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def get_pool(workers=None):
+    """
+    Returns the shared 'WorkerPool' with that many workers, creating it the
+    first time. The shared pools are closed when the interpreter exits
+    """
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            if not _pools:
+                atexit.register(close_pools)
+            pool = _pools[workers] = WorkerPool(workers)
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
 
 
 def distribute(function, iterable, *, workers=4):
     """
     A version of multiprocessing.Pool.map that works using dill to pickle the
-    function and iterable
+    function and iterable. Runs on the shared pool of 'workers' processes
     """
-    with multiprocessing.Pool(workers) as pool:
-        processes = []
-        for item in iterable:
-            pickled = dill.dumps((function, item))
-            process = pool.apply_async(_run_pickled, (pickled,))
-            processes.append(process)
-
-        results = [process.get() for process in processes]
-    return results
+    return get_pool(workers).map(function, iterable)
 
 
 def test():
@@ -0,0 +1,475 @@
+"""
+This module reads the common subset of makefiles (explicit rules,
+prerequisites, simple variables and phony targets) into 'Instruction' objects,
+so that legacy C components can be built by the same executor as the Cython
+targets. The programs linked out of objects compiled from one C file each
+can be built in unity mode (see 'unity.py') instead
+"""
+
+import os
+import re
+import shlex
+
+from .tools import CytherError
+from .instructions import Instruction
+from .cache import C_SOURCE_EXTENSIONS, LINK_INPUT_EXTENSIONS
+
+
+MAKEFILE_NAMES = ('GNUmakefile', 'makefile', 'Makefile')
+MAKEFILE_EXTENSION = '.mk'
+
+UNSUPPORTED = "{}:{}: '{}' is not supported by cyther's makefile reader"
+UNSUPPORTED_FUNCTION = "{}:{}: the function '{}' is not supported by " \
+                       "cyther's makefile reader"
+MISSING_SEPARATOR = "{}:{}: missing separator, expected a rule or a variable"
+RECIPE_WITHOUT_RULE = "{}:{}: recipe commences before first target"
+NO_RULE = "No rule to make target '{}', needed by '{}'"
+NO_GOAL = "No rule to make target '{}'"
+NO_TARGETS = "The makefile '{}' has no targets"
+RECURSIVE_VARIABLE = "Recursive variable '{}' references itself"
+
+UNSUPPORTED_DIRECTIVES = ('include', '-include', 'sinclude', 'ifeq', 'ifneq',
+                          'ifdef', 'ifndef', 'else', 'endif', 'define',
+                          'endef', 'export', 'unexport', 'override', 'vpath')
+
+ASSIGNMENT_PATTERN = r"^(?P<name>[^:#=\s]+)\s*" \
+                     r"(?P<operator>:{1,2}=|\?=|\+=|=)\s*(?P<value>.*)$"
+REFERENCE_PATTERN = r"\$(?:\((?P<paren>[^()]*)\)|\{(?P<brace>[^{}]*)\}|" \
+                    r"(?P<single>.))"
+
+# Anything that makes a recipe line need a shell
+SHELL_CHARACTERS = set('|&;<>()$`\\"\'*?[]#~\n')
+SHELL = ['sh', '-c'] if os.name != 'nt' else ['cmd', '/c']
+IGNORE_ERRORS = ' || true' if os.name != 'nt' else ' & exit 0'
+
+SPECIAL_PREFIX = '.'
+PHONY_TARGET = '.PHONY'
+
+MAX_EXPANSION_DEPTH = 64
+
+# The flags whose value is a path, relative to the makefile
+PATH_FLAGS = ('-I', '-L', '-isystem', '-iquote', '-include')
+
+
+def is_makefile(file_path):
+    name = os.path.basename(file_path)
+    return name in MAKEFILE_NAMES or \
+        os.path.splitext(name)[1] == MAKEFILE_EXTENSION
+
+
+def _join_lines(lines):
+    if lines[0].startswith('\t'):
+        # Recipes keep their backslash newlines for the shell, minus the tab
+        # continuation lines start with
+        return '\n'.join(line[1:] if index and line.startswith('\t') else line
+                         for index, line in enumerate(lines))
+    return ' '.join(line.rstrip('\\').strip() for line in lines)
+
+
+def _logical_lines(string):
+    """
+    Joins the lines continued with a backslash, and yields each logical line
+    with the number of the line it started on
+    """
+    pending = []
+    start = 0
+    for number, line in enumerate(string.splitlines(), 1):
+        if not pending:
+            start = number
+        pending.append(line)
+        if not line.endswith('\\'):
+            yield start, _join_lines(pending)
+            pending = []
+    if pending:
+        yield start, _join_lines(pending)
+
+
+def _strip_comment(line):
+    index = 0
+    while True:
+        index = line.find('#', index)
+        if index == -1:
+            return line
+        if index and line[index - 1] == '\\':
+            line = line[:index - 1] + line[index:]
+            continue
+        return line[:index]
+
+
+class Rule:
+    """
+    An explicit rule of a makefile; its target, prerequisites and recipe (the
+    raw lines, expanded once the whole makefile has been read)
+    """
+    def __init__(self, target, prerequisites, recipe=None):
+        self.target = target
+        self.prerequisites = list(prerequisites)
+        self.recipe = list(recipe or [])
+
+
+class Makefile:
+    """
+    Reads a makefile. 'variables' can override the ones it defines, and the
+    environment variables are used for the ones it doesn't
+    """
+    def __init__(self, file_path, *, variables=None):
+        self.file_path = os.path.abspath(file_path)
+        self.directory = os.path.dirname(self.file_path)
+        self.rules = {}
+        self.targets = []
+        self.phony = set()
+        self.default_goal = None
+        self.__variables = {}
+        self.__overrides = dict(variables or {})
+        self.read()
+
+    def read(self):
+        with open(self.file_path) as file:
+            string = file.read()
+
+        current = []
+        for number, line in _logical_lines(string):
+            if line.startswith('\t'):
+                if not current:
+                    if not line.strip() or line.lstrip().startswith('#'):
+                        continue
+                    raise CytherError(RECIPE_WITHOUT_RULE.format(
+                        self.file_path, number))
+                for rule in current:
+                    rule.recipe.append(line[1:])
+                continue
+
+            line = _strip_comment(line).strip()
+            if not line:
+                continue
+
+            directive = line.split()[0]
+            if directive in UNSUPPORTED_DIRECTIVES:
+                raise CytherError(UNSUPPORTED.format(self.file_path, number,
+                                                     directive))
+
+            match = re.match(ASSIGNMENT_PATTERN, line)
+            if match:
+                current = []
+                self._assign(match.group('name'), match.group('operator'),
+                             match.group('value'), number)
+                continue
+
+            if ':' not in line:
+                raise CytherError(MISSING_SEPARATOR.format(self.file_path,
+                                                           number))
+            current = self._addRules(line, number)
+
+    def _assign(self, name, operator, value, number):
+        if name in self.__overrides:
+            return
+        if operator in (':=', '::='):
+            self.__variables[name] = (self.expand(value, number=number), True)
+        elif operator == '?=':
+            if name not in self.__variables and name not in os.environ:
+                self.__variables[name] = (value, False)
+        elif operator == '+=' and name in self.__variables:
+            old, simple = self.__variables[name]
+            if simple:
+                value = self.expand(value, number=number)
+            self.__variables[name] = ((old + ' ' + value).strip(), simple)
+        else:
+            self.__variables[name] = (value, False)
+
+    def _addRules(self, line, number):
+        """
+        Adds the rules of a 'targets: prerequisites [; recipe]' line, and
+        returns them so that the recipe lines that follow go to them
+        """
+        line, _, inline_recipe = line.partition(';')
+        targets, _, prerequisites = line.partition(':')
+        if prerequisites.startswith(':'):
+            # Double colon rules behave the same in this subset
+            prerequisites = prerequisites[1:]
+        if '%' in targets:
+            raise CytherError(UNSUPPORTED.format(self.file_path, number,
+                                                 'pattern rules'))
+        if '=' in prerequisites:
+            raise CytherError(UNSUPPORTED.format(
+                self.file_path, number, 'target-specific variables'))
+        targets = self.expand(targets, number=number).split()
+        prerequisites = self.expand(prerequisites, number=number).split()
+
+        rules = []
+        for target in targets:
+            if target == PHONY_TARGET:
+                self.phony.update(prerequisites)
+                continue
+            elif target.startswith(SPECIAL_PREFIX):
+                continue
+
+            rule = self.rules.get(target)
+            if rule is None:
+                rule = Rule(target, [])
+                self.rules[target] = rule
+                self.targets.append(target)
+                if self.default_goal is None:
+                    self.default_goal = target
+            for prerequisite in prerequisites:
+                if prerequisite not in rule.prerequisites:
+                    rule.prerequisites.append(prerequisite)
+            if inline_recipe.strip():
+                rule.recipe.append(inline_recipe.strip())
+            rules.append(rule)
+        return rules
+
+    def getVariable(self, name, *, number=None, depth=0):
+        if name in self.__overrides:
+            return str(self.__overrides[name])
+        if name in self.__variables:
+            value, simple = self.__variables[name]
+            if simple:
+                return value
+            if depth > MAX_EXPANSION_DEPTH:
+                raise CytherError(RECURSIVE_VARIABLE.format(name))
+            return self.expand(value, number=number, depth=depth + 1)
+        return os.environ.get(name, '')
+
+    def expand(self, string, automatic=None, *, number=None, depth=0):
+        """
+        Expands the variable references of a string. 'automatic' holds the
+        automatic variables ('@', '<', '^') of the rule being expanded
+        """
+        automatic = automatic or {}
+
+        def replace(match):
+            name = match.group('paren')
+            if name is None:
+                name = match.group('brace')
+            if name is None:
+                name = match.group('single')
+            if name == '$':
+                return '$'
+            if name in automatic:
+                return automatic[name]
+            if ' ' in name or ',' in name:
+                raise CytherError(UNSUPPORTED_FUNCTION.format(
+                    self.file_path, number, name.split()[0]))
+            return self.getVariable(name, number=number, depth=depth)
+
+        return re.sub(REFERENCE_PATTERN, replace, string)
+
+    def getPath(self, name):
+        return os.path.normpath(os.path.join(self.directory, name))
+
+    def getCommands(self, rule):
+        """
+        Returns the recipe of a rule as commands. Simple lines run directly,
+        the others go through the shell, like make does. The commands are
+        run from the directory of the makefile
+        """
+        prerequisites = []
+        for prerequisite in rule.prerequisites:
+            if prerequisite not in prerequisites:
+                prerequisites.append(prerequisite)
+        automatic = {'@': rule.target,
+                     '<': prerequisites[0] if prerequisites else '',
+                     '^': ' '.join(prerequisites),
+                     '?': ' '.join(prerequisites),
+                     '+': ' '.join(rule.prerequisites)}
+
+        commands = []
+        for line in rule.recipe:
+            line = self.expand(line, automatic).strip()
+            ignore_errors = False
+            while line[:1] in ('@', '-', '+'):
+                ignore_errors = ignore_errors or line[0] == '-'
+                line = line[1:].lstrip()
+            if not line:
+                continue
+
+            in_place = os.path.normcase(os.getcwd()) == \
+                os.path.normcase(self.directory)
+            # 'NAME=value command' sets an environment variable
+            if in_place and not ignore_errors and \
+                    not SHELL_CHARACTERS & set(line) and \
+                    '=' not in line.split()[0]:
+                commands.append(shlex.split(line))
+                continue
+
+            if ignore_errors:
+                line += IGNORE_ERRORS
+            if not in_place:
+                line = 'cd {} && {}'.format(shlex.quote(self.directory), line)
+            commands.append(SHELL + [line])
+        return commands
+
+    def _getWords(self, rule):
+        """
+        Returns the words of the recipe of a rule, if it is a single command
+        that runs without a shell; None otherwise
+        """
+        commands = self.getCommands(rule)
+        if len(commands) != 1 or commands[0][:len(SHELL)] == SHELL:
+            return None
+        return commands[0]
+
+    def _getAbsoluteFlags(self, flags):
+        absolute = []
+        take_path = False
+        for flag in flags:
+            if take_path:
+                flag = self.getPath(flag)
+                take_path = False
+            elif flag in PATH_FLAGS:
+                take_path = True
+            else:
+                for prefix in PATH_FLAGS[:2]:
+                    if flag.startswith(prefix) and len(flag) > len(prefix):
+                        flag = prefix + self.getPath(flag[len(prefix):])
+            absolute.append(flag)
+        return absolute
+
+    def getUnityOptions(self, target):
+        """
+        Returns the C sources of 'target' and the 'UnityBuild' keyword
+        arguments building it in unity mode, if it links objects that are
+        each compiled from one C file, by the same compiler and flags. Returns
+        None, None otherwise
+        """
+        rule = self.rules[target]
+        link = self._getWords(rule)
+        objects = [prerequisite for prerequisite in rule.prerequisites
+                   if prerequisite in self.rules and
+                   os.path.splitext(prerequisite)[1] in LINK_INPUT_EXTENSIONS]
+        made = [prerequisite for prerequisite in rule.prerequisites
+                if prerequisite in self.rules]
+        if link is None or len(objects) < 2 or made != objects:
+            return None, None
+
+        sources = []
+        compile_flags = None
+        for name in objects:
+            words = self._getWords(self.rules[name])
+            if words is None or words[0] != link[0] or '-c' not in words:
+                return None, None
+            found = [word for word in words[1:]
+                     if os.path.splitext(word)[1] in C_SOURCE_EXTENSIONS]
+            if len(found) != 1:
+                return None, None
+            flags = _without_output(words[1:])
+            flags = [flag for flag in flags if flag not in ('-c', found[0])]
+            if compile_flags is None:
+                compile_flags = flags
+            elif flags != compile_flags:
+                return None, None
+            sources.append(self.getPath(found[0]))
+
+        link_flags = [flag for flag in _without_output(link[1:])
+                      if flag not in objects]
+        return sources, {'compiler': link[0],
+                         'compile_flags': self._getAbsoluteFlags(
+                             compile_flags),
+                         'link_flags': self._getAbsoluteFlags(link_flags)}
+
+    def getGoals(self, goals=None):
+        """
+        Returns every target needed to make the given 'goals' (the default
+        goal if None), in the order the makefile defines them
+        """
+        if goals is None:
+            if self.default_goal is None:
+                raise CytherError(NO_TARGETS.format(self.file_path))
+            goals = [self.default_goal]
+
+        needed = []
+        to_visit = []
+        for goal in goals:
+            if goal not in self.rules:
+                raise CytherError(NO_GOAL.format(goal))
+            to_visit.append(goal)
+        while to_visit:
+            target = to_visit.pop()
+            if target in needed:
+                continue
+            needed.append(target)
+            for prerequisite in self.rules[target].prerequisites:
+                if prerequisite in self.rules:
+                    to_visit.append(prerequisite)
+        return [target for target in self.targets if target in needed]
+
+    def getInstructions(self, goals=None, unity=None):
+        """
+        Converts the rules needed by 'goals' into 'Instruction' objects. The
+        prerequisites made by another rule are buildable dependencies, the
+        others are given dependencies and must exist.
+
+        With 'unity' (a number of chunks), the targets 'getUnityOptions'
+        accepts are built in unity mode, and their objects aren't built on
+        their own unless another target needs them
+        """
+        needed = self.getGoals(goals)
+        unity_targets = {}
+        if unity:
+            for target in needed:
+                sources, options = self.getUnityOptions(target)
+                if sources:
+                    unity_targets[target] = (sources, options)
+        # The objects the unity targets replace (their only rule-made
+        # prerequisites)
+        replaced = set()
+        for target in unity_targets:
+            replaced.update(self.rules[target].prerequisites)
+        for target in needed:
+            if target not in unity_targets:
+                replaced.difference_update(self.rules[target].prerequisites)
+
+        instructions = []
+        for target in needed:
+            if target in replaced:
+                continue
+            rule = self.rules[target]
+            if target in unity_targets:
+                sources, options = unity_targets[target]
+                instruction = Instruction()
+                instruction.output = self.getPath(target)
+                instruction.input = sources[0]
+                instruction.setBuildableDependencies(sources[1:])
+                instruction.setUnity(unity, **options)
+                instructions.append(instruction)
+                continue
+            instruction = Instruction()
+            instruction.output = self.getPath(target)
+            instruction.phony = target in self.phony
+            instruction.setCommands(self.getCommands(rule))
+
+            buildables = []
+            givens = []
+            for prerequisite in rule.prerequisites:
+                file_path = self.getPath(prerequisite)
+                if prerequisite in self.rules:
+                    buildables.append(file_path)
+                elif os.path.exists(file_path):
+                    givens.append(file_path)
+                else:
+                    raise CytherError(NO_RULE.format(prerequisite, target))
+            instruction.input = givens[0] if givens else None
+            instruction.setBuildableDependencies(buildables)
+            instruction.setGivenDependencies(givens)
+            instructions.append(instruction)
+        return instructions
+
+
+def _without_output(words):
+    """
+    Removes '-o' and the file given to it from the words of a command
+    """
+    if '-o' not in words:
+        return list(words)
+    index = words.index('-o')
+    return words[:index] + words[index + 2:]
+
+
+def read_makefile(file_path, goals=None, unity=None, **kwargs):
+    """
+    Returns the 'Instruction' objects needed to make the 'goals' of a
+    makefile (its default goal if None), with the programs built in 'unity'
+    chunks where possible (see 'Makefile.getInstructions'). Takes the same
+    keyword arguments as 'Makefile'
+    """
+    return Makefile(file_path, **kwargs).getInstructions(goals, unity)
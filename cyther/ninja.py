@@ -0,0 +1,164 @@
+"""
+This module writes a 'Commands' plan out as a 'build.ninja' file, so that the
+build itself can be left to ninja while Cyther keeps discovering the toolchain
+and resolving the dependencies
+"""
+
+import os
+import shlex
+import subprocess
+
+from .tools import CytherError
+from .launcher import call
+from .searcher import where
+from .depfiles import get_depfile
+
+
+NINJA_FILENAME = 'build.ninja'
+NINJA_EXECUTABLE = 'ninja'
+
+NINJA_NOT_FOUND = "Could not find 'ninja' in the path, the build file '{}' " \
+                  "was written but not run"
+
+# Every rule runs the command of its build statement. 'restat' lets ninja
+# skip the dependents of an output that a command left untouched
+RULE_TEMPLATE = """rule {name}
+  command = $cmd
+  description = {description} $out
+  restat = 1
+"""
+DEPFILE_RULE_TEMPLATE = RULE_TEMPLATE + """  depfile = $depfile
+  deps = gcc
+"""
+
+DEFAULT_RULE = 'run'
+# A phony target that never exists, so that the phony targets with commands
+# depending on it always run
+ALWAYS = 'cyther_always'
+DESCRIPTIONS = {'cython': 'CYTHON', 'compile': 'CC', 'link': 'LINK'}
+
+
+def escape_path(file_path):
+    """
+    Escapes a path for a build line of a ninja file
+    """
+    return file_path.replace('$', '$$').replace(' ', '$ ').replace(':', '$:')
+
+
+def escape_value(string):
+    """
+    Escapes the value of a ninja variable
+    """
+    return string.replace('$', '$$').replace('\n', ' ')
+
+
+def quote_command(command):
+    """
+    Turns a list of arguments into a command line for the shell ninja uses
+    """
+    if os.name == 'nt':
+        return subprocess.list2cmdline(command)
+    return ' '.join(shlex.quote(arg) for arg in command)
+
+
+def _rule_name(stage, depfile):
+    name = stage or DEFAULT_RULE
+    return name + '_deps' if depfile else name
+
+
+def make_ninja_string(plan):
+    """
+    Returns the contents of the ninja file building a 'Commands' plan
+    """
+    tasks = plan.getTasks()
+    givens = plan.getGivens()
+    actions = plan.getActions()
+    stages = plan.getStages()
+    phony = plan.getPhony()
+
+    rules = {}
+    builds = []
+    always = False
+    for target in sorted(tasks):
+        inputs = ' '.join(escape_path(name) for name in tasks[target])
+        commands = actions.get(target)
+        if commands and target in phony:
+            inputs = (inputs + ' ' + ALWAYS).lstrip()
+            always = True
+        if not commands:
+            builds.append('build {}: phony {}'.format(escape_path(target),
+                                                      inputs).rstrip())
+            continue
+
+        depfiles = [get_depfile(command) for command in commands]
+        depfiles = [depfile for depfile in depfiles if depfile]
+        stage = stages.get(target)
+        rule = _rule_name(stage, depfiles)
+        template = DEPFILE_RULE_TEMPLATE if depfiles else RULE_TEMPLATE
+        description = DESCRIPTIONS.get(stage, (stage or DEFAULT_RULE).upper())
+        rules[rule] = template.format(name=rule, description=description)
+
+        line = 'build {}: {} {}'.format(escape_path(target), rule, inputs)
+        builds.append(line.rstrip())
+        string = ' && '.join(quote_command(command) for command in commands)
+        if os.name == 'nt' and len(commands) > 1:
+            # ninja doesn't go through a shell on windows
+            string = 'cmd /c ' + string
+        builds.append('  cmd = ' + escape_value(string))
+        if depfiles:
+            # ninja reads a single depfile per build statement
+            builds.append('  depfile = ' + escape_value(depfiles[0]))
+
+    dependents = {dependency for dependencies in tasks.values()
+                  for dependency in dependencies if dependency not in givens}
+    finals = [escape_path(task) for task in sorted(tasks)
+              if task not in dependents]
+
+    lines = ['# Generated by cyther, do not edit',
+             'ninja_required_version = 1.3', '']
+    for rule in sorted(rules):
+        lines.append(rules[rule])
+    lines.extend(builds)
+    if always:
+        lines.append('build {}: phony'.format(ALWAYS))
+    lines.append('')
+    if finals:
+        lines.append('default ' + ' '.join(finals))
+    return '\n'.join(lines) + '\n'
+
+
+def write_ninja(plan, filename=None):
+    """
+    Writes the ninja file of a plan, leaving it alone if nothing changed so
+    that ninja doesn't have to reload it. Returns the path written to
+    """
+    if not filename:
+        filename = NINJA_FILENAME
+    string = make_ninja_string(plan)
+    try:
+        with open(filename) as file:
+            if file.read() == string:
+                return filename
+    except OSError:
+        pass
+
+    with open(filename, 'w') as file:
+        file.write(string)
+    return filename
+
+
+def run_ninja(filename=None, *, jobs=None, targets=(), print_result=True):
+    """
+    Runs ninja on a ninja file, and returns the 'Result'
+    """
+    if not filename:
+        filename = NINJA_FILENAME
+    try:
+        executable = where(NINJA_EXECUTABLE)
+    except ValueError:
+        raise CytherError(NINJA_NOT_FOUND.format(filename))
+
+    command = [executable, '-f', filename]
+    if jobs:
+        command += ['-j', str(jobs)]
+    return call(command + list(targets), print_result=print_result)
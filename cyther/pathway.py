@@ -413,12 +413,16 @@ class File:
         new_path = path(self.getPath(), **kwargs)
         return File(new_path)
 
-    def isOutDated(self, output_file):
+    def isOutDated(self, output_file, *, database=None, commands=()):
         """
-        Figures out if Cyther should compile the given FileInfo object by
-        checking the both of the modified times
+        Figures out if Cyther should compile the given FileInfo object. If a
+        'BuildDatabase' is given, the contents of both files and the commands
+        are compared by hash; otherwise both of the modified times are checked
         """
-        if output_file.exists():
+        if database:
+            return database.isOutDated(output_file.getPath(),
+                                       [self.getPath()], commands)
+        elif output_file.exists():
             source_time = self.getmtime()
             output_time = output_file.getmtime()
             return source_time > output_time
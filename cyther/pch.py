@@ -0,0 +1,197 @@
+"""
+This module precompiles 'Python.h' (and the numpy headers, for modules that
+cimport numpy) so that gcc doesn't parse it again for every extension. The
+precompiled headers live in the user's artifact cache, one for every
+combination of interpreter, compiler and flags
+"""
+
+import os
+import sys
+import tempfile
+import threading
+
+from .pathway import path, USER, ISDIR
+from .launcher import call
+from .definitions import USER_CACHE_NAME
+from .direct import getIncludeAndRuntime
+from .database import hash_file
+from .scanner import scan_file
+from .cache import make_key, parse_compile_command, get_include_dirs
+from .depfiles import strip_depfile_flags
+
+
+PCH_DIRECTORY = 'pch'
+PYTHON_HEADER = 'Python.h'
+PYTHON_CONFIG_HEADER = 'pyconfig.h'
+NUMPY_HEADER = os.path.join('numpy', 'arrayobject.h')
+PCH_EXTENSION = '.gch'
+
+# Cython defines this (as nothing) before it includes 'Python.h'. gcc only
+# uses a precompiled header if such macros are defined the same way
+PCH_DEFINES = ['-DPY_SSIZE_T_CLEAN=']
+
+
+def find_header(name, include_dirs):
+    """
+    Returns the path of the header 'name' in the first of 'include_dirs'
+    that has it, or None
+    """
+    for directory in include_dirs:
+        file_path = os.path.join(directory, name)
+        if os.path.isfile(file_path):
+            return file_path
+    return None
+
+
+def cimports_numpy(source):
+    modules, _ = scan_file(source)
+    return any(module == 'numpy' or module.startswith('numpy.')
+               for module in modules)
+
+
+class PrecompiledHeader:
+    """
+    Builds (once) and applies the precompiled 'Python.h' matching a compile
+    command. gcc looks for 'Python.h.gch' in every include directory before
+    'Python.h' itself, so the directory holding it is simply put first on the
+    include path. If the precompiled header can't be used, gcc ignores it and
+    carries on with the real 'Python.h'.
+
+    The key of a precompiled header covers the interpreter, the version
+    output of the compiler, the flags and the contents of the headers, so a
+    new one is built whenever any of them changes
+    """
+    def __init__(self, directory=None, *, include_dirs=None):
+        if not directory:
+            directory = os.path.join(path(USER_CACHE_NAME, ISDIR, root=USER),
+                                     PCH_DIRECTORY)
+        if include_dirs is None:
+            include_dirs, _ = getIncludeAndRuntime()
+        self.directory = directory
+        self.include_dirs = list(include_dirs)
+        self.built = []
+        self.__directories = {}
+        self.__identities = {}
+        self.__lock = threading.Lock()
+
+    def getIdentity(self, compiler):
+        if compiler not in self.__identities:
+            self.__identities[compiler] = call([compiler, '-v']).getOutput()
+        return self.__identities[compiler]
+
+    def getHeaders(self, numpy_dirs=()):
+        """
+        Returns the headers to precompile; 'Python.h', and the numpy ones if
+        'numpy_dirs' has them. Returns an empty list if 'Python.h' is missing
+        """
+        python_header = find_header(PYTHON_HEADER, self.include_dirs)
+        if not python_header:
+            return []
+        headers = [PYTHON_HEADER]
+        if find_header(NUMPY_HEADER, numpy_dirs):
+            headers.append(NUMPY_HEADER)
+        return headers
+
+    def getBuildFlags(self, flags, headers, include_dirs):
+        """
+        Returns the flags to precompile with; the flags of the compile
+        command that affect code generation, and the include directories of
+        the headers
+        """
+        flags = strip_depfile_flags(flags)
+        dirs = list(self.include_dirs)
+        if NUMPY_HEADER in headers:
+            dirs.append(os.path.dirname(os.path.dirname(
+                find_header(NUMPY_HEADER, include_dirs))))
+        kept = []
+        skip = False
+        for flag in flags:
+            if skip:
+                skip = False
+            elif flag in ('-I', '-c'):
+                skip = flag == '-I'
+            elif not flag.startswith('-I'):
+                kept.append(flag)
+        return kept + PCH_DEFINES + ['-I' + directory for directory in dirs]
+
+    def getKey(self, compiler, build_flags, headers, include_dirs):
+        digests = []
+        for header in headers + [PYTHON_CONFIG_HEADER]:
+            file_path = find_header(header, self.include_dirs + include_dirs)
+            digests.append(file_path and hash_file(file_path))
+        return make_key('pch', sys.executable, sys.version,
+                        self.getIdentity(compiler), build_flags, headers,
+                        digests)
+
+    def build(self, compiler, build_flags, headers, key):
+        """
+        Precompiles the headers under 'key'. Returns the directory holding
+        the precompiled header, or None if it couldn't be built
+        """
+        directory = os.path.join(self.directory, key[:2], key[2:])
+        target = os.path.join(directory, PYTHON_HEADER + PCH_EXTENSION)
+        if os.path.isfile(target):
+            return directory
+        os.makedirs(directory, exist_ok=True)
+
+        handle, source = tempfile.mkstemp(suffix='.h', dir=directory)
+        with os.fdopen(handle, 'w') as file:
+            for header in headers:
+                file.write('#include <{}>\n'.format(header))
+        handle, temporary = tempfile.mkstemp(dir=directory)
+        os.close(handle)
+        try:
+            command = [compiler] + build_flags + ['-x', 'c-header', source,
+                                                  '-o', temporary]
+            if call(command).returncode:
+                return None
+            os.replace(temporary, target)
+        finally:
+            for file_path in (source, temporary):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+
+        self.built.append(target)
+        return directory
+
+    def getDirectory(self, command, source=None):
+        """
+        Returns the directory of the precompiled header matching a compile
+        command, building it if needed, or None if there can't be one.
+        'source' is the Cython source the C file is generated from, checked
+        for a numpy cimport
+        """
+        parsed = parse_compile_command(command)
+        if not parsed:
+            return None
+        flags = parsed[0]
+        include_dirs = get_include_dirs(flags)
+
+        numpy_dirs = include_dirs if source and cimports_numpy(source) else ()
+        headers = self.getHeaders(numpy_dirs)
+        if not headers:
+            return None
+
+        compiler = command[0]
+        build_flags = self.getBuildFlags(flags, headers, include_dirs)
+        key = self.getKey(compiler, build_flags, headers, include_dirs)
+        with self.__lock:
+            if key not in self.__directories:
+                self.__directories[key] = self.build(compiler, build_flags,
+                                                     headers, key)
+            return self.__directories[key]
+
+    def apply(self, command, source=None):
+        """
+        Returns the compile command, using the matching precompiled header
+        """
+        directory = self.getDirectory(command, source)
+        if not directory:
+            return command
+
+        for index, flag in enumerate(command):
+            if flag.startswith('-I'):
+                break
+        else:
+            index = 1
+        return command[:index] + ['-I' + directory] + command[index:]
@@ -13,7 +13,7 @@ from .definitions import CACHE_NAME
 def assure_cache(project_path=None):
     """
     Assure that a project directory has a cache folder.
-    If not, it will create it.
+    If not, it will create it. Returns the path to the cache folder
     """
 
     project_path = path(project_path, ISDIR)
@@ -22,6 +22,8 @@ def assure_cache(project_path=None):
     if not os.path.isdir(cache_path):
         os.mkdir(cache_path)
 
+    return cache_path
+
 
 def clean_project():
     """
@@ -0,0 +1,327 @@
+"""
+This module shares artifacts between machines through a remote cache; any
+HTTP server that answers 'GET /<key>' with a blob and stores the body of
+'PUT /<key>'. A minimal server ('cyther cache-server') is bundled as the
+reference implementation. Uploads carry a token, as whoever can store blobs
+decides what the clients link into their modules
+"""
+
+import os
+import re
+import hmac
+import queue
+import secrets
+import tempfile
+import threading
+import socketserver
+import http.client
+import urllib.error
+import urllib.request
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from .cache import ArtifactCache, DEFAULT_MAX_SIZE
+
+
+READ_ONLY = 'read-only'
+READ_WRITE = 'read-write'
+MODES = (READ_ONLY, READ_WRITE)
+
+# A slow or unreachable cache must never be slower than building locally
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_UPLOADS = 4
+DEFAULT_QUEUE_SIZE = 64
+
+# After that many errors in a row, the remote cache is left alone
+MAX_ERRORS = 3
+
+DEFAULT_SERVER_ADDRESS = 'localhost:7846'
+REMOTE_DIRECTORY = 'remote'
+
+# Where the token of the uploads comes from when it isn't given, and the
+# header it is sent in
+TOKEN_ENVIRONMENT = 'CYTHER_CACHE_TOKEN'
+TOKEN_HEADER = 'X-Cyther-Token'
+
+KEY_PATTERN = r"^[0-9a-f]{40}(\.[a-z]+)?$"
+
+STAT_NAMES = ('hits', 'misses', 'errors', 'uploads', 'dropped')
+
+UNKNOWN_MODE = "The remote cache mode must be one of {}, not '{}'"
+INVALID_KEY = "Invalid cache key"
+INVALID_TOKEN = "Invalid or missing cache token"
+
+
+def get_token(token=None):
+    """
+    Returns the given cache token, or the one of the environment
+    """
+    if token is None:
+        token = os.environ.get(TOKEN_ENVIRONMENT) or None
+    return token
+
+
+class RemoteCache:
+    """
+    A client for a remote cache at 'url'. Downloads are synchronous; uploads
+    go through a bounded queue drained by 'uploads' threads, and are dropped
+    when the queue is full rather than slowing the build down. Every request
+    gives up after 'timeout' seconds, and the cache is disabled for the rest
+    of the session after 'MAX_ERRORS' errors in a row. Uploads carry the
+    'token' of the server (see 'get_token')
+    """
+    def __init__(self, url, *, mode=READ_WRITE, timeout=DEFAULT_TIMEOUT,
+                 uploads=DEFAULT_UPLOADS, queue_size=DEFAULT_QUEUE_SIZE,
+                 token=None):
+        if mode not in MODES:
+            raise ValueError(UNKNOWN_MODE.format(MODES, mode))
+        self.url = url.rstrip('/')
+        self.mode = mode
+        self.timeout = timeout
+        self.token = get_token(token)
+        self.stats = dict.fromkeys(STAT_NAMES, 0)
+        self.__errors = 0
+        self.__lock = threading.Lock()
+        self.__queue = queue.Queue(queue_size)
+        self.__threads = []
+        if mode == READ_WRITE:
+            for _ in range(uploads):
+                thread = threading.Thread(target=self._upload, daemon=True)
+                thread.start()
+                self.__threads.append(thread)
+
+    def count(self, stat):
+        with self.__lock:
+            self.stats[stat] += 1
+
+    def isEnabled(self):
+        with self.__lock:
+            return self.__errors < MAX_ERRORS
+
+    def _succeeded(self):
+        with self.__lock:
+            self.__errors = 0
+
+    def _failed(self):
+        with self.__lock:
+            self.__errors += 1
+            self.stats['errors'] += 1
+
+    def getURL(self, key):
+        return '{}/{}'.format(self.url, key)
+
+    def get(self, key):
+        """
+        Returns the blob stored under 'key', or None if it's missing or the
+        cache couldn't be reached in time
+        """
+        if not self.isEnabled():
+            return None
+        try:
+            with urllib.request.urlopen(self.getURL(key),
+                                        timeout=self.timeout) as response:
+                data = response.read()
+        except urllib.error.HTTPError as error:
+            if error.code == 404:
+                self._succeeded()
+                self.count('misses')
+            else:
+                self._failed()
+            return None
+        except (OSError, ValueError, http.client.HTTPException):
+            self._failed()
+            return None
+
+        self._succeeded()
+        self.count('hits')
+        return data
+
+    def fetch(self, key, destination):
+        """
+        Downloads the blob stored under 'key' to 'destination'. Returns
+        whether it was found
+        """
+        data = self.get(key)
+        if data is None:
+            return False
+        temporary = destination + '.part'
+        with open(temporary, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, destination)
+        return True
+
+    def put(self, key, source):
+        """
+        Queues an upload of the file 'source' under 'key'. Does nothing in
+        read-only mode, and drops the upload if the queue is full
+        """
+        if self.mode != READ_WRITE or not self.isEnabled():
+            return False
+        try:
+            with open(source, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return False
+        try:
+            self.__queue.put_nowait((key, data))
+        except queue.Full:
+            self.count('dropped')
+            return False
+        return True
+
+    def _upload(self):
+        while True:
+            key, data = self.__queue.get()
+            try:
+                if self.isEnabled():
+                    self.upload(key, data)
+            finally:
+                self.__queue.task_done()
+
+    def upload(self, key, data):
+        request = urllib.request.Request(self.getURL(key), data=data,
+                                         method='PUT')
+        request.add_header('Content-Type', 'application/octet-stream')
+        if self.token:
+            request.add_header(TOKEN_HEADER, self.token)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+        except (OSError, ValueError, http.client.HTTPException):
+            self._failed()
+            return False
+        self._succeeded()
+        self.count('uploads')
+        return True
+
+    def flush(self):
+        """
+        Waits for the queued uploads to be done
+        """
+        if self.__threads:
+            self.__queue.join()
+
+    def formatStats(self):
+        stats = self.stats
+        return "{} hits, {} misses, {} uploads, {} dropped, {} errors " \
+               "({})".format(stats['hits'], stats['misses'], stats['uploads'],
+                             stats['dropped'], stats['errors'], self.mode)
+
+
+class _CacheRequestHandler(BaseHTTPRequestHandler):
+    def _getBlobPath(self):
+        key = self.path.strip('/')
+        if not re.match(KEY_PATTERN, key):
+            self.send_error(400, INVALID_KEY)
+            return None, None
+        return key, self.server.cache.getBlobPath(key)
+
+    def do_GET(self):
+        key, blob_path = self._getBlobPath()
+        if not key:
+            return
+        try:
+            with open(blob_path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        token = self.headers.get(TOKEN_HEADER, '')
+        if not hmac.compare_digest(token.encode('utf-8'),
+                                   self.server.token.encode('utf-8')):
+            self.send_error(403, INVALID_TOKEN)
+            return
+        key, _ = self._getBlobPath()
+        if not key:
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        handle, temporary = tempfile.mkstemp()
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                remaining = length
+                while remaining:
+                    chunk = self.rfile.read(min(remaining, 1 << 16))
+                    if not chunk:
+                        break
+                    file.write(chunk)
+                    remaining -= len(chunk)
+            if remaining:
+                self.send_error(400)
+                return
+            if self.server.cache.store(key, temporary):
+                self.server.addSize(length)
+        finally:
+            os.remove(temporary)
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(_CacheRequestHandler, self).log_message(format, *args)
+
+
+class CacheServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    The bundled remote cache server, storing blobs in an 'ArtifactCache'
+    (with its size cap and eviction) at 'directory'. The cache is evicted as
+    soon as the uploads push it past 'max_size' bytes. It listens on
+    localhost by default, and is only meant to be exposed to trusted clients.
+
+    Anyone can download, but uploads must carry 'token'. Without one (given,
+    or from 'TOKEN_ENVIRONMENT'), a random token is made up; clients have to
+    be given 'self.token'
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, directory, address=DEFAULT_SERVER_ADDRESS, *,
+                 verbose=False, token=None, max_size=DEFAULT_MAX_SIZE):
+        host, _, port = address.rpartition(':')
+        HTTPServer.__init__(self, (host, int(port)), _CacheRequestHandler)
+        token = get_token(token)
+        if token is None:
+            token = secrets.token_hex(16)
+        self.token = token
+        self.cache = ArtifactCache(directory, max_size=max_size)
+        self.verbose = verbose
+        self.__thread = None
+        # The size of the cache, counted from the uploads between evictions
+        self.__size = self.cache.getSize()
+        self.__size_lock = threading.Lock()
+
+    def getURL(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def addSize(self, size):
+        """
+        Counts 'size' more bytes in the cache, and evicts it once it goes
+        over its cap
+        """
+        with self.__size_lock:
+            self.__size += size
+            if self.__size <= self.cache.max_size:
+                return
+            self.cache.evict()
+            self.__size = self.cache.getSize()
+
+    def start(self):
+        """
+        Serves from a background thread, and returns the server
+        """
+        self.__thread = threading.Thread(target=self.serve_forever,
+                                         daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.cache.evict()
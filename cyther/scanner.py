@@ -0,0 +1,291 @@
+"""
+This module scans Cython sources for the files they depend on at compile time
+('cimport', 'from ... cimport' and 'include' statements), and resolves them
+against the include path
+"""
+
+import os
+import re
+import json
+import threading
+
+from .extractor import get_content
+from .database import hash_file
+
+
+CIMPORT_PATTERN = r"(?m)^[ \t]*cimport[ \t]+(?P<content>[\w\. \t,]+)"
+FROM_CIMPORT_PATTERN = r"(?m)^[ \t]*from[ \t]+(?P<content>\.*[\w\.]*)" \
+                       r"[ \t]+cimport[ \t]+(?P<names>[\w\. \t,()]+)"
+INCLUDE_PATTERN = r"(?m)^[ \t]*include[ \t]+['\"](?P<content>[^'\"]+)['\"]"
+
+DECLARATION_EXTENSION = '.pxd'
+IMPLEMENTATION_EXTENSIONS = ('.pyx', '.py')
+PACKAGE_INITS = ('__init__.py', '__init__.pyx', '__init__.pxd')
+
+SCANS_FILE_NAME = 'scans.json'
+
+
+def _split_names(string):
+    """
+    Splits 'a.b as c, d' into ['a.b', 'd']
+    """
+    names = []
+    for part in string.replace('(', '').replace(')', '').split(','):
+        words = part.split()
+        if words:
+            names.append(words[0])
+    return names
+
+
+def parse_string(string):
+    """
+    Returns the modules cimported and the files included by the given Cython
+    source code. 'from a cimport b' yields both 'a' and 'a.b', as 'b' may be
+    a submodule
+    """
+    modules = []
+    for content in get_content(CIMPORT_PATTERN, string):
+        modules.extend(_split_names(content))
+
+    for match in re.finditer(FROM_CIMPORT_PATTERN, string):
+        package = match.group('content')
+        modules.append(package)
+        separator = '' if package.endswith('.') else '.'
+        for name in _split_names(match.group('names')):
+            modules.append(package + separator + name)
+
+    includes = get_content(INCLUDE_PATTERN, string)
+    return modules, includes
+
+
+def scan_file(file_path):
+    """
+    Returns the modules cimported and the files included by a file
+    """
+    try:
+        with open(file_path, encoding='utf-8', errors='replace') as file:
+            string = file.read()
+    except OSError:
+        return [], []
+    return parse_string(string)
+
+
+def resolve_module(name, directory, include_dirs=()):
+    """
+    Finds the '.pxd' file declaring the module 'name', cimported from a file
+    in 'directory'. Relative names ('.a', '..a') are resolved from
+    'directory'. Returns None if it can't be found (like 'libc.math', which
+    ships with Cython itself)
+    """
+    if name.startswith('.'):
+        stripped = name.lstrip('.')
+        base = directory
+        for _ in range(len(name) - len(stripped) - 1):
+            base = os.path.dirname(base)
+        search_dirs = [base]
+        name = stripped
+    else:
+        search_dirs = [directory] + list(include_dirs)
+
+    if not name:
+        return None
+
+    parts = name.split('.')
+    for search_dir in search_dirs:
+        candidate = os.path.join(search_dir, *parts)
+        for file_path in (candidate + DECLARATION_EXTENSION,
+                          os.path.join(candidate, '__init__.pxd')):
+            if os.path.isfile(file_path):
+                return os.path.normpath(file_path)
+    return None
+
+
+def resolve_include(name, directory, include_dirs=()):
+    """
+    Finds a file named in an 'include' statement
+    """
+    for search_dir in [directory] + list(include_dirs):
+        file_path = os.path.join(search_dir, name)
+        if os.path.isfile(file_path):
+            return os.path.normpath(file_path)
+    return None
+
+
+def get_direct_dependencies(file_path, include_dirs=()):
+    """
+    Returns the '.pxd' and '.pxi' files a single file depends on, including
+    the '.pxd' of the same name that Cython reads implicitly
+    """
+    return DependencyScanner(include_dirs).getDirectDependencies(file_path)
+
+
+def find_dependencies(source, include_dirs=()):
+    """
+    Returns every '.pxd' and '.pxi' file that 'source' depends on, directly or
+    transitively, sorted
+    """
+    return DependencyScanner(include_dirs).getDependencies(source)
+
+
+def get_module_name(source):
+    """
+    Returns the fully qualified module name of a source file, walking up the
+    directories that are packages
+    """
+    directory, file_name = os.path.split(os.path.abspath(source))
+    parts = [os.path.splitext(file_name)[0]]
+    while any(os.path.isfile(os.path.join(directory, init))
+              for init in PACKAGE_INITS):
+        directory, package = os.path.split(directory)
+        parts.append(package)
+    return '.'.join(reversed(parts))
+
+
+class DependencyScanner:
+    """
+    Scans sources like 'find_dependencies' does, but remembers what it found.
+    The raw scan of a file is cached by the hash of its contents (itself
+    cached on the file's mtime and size), and resolutions are memoized, so
+    thousands of files can be rescanned in no time. If 'cache_path' is given,
+    the scans are kept there between runs
+    """
+    def __init__(self, include_dirs=(), *, cache_path=None):
+        self.include_dirs = list(include_dirs)
+        self.__cache_path = cache_path
+        self.__lock = threading.Lock()
+        self.__files = {}
+        self.__scans = {}
+        self.__resolved = {}
+        if cache_path:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.__cache_path) as file:
+                data = json.load(file)
+            self.__files = data['files']
+            self.__scans = data['scans']
+        except (OSError, ValueError, KeyError):
+            self.__files = {}
+            self.__scans = {}
+
+    def save(self):
+        """
+        Saves the scans of the files seen, dropping the ones no file has
+        anymore
+        """
+        if not self.__cache_path:
+            return
+        with self.__lock:
+            used = {entry[2] for entry in self.__files.values()}
+            scans = {digest: scan for digest, scan in self.__scans.items()
+                     if digest in used}
+            data = {'files': self.__files, 'scans': scans}
+            with open(self.__cache_path, 'w') as file:
+                json.dump(data, file, sort_keys=True)
+
+    def scan(self, file_path):
+        """
+        Returns the modules cimported and the files included by a file,
+        reading it only if its contents are unknown
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return [], []
+
+        key = [stat.st_mtime_ns, stat.st_size]
+        with self.__lock:
+            entry = self.__files.get(file_path)
+        if entry and entry[:2] == key:
+            digest = entry[2]
+        else:
+            digest = hash_file(file_path)
+            with self.__lock:
+                self.__files[file_path] = key + [digest]
+
+        with self.__lock:
+            scan = self.__scans.get(digest)
+        if scan is None:
+            scan = scan_file(file_path)
+            with self.__lock:
+                self.__scans[digest] = scan
+        return scan
+
+    def _resolve(self, kind, name, directory):
+        memo_key = (kind, name, directory)
+        with self.__lock:
+            if memo_key in self.__resolved:
+                return self.__resolved[memo_key]
+
+        if kind == 'module':
+            resolved = resolve_module(name, directory, self.include_dirs)
+        else:
+            resolved = resolve_include(name, directory, self.include_dirs)
+
+        with self.__lock:
+            self.__resolved[memo_key] = resolved
+        return resolved
+
+    def getDirectDependencies(self, file_path):
+        """
+        Returns the '.pxd' and '.pxi' files a single file depends on,
+        including the '.pxd' of the same name that Cython reads implicitly
+        """
+        directory = os.path.dirname(os.path.abspath(file_path))
+        modules, includes = self.scan(file_path)
+
+        found = []
+        name, extension = os.path.splitext(file_path)
+        own_declaration = name + DECLARATION_EXTENSION
+        if extension in IMPLEMENTATION_EXTENSIONS and \
+                os.path.isfile(own_declaration):
+            found.append(os.path.normpath(os.path.abspath(own_declaration)))
+
+        for module in modules:
+            resolved = self._resolve('module', module, directory)
+            if resolved and resolved not in found:
+                found.append(resolved)
+
+        for include in includes:
+            resolved = self._resolve('include', include, directory)
+            if resolved and resolved not in found:
+                found.append(resolved)
+
+        return found
+
+    def getDependencies(self, source):
+        """
+        Returns every '.pxd' and '.pxi' file that 'source' depends on,
+        directly or transitively, sorted
+        """
+        found = set()
+        to_scan = [source]
+        while to_scan:
+            file_path = to_scan.pop()
+            for dependency in self.getDirectDependencies(file_path):
+                if dependency not in found:
+                    found.add(dependency)
+                    to_scan.append(dependency)
+        found.discard(os.path.normpath(os.path.abspath(source)))
+        return sorted(found)
+
+    def getBuildDependencies(self, source, sources):
+        """
+        Splits what 'source' depends on into the buildable dependencies (the
+        other 'sources' whose '.pxd' it cimports) and the given dependencies
+        (the '.pxd' and '.pxi' files themselves)
+        """
+        implementations = {}
+        for other in sources:
+            declaration = os.path.splitext(other)[0] + DECLARATION_EXTENSION
+            implementations[os.path.normpath(os.path.abspath(declaration))] = \
+                other
+
+        givens = self.getDependencies(source)
+        buildables = []
+        for given in givens:
+            other = implementations.get(given)
+            if other and other != source and other not in buildables:
+                buildables.append(other)
+        return buildables, givens
@@ -14,6 +14,8 @@ from time import time
 from .tools import isIterable, process_output
 from .pathway import get_system_drives, has_suffix, disintegrate
 from .launcher import distribute
+from .index import get_index
+from .walker import walk, parallel_walk, DEPTH_FIRST, BREADTH_FIRST
 
 
 def _is_exe(fpath):
@@ -46,13 +48,14 @@ def search_file(pattern, file_path):
     return matches
 
 
-def _find_init(init, start):
+def _parse_init(init):
     if not init:
         raise ValueError("Parameter 'init' must not be empty")
     elif isinstance(init, str):
         target = init
         suffix = None
     elif isIterable(init):
+        init = list(init)
         target = init.pop()
         if init:
             suffix = init
@@ -61,15 +64,88 @@ def _find_init(init, start):
     else:
         raise TypeError("Parameter 'init' cannot be type "
                         "'{}'".format(type(init)))
+    return target, suffix
 
+
+def _parse_start(start):
     if not start:
         start = get_system_drives()
     elif isinstance(start, str) and os.path.isdir(start):
         start = [start]
     else:
         raise TypeError("Parameter 'start' must be None, tuple, or list")
+    return start
+
 
-    return start, target, suffix
+class Query:
+    """
+    Something for 'find' to look for; a file called 'init', or the last item
+    of 'init' under directories ending with the others (as in ['include',
+    'Python.h']). It must be executable if 'is_exec', and hold the regex
+    'content' if given. With 'one', the search for it stops at the first
+    match
+    """
+    def __init__(self, init, *, one=False, is_exec=False, content=None):
+        self.target, self.suffix = _parse_init(init)
+        self.one = one
+        self.is_exec = is_exec
+        self.content = content
+
+    def check(self, dirpath, names):
+        """
+        Returns the path of the target if 'dirpath' (holding the file
+        'names') has one that satisfies the query, None otherwise
+        """
+        if self.target not in names:
+            return None
+        file_path = os.path.normpath(os.path.join(dirpath, self.target))
+        if self.is_exec and not os.access(file_path, os.X_OK):
+            return None
+        if self.suffix and not has_suffix(dirpath, self.suffix):
+            return None
+        if self.content and not search_file(self.content, file_path):
+            return None
+        return file_path
+
+    def process(self, results):
+        if self.one:
+            results = results[:1]
+        return process_output(results, one=self.one)
+
+
+def _is_batch(init):
+    return isIterable(init) and not isinstance(init, str) and \
+        bool(init) and all(isinstance(query, Query) for query in init)
+
+
+def _indexed(index, roots, targets):
+    for dirpath, files in index.getDirectories(roots):
+        names = index.getNames(files, targets)
+        # The index can be behind on a file that was just removed
+        yield dirpath, {name for name in names
+                        if os.path.isfile(os.path.join(dirpath, name))}
+
+
+def _search(queries, entries, results):
+    """
+    Checks every query that still needs to be against each (dirpath, names)
+    of 'entries', adding what they find to 'results' (a list per query).
+    Stops as soon as every query is satisfied
+    """
+    pending = [index for index, query in enumerate(queries)
+               if not (query.one and results[index])]
+    if not pending:
+        return results
+    for dirpath, names in entries:
+        for index in list(pending):
+            file_path = queries[index].check(dirpath, names)
+            if file_path:
+                results[index].append(file_path)
+                if queries[index].one:
+                    pending.remove(index)
+        if not pending:
+            break
+    return results
 
 
 def breadth(dirs):
@@ -77,43 +153,41 @@ def breadth(dirs):
     Crawl through directories like os.walk, but use a 'breadth first' approach
     (os.walk uses 'depth first')
     """
-    while dirs:
-        next_dirs = []
-        print("Dirs: '{}'".format(dirs))
-        for d in dirs:
-            next_dirs = []
-            try:
-                for name in os.listdir(d):
-                    p = os.path.join(d, name)
-                    if os.path.isdir(p):
-                        print(p)
-                        next_dirs.append(p)
-            except PermissionError as nallowed:
-                print(nallowed)
-        dirs = next_dirs
-        if dirs:
-            yield dirs
+    return walk(dirs, order=BREADTH_FIRST)
 
 
 def _get_starting_points(base_start):
     return base_start, [], []
 
 
-# TODO Make it possible to find multiple things at once (saves crazy time)
 # TODO It turns out that process_args might not be necesssary at all... ('one')
 def find(init, start=None, one=False, is_exec=False, content=None,
-         parallelize=True, workers=None):
+         parallelize=True, workers=None, fresh=False, use_index=True,
+         order=DEPTH_FIRST):
     """
-    Finds a given 'target' (filename string) in the file system
+    Finds a given 'target' (filename string) in the file system. 'init' can
+    also be a list of 'Query' objects, each with its own constraints (the
+    'one', 'is_exec' and 'content' given to 'find' are ignored then). They
+    are all answered by a single traversal, and a list of their results is
+    returned.
+
+    The directories are looked up in the user's file index (see 'index.py'),
+    refreshed first if it is missing or old (or with 'fresh', which lists
+    every directory again instead of trusting its modification time). The
+    refresh is shared out between 'workers' threads if 'parallelize' is
+    specified (see 'walker.parallel_walk'), else done by a single one.
+
+    Without 'use_index', the file system is walked directly; by 'workers'
+    threads if 'parallelize' is specified, else in the given 'order' (see
+    'walker.walk'), breadth first finding shallow targets sooner. 'order'
+    only applies then
     """
-    base_start, target, suffix = _find_init(init, start)
-
-    def _condition(file_path, dirpath, filenames):
-        if target in filenames or is_exec and os.access(file_path, os.X_OK):
-            if not suffix or has_suffix(dirpath, suffix):
-                if not content or search_file(content, file_path):
-                    return True
-        return False
+    batch = _is_batch(init)
+    if batch:
+        queries = list(init)
+    else:
+        queries = [Query(init, one=one, is_exec=is_exec, content=content)]
+    base_start = _parse_start(start)
 
     starting_points, watch_dirs, excludes = _get_starting_points(base_start)
     disintegrated_excludes = [disintegrate(e) for e in excludes]
@@ -125,34 +199,42 @@ def find(init, start=None, one=False, is_exec=False, content=None,
                     if disintegrate(dirpath) == e[:-1]:
                         dirnames.remove(e[-1])
 
-    def _fetch(top):
-        results = []
-        for dirpath, dirnames, filenames in os.walk(top, topdown=True):
+    def _walk(top):
+        for dirpath, dirnames, filenames in walk(top, order=order):
             # This if-statement is designed to save time
             _filter(dirnames, dirpath)
-
-            file_path = os.path.normpath(os.path.join(dirpath, target))
-            if _condition(file_path, dirpath, filenames):
-                results.append(file_path)
-        return results
-
-    st = time()
-    if parallelize:
-        unzipped_results = distribute(_fetch, starting_points, workers=workers)
+            yield dirpath, set(filenames)
+
+    def _walk_in_parallel(tops):
+        for dirpath, _, filenames in parallel_walk(
+                tops, workers=workers,
+                prune=lambda dirpath, dirnames: _filter(dirnames, dirpath)):
+            yield dirpath, set(filenames)
+
+    results = [[] for _ in queries]
+    if use_index:
+        index = get_index()
+        index.update(base_start, rescan=fresh,
+                     workers=workers if parallelize else 1)
+        targets = {query.target for query in queries}
+        _search(queries, _indexed(index, base_start, targets), results)
+    elif parallelize:
+        # Stopping the search early stops the threads
+        _search(queries, _walk_in_parallel(starting_points), results)
     else:
-        unzipped_results = [_fetch(point) for point in base_start]
-    et = time()
-    #print(et - st)
-
-    zipped_results = [i for item in unzipped_results for i in item]
-    processed_results = process_output(zipped_results, one=one)
+        for point in base_start:
+            _search(queries, _walk(point), results)
 
-    return processed_results
+    processed_results = [query.process(paths) for query, paths
+                         in zip(queries, results)]
+    if batch:
+        return processed_results
+    return processed_results[0]
 
 
 def bloop(p):
     start = time()
-    i = find(['include', 'Python.h'], parallelize=p)
+    i = find(['include', 'Python.h'], parallelize=p, use_index=False)
     end = time()
     return end - start
 
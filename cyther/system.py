@@ -15,7 +15,7 @@ from .tools import CytherError
 from .searcher import where
 from .launcher import call
 from .definitions import MISSING_INCLUDE_DIRS, MISSING_RUNTIME_DIRS
-from .direct import getIncludeAndRuntime
+from .direct import getIncludeAndRuntime, BASENAME
 
 
 MAJOR = str(sys.version_info.major)
@@ -34,6 +34,11 @@ IS_WINDOWS = OPERATING_SYSTEM.lower().startswith('windows')
 
 DEFAULT_OUTPUT_EXTENSION = '.pyd' if IS_WINDOWS else '.so'
 
+INCLUDE_DIRS, RUNTIME_DIRS = getIncludeAndRuntime()
+INCLUDE_OPTIONS = ['-I' + directory for directory in INCLUDE_DIRS]
+RUNTIME_OPTIONS = ['-L' + directory for directory in RUNTIME_DIRS]
+L_OPTION = '-l' + BASENAME
+
 
 PYTHON_EXECUTABLE = where('python')
 '''
@@ -33,13 +33,47 @@ def test_utilities():
     A function to test cyther's internal compilation and helper tools
     """
     from .aberdeen import test_generateBatches, test_path, test_dict_file, \
-        test_extract, test_find, display_configure, display_resources
+        test_extract, test_find, test_file_index, test_find_queries, \
+        test_walker, test_parallel_walk, test_async_launcher, \
+        test_output_buffer, test_worker_pool, test_executor, \
+        test_critical_path, test_stage_limits, test_memory_scheduling, \
+        test_fail_fast, test_resource_stats, test_timeouts_and_retries, \
+        test_build_database, test_artifact_cache, test_cython_cache, \
+        test_depfiles, test_unity_build, test_precompiled_header, \
+        test_ninja_file, test_makefile, test_distributed, \
+        test_remote_cache, test_dependency_scanner, display_configure, \
+        display_resources
     from .direct import display_direct
 
     test_generateBatches()
     test_path()
     test_dict_file()
     test_extract()
+    test_file_index()
+    test_find_queries()
+    test_walker()
+    test_parallel_walk()
+    test_async_launcher()
+    test_output_buffer()
+    test_worker_pool()
+    test_executor()
+    test_critical_path()
+    test_stage_limits()
+    test_memory_scheduling()
+    test_fail_fast()
+    test_resource_stats()
+    test_timeouts_and_retries()
+    test_build_database()
+    test_artifact_cache()
+    test_cython_cache()
+    test_depfiles()
+    test_unity_build()
+    test_precompiled_header()
+    test_ninja_file()
+    test_makefile()
+    test_distributed()
+    test_remote_cache()
+    test_dependency_scanner()
     #test_find()
     display_direct()
     display_configure()
@@ -0,0 +1,104 @@
+"""
+This module holds the per-project database of how long each task took to
+build the last time it ran, and how much memory it peaked at. The executor
+uses it to start the most expensive chains of tasks first, and to keep the
+tasks running at once within a memory budget
+"""
+
+import os
+import json
+
+from .project import assure_cache
+
+
+TIMINGS_FILE_NAME = 'timings.json'
+
+# The weight of a new measurement against the ones recorded before it
+SMOOTHING = 0.5
+
+
+class TimingDatabase:
+    """
+    Holds the historical durations (in seconds) and peak memory (in bytes)
+    of the tasks of a project, in a file inside of the project's
+    '__cythercache__'
+    """
+    def __init__(self, project_path=None):
+        self.__file_path = os.path.join(assure_cache(project_path),
+                                        TIMINGS_FILE_NAME)
+        self.__durations = {}
+        self.__memory = {}
+        self.load()
+
+    def load(self):
+        """
+        Loads the recorded durations and memory, starting fresh if the file
+        is missing or unreadable
+        """
+        try:
+            with open(self.__file_path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            data = {}
+
+        if 'durations' in data:
+            self.__durations = data['durations']
+            self.__memory = data.get('memory', {})
+        else:
+            # The durations used to be the only thing in the file
+            self.__durations = {task: value for task, value in data.items()
+                                if isinstance(value, (int, float))}
+            self.__memory = {}
+
+    def save(self):
+        data = {'durations': self.__durations, 'memory': self.__memory}
+        with open(self.__file_path, 'w') as file:
+            json.dump(data, file, indent=1, sort_keys=True)
+
+    def getDuration(self, task, default=None):
+        return self.__durations.get(task, default)
+
+    def getDurations(self, tasks=None):
+        """
+        Returns the recorded durations of 'tasks' (all of them by default)
+        """
+        if tasks is None:
+            return dict(self.__durations)
+        return {task: self.__durations[task] for task in tasks
+                if task in self.__durations}
+
+    def record(self, task, duration):
+        """
+        Records a new measurement for the task, smoothed against the previous
+        ones so that a single noisy build doesn't reorder everything
+        """
+        previous = self.__durations.get(task)
+        if previous is None:
+            self.__durations[task] = duration
+        else:
+            self.__durations[task] = previous + SMOOTHING * (duration -
+                                                             previous)
+
+    def recordAll(self, durations):
+        for task, duration in durations.items():
+            self.record(task, duration)
+
+    def getMemory(self, tasks=None):
+        """
+        Returns the recorded peak memory of 'tasks' (all of them by default)
+        """
+        if tasks is None:
+            return dict(self.__memory)
+        return {task: self.__memory[task] for task in tasks
+                if task in self.__memory}
+
+    def recordMemory(self, task, peak_memory):
+        """
+        Records the peak memory of a task. Unlike the durations it isn't
+        smoothed; the latest peak is what the next build should expect
+        """
+        self.__memory[task] = int(peak_memory)
+
+    def recordAllMemory(self, memory):
+        for task, peak_memory in memory.items():
+            self.recordMemory(task, peak_memory)
@@ -0,0 +1,310 @@
+"""
+This module holds the unity ('jumbo') build mode for targets made of several C
+files. The translation units of a target are concatenated into a few
+generated unity files, so that shared headers are parsed once per chunk and
+the compiler can inline across files. Files that can't share a translation
+unit are compiled on their own instead
+"""
+
+import os
+import json
+import hashlib
+
+from .launcher import Result, call
+from .extractor import get_content
+from .commands import Commands, COMPILE_STAGE, LINK_STAGE
+from .depfiles import DEPFILE_FLAGS, make_depfile_name, parse_depfile
+
+
+UNITY_SUFFIX = '_unity'
+UNITY_STATE_FILE_NAME = 'unity.json'
+
+NOT_ENOUGH_CHUNKS = "The number of unity chunks must be at least 1, not '{}'"
+FELL_BACK = "Unity build of '{}' failed, its files were compiled separately"
+
+# Names defined at file scope, which two files of a chunk can't both define
+STATIC_PATTERN = r"(?m)^static[ \t]+(?:[\w\*]+[ \t\*]+)*?(?P<content>\w+)" \
+                 r"[ \t]*[\(\[=;,]"
+DEFINE_PATTERN = r"(?m)^[ \t]*#[ \t]*define[ \t]+(?P<content>\w+.*?)[ \t]*$"
+
+# Flags that relink several objects into a single relocatable object
+RELOCATABLE_FLAGS = ['-r', '-nostdlib']
+
+
+def scan_file_scope_names(string):
+    """
+    Returns the 'static' names and the macros (name -> definition) defined
+    by the given C source code
+    """
+    statics = set(get_content(STATIC_PATTERN, string))
+    macros = {}
+    for definition in get_content(DEFINE_PATTERN, string):
+        name = definition.split('(')[0].split()[0]
+        macros[name] = definition
+    return statics, macros
+
+
+def _read_names(source):
+    try:
+        with open(source, encoding='utf-8', errors='replace') as file:
+            return scan_file_scope_names(file.read())
+    except OSError:
+        return set(), {}
+
+
+def find_clashes(sources):
+    """
+    Returns the sources that would clash with an earlier source if they
+    shared a translation unit; because they define a 'static' name another
+    file defines as well, or redefine one of its macros differently
+    """
+    statics = set()
+    macros = {}
+    clashes = []
+    for source in sources:
+        own_statics, own_macros = _read_names(source)
+        names = set(own_statics) | set(own_macros)
+        redefined = [name for name, definition in own_macros.items()
+                     if name in macros and macros[name] != definition]
+        if (names & statics) or (own_statics & set(macros)) or redefined:
+            clashes.append(source)
+            continue
+        statics.update(own_statics)
+        macros.update(own_macros)
+    return clashes
+
+
+def split_chunks(sources, chunks):
+    """
+    Splits the sources into at most 'chunks' groups of about the same size
+    (in bytes). Each group keeps the order the sources were given in
+    """
+    if chunks < 1:
+        raise ValueError(NOT_ENOUGH_CHUNKS.format(chunks))
+
+    def size(source):
+        try:
+            return os.path.getsize(source)
+        except OSError:
+            return 0
+
+    groups = [[] for _ in range(min(chunks, len(sources)))]
+    totals = [0] * len(groups)
+    for source in sorted(sources, key=size, reverse=True):
+        index = totals.index(min(totals))
+        groups[index].append(source)
+        totals[index] += size(source)
+
+    order = {source: index for index, source in enumerate(sources)}
+    groups = [sorted(group, key=order.get) for group in groups if group]
+    return sorted(groups, key=lambda group: order[group[0]])
+
+
+def make_unity_string(sources):
+    lines = ['/* Generated by cyther for a unity build, do not edit */']
+    for source in sources:
+        lines.append('#include "{}"'.format(os.path.abspath(source)))
+    return '\n'.join(lines) + '\n'
+
+
+def write_unity_file(sources, file_path):
+    """
+    Writes the unity file including 'sources', leaving it alone if it
+    already has the right contents
+    """
+    string = make_unity_string(sources)
+    try:
+        with open(file_path) as file:
+            if file.read() == string:
+                return file_path
+    except OSError:
+        pass
+
+    with open(file_path, 'w') as file:
+        file.write(string)
+    return file_path
+
+
+def _write_depfile(target, depfiles, file_path):
+    """
+    Merges the prerequisites of several depfiles into one, for 'target'
+    """
+    prerequisites = []
+    for depfile in depfiles:
+        for prerequisite in parse_depfile(depfile):
+            if prerequisite not in prerequisites:
+                prerequisites.append(prerequisite)
+    words = [prerequisite.replace(' ', '\\ ')
+             for prerequisite in prerequisites]
+    with open(file_path, 'w') as file:
+        file.write('{}: {}\n'.format(target, ' \\\n '.join(words)))
+
+
+class UnityBuild:
+    """
+    Builds 'output' out of the C 'sources' in unity mode. 'getPlan' returns
+    the 'Commands' plan, whose unity files are spread over 'chunks' compile
+    tasks to keep some parallelism.
+
+    It is also a wrapper for the 'Executor' (see 'cache.CompilerCache'); a
+    unity compile that fails is retried file by file, and the objects are
+    relinked into the object the unity compile was supposed to produce. The
+    files blamed for the failure are remembered in the build directory and
+    kept out of the unity files from then on
+    """
+    def __init__(self, sources, output, *, chunks=1, build_directory=None,
+                 compile_flags=(), link_flags=(), compiler='gcc',
+                 exclude=()):
+        if chunks < 1:
+            raise ValueError(NOT_ENOUGH_CHUNKS.format(chunks))
+        if not build_directory:
+            build_directory = os.path.join(
+                os.path.dirname(os.path.abspath(output)), '__cythercache__')
+        os.makedirs(build_directory, exist_ok=True)
+
+        self.sources = [os.path.abspath(source) for source in sources]
+        self.output = output
+        self.chunks = chunks
+        self.build_directory = build_directory
+        self.compile_flags = list(compile_flags)
+        self.link_flags = list(link_flags)
+        self.compiler = compiler
+        self.exclude = [os.path.abspath(source) for source in exclude]
+        self.fallbacks = []
+
+        self.__state_path = os.path.join(build_directory,
+                                         UNITY_STATE_FILE_NAME)
+        self.__broken = self._loadBroken()
+        self.__members = {}
+
+    def _loadBroken(self):
+        try:
+            with open(self.__state_path) as file:
+                return json.load(file)['broken']
+        except (OSError, ValueError, KeyError):
+            return []
+
+    def save(self):
+        with open(self.__state_path, 'w') as file:
+            json.dump({'broken': sorted(self.__broken)}, file, indent=1)
+
+    def getBroken(self):
+        return list(self.__broken)
+
+    def _objectName(self, source):
+        # Two sources can share a name in different directories
+        name = os.path.splitext(os.path.basename(source))[0]
+        digest = hashlib.sha1(source.encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.build_directory,
+                            '{}_{}.o'.format(name, digest))
+
+    def _compileCommand(self, source, object_file_name):
+        return [self.compiler] + self.compile_flags + ['-c'] + \
+            DEPFILE_FLAGS + [make_depfile_name(object_file_name),
+                             '-o', object_file_name, source]
+
+    def getSeparate(self):
+        """
+        Returns the sources that are compiled on their own
+        """
+        separate = [source for source in self.sources
+                    if source in self.exclude or source in self.__broken]
+        candidates = [source for source in self.sources
+                      if source not in separate]
+        separate.extend(find_clashes(candidates))
+        return [source for source in self.sources if source in separate]
+
+    def getPlan(self):
+        """
+        Writes the unity files, and returns the plan building 'output'
+        """
+        separate = self.getSeparate()
+        unified = [source for source in self.sources
+                   if source not in separate]
+        base_name = os.path.splitext(os.path.basename(self.output))[0]
+
+        plan = Commands()
+        objects = []
+        self.__members = {}
+        for index, group in enumerate(split_chunks(unified, self.chunks)):
+            if len(group) == 1:
+                separate.append(group[0])
+                continue
+            unity_name = os.path.join(
+                self.build_directory,
+                '{}{}{}.c'.format(base_name, UNITY_SUFFIX, index))
+            write_unity_file(group, unity_name)
+            object_file_name = os.path.splitext(unity_name)[0] + '.o'
+            self.__members[object_file_name] = group
+            plan.addTask(object_file_name,
+                         [self._compileCommand(unity_name, object_file_name)],
+                         givens=group + [unity_name], stage=COMPILE_STAGE)
+            objects.append(object_file_name)
+
+        for source in separate:
+            object_file_name = self._objectName(source)
+            plan.addTask(object_file_name,
+                         [self._compileCommand(source, object_file_name)],
+                         givens=[source], stage=COMPILE_STAGE)
+            objects.append(object_file_name)
+
+        link_command = [self.compiler] + ['-o', self.output] + objects + \
+            self.link_flags
+        plan.addTask(self.output, [link_command], dependencies=objects,
+                     stage=LINK_STAGE)
+        return plan
+
+    def wraps(self, command):
+        if '-o' not in command:
+            return False
+        output_index = command.index('-o') + 1
+        return output_index < len(command) and \
+            command[output_index] in self.__members
+
+    def _blame(self, group, output):
+        """
+        Guesses which files of a chunk broke it; the ones its errors mention.
+        The first file can't be broken by the others, as nothing precedes it
+        """
+        blamed = [source for source in group[1:] if source in output]
+        return blamed or group[1:]
+
+    def call(self, command):
+        """
+        Compiles a unity file, or falls back to compiling its files one by
+        one if that fails
+        """
+        result = call(command)
+        if not result.returncode:
+            return result
+
+        object_file_name = command[command.index('-o') + 1]
+        group = self.__members[object_file_name]
+        fallback = Result(stderr=FELL_BACK.format(object_file_name))
+
+        objects = []
+        for source in group:
+            member_object = self._objectName(source)
+            response = call(self._compileCommand(source, member_object))
+            fallback.extendInformation(response)
+            if response.returncode:
+                # The file is broken on its own, unity build or not
+                fallback.returncode = response.returncode
+                return fallback
+            objects.append(member_object)
+
+        response = call([self.compiler] + RELOCATABLE_FLAGS +
+                        ['-o', object_file_name] + objects)
+        fallback.extendInformation(response)
+        if response.returncode:
+            fallback.returncode = response.returncode
+            return fallback
+
+        _write_depfile(object_file_name,
+                       [make_depfile_name(name) for name in objects],
+                       make_depfile_name(object_file_name))
+        for source in self._blame(group, result.getOutput()):
+            if source not in self.__broken:
+                self.__broken.append(source)
+        self.fallbacks.append(object_file_name)
+        return fallback
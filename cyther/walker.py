@@ -0,0 +1,411 @@
+"""
+This module walks directory trees with 'os.scandir'. The type of each entry
+comes with the directory listing on most file systems, so telling the files
+from the directories doesn't cost a 'stat' per entry like 'os.path.isdir'
+does. Trees can be walked depth first or breadth first, or by a pool of
+threads that share the work out subdirectory by subdirectory (the listing of
+a directory releases the GIL). Run it as a script to compare the ways of
+walking a tree:
+
+    python -m cyther.walker [DIRECTORY ...]
+"""
+
+import os
+import time
+import queue
+import threading
+import collections
+from contextlib import contextmanager, nullcontext
+
+
+DEPTH_FIRST = 'depth'
+BREADTH_FIRST = 'breadth'
+ORDERS = (DEPTH_FIRST, BREADTH_FIRST)
+
+UNKNOWN_ORDER = "The order of a walk must be one of {}, not '{}'"
+NOT_ENOUGH_WORKERS = "The number of workers must be at least 1, not '{}'"
+
+# Listing directories mostly waits on the file system, more so over a
+# network, so there are more threads than cores
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# How many directories the threads of 'parallel_walk' get ahead of the code
+# consuming them, and how often they check whether it stopped while blocked
+RESULTS_SIZE = 1024
+STOP_POLL_INTERVAL = 0.1
+
+# The functions of 'os' counted by 'count_calls'; each makes a system call
+# when called from Python
+COUNTED_CALLS = ('stat', 'lstat', 'access', 'scandir', 'listdir')
+
+
+def walk(top, *, order=DEPTH_FIRST, follow_links=False, on_error=None):
+    """
+    Walks the trees under 'top' (a directory, or a list of them) like
+    'os.walk' does top down, yielding a (dirpath, dirnames, filenames) tuple
+    per directory; removing names from 'dirnames' keeps the walk out of them.
+
+    With 'follow_links', the symbolic links to directories are walked into as
+    well. A directory is never walked twice (they are told apart by device
+    and inode), which keeps symbolic link loops from going on forever.
+    'on_error' is called with the 'OSError' of a directory that couldn't be
+    listed
+    """
+    if order not in ORDERS:
+        raise ValueError(UNKNOWN_ORDER.format(ORDERS, order))
+    tops = [top] if isinstance(top, str) else list(top)
+    if order == DEPTH_FIRST:
+        # Popped from the end, so the first ones go last
+        tops.reverse()
+    pending = collections.deque(tops)
+    visited = set()
+
+    while pending:
+        if order == DEPTH_FIRST:
+            directory = pending.pop()
+        else:
+            directory = pending.popleft()
+
+        if follow_links and not _is_new(directory, visited, on_error):
+            continue
+        listing = _scan(directory, follow_links, on_error)
+        if listing is None:
+            continue
+        dirnames, filenames, links = listing
+
+        yield directory, dirnames, filenames
+
+        children = _get_children(directory, dirnames, links)
+        if order == DEPTH_FIRST:
+            children.reverse()
+        pending.extend(children)
+
+
+def _is_new(directory, visited, on_error, lock=None):
+    """
+    Tells whether 'directory' wasn't walked yet, adding it to 'visited'. Only
+    symbolic links can make a directory show up twice
+    """
+    try:
+        info = os.stat(directory)
+    except OSError as error:
+        if on_error is not None:
+            on_error(error)
+        return False
+    key = (info.st_dev, info.st_ino)
+    with lock or nullcontext():
+        if key in visited:
+            return False
+        visited.add(key)
+    return True
+
+
+def _scan(directory, follow_links, on_error):
+    """
+    Lists a directory; returns its dirnames, filenames, and the names of the
+    dirnames not to walk into (symbolic links, unless they are followed).
+    Returns None if it couldn't be listed
+    """
+    try:
+        with os.scandir(directory) as iterator:
+            entries = list(iterator)
+    except OSError as error:
+        if on_error is not None:
+            on_error(error)
+        return None
+
+    dirnames = []
+    filenames = []
+    links = set()
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if not is_dir:
+            filenames.append(entry.name)
+            continue
+        dirnames.append(entry.name)
+        if not follow_links:
+            try:
+                if entry.is_symlink():
+                    links.add(entry.name)
+            except OSError:
+                links.add(entry.name)
+    return dirnames, filenames, links
+
+
+def _get_children(directory, dirnames, links):
+    return [os.path.join(directory, name) for name in dirnames
+            if name not in links]
+
+
+class _WorkQueues:
+    """
+    The directories left to list, in a deque per worker. A worker takes the
+    newest directory of its own deque (depth first, so that its deque stays
+    short), and steals the oldest one of another worker's deque (the one
+    most likely to hold a large subtree) when its own is empty
+    """
+    def __init__(self, workers, tops):
+        self.__deques = [collections.deque() for _ in range(workers)]
+        for index, top in enumerate(tops):
+            self.__deques[index % workers].append(top)
+        # Directories queued, or being listed
+        self.__pending = len(tops)
+        self.__stopped = False
+        self.__condition = threading.Condition()
+        self.steals = 0
+
+    def push(self, worker, directories):
+        if not directories:
+            return
+        with self.__condition:
+            self.__deques[worker].extend(directories)
+            self.__pending += len(directories)
+            self.__condition.notify(len(directories))
+
+    def pop(self, worker):
+        """
+        Returns the next directory for 'worker' to list, waiting for one if
+        the others are still listing. Returns None once the walk is over
+        """
+        with self.__condition:
+            while not self.__stopped:
+                own = self.__deques[worker]
+                if own:
+                    return own.pop()
+                count = len(self.__deques)
+                for offset in range(1, count):
+                    victim = self.__deques[(worker + offset) % count]
+                    if victim:
+                        self.steals += 1
+                        return victim.popleft()
+                if not self.__pending:
+                    return None
+                self.__condition.wait()
+            return None
+
+    def done(self):
+        """
+        Tells that a directory popped was listed, and its children pushed
+        """
+        with self.__condition:
+            self.__pending -= 1
+            if not self.__pending:
+                self.__condition.notify_all()
+
+    def stop(self):
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify_all()
+
+    def isStopped(self):
+        return self.__stopped
+
+
+_FINISHED = object()
+
+
+def parallel_walk(top, *, workers=None, follow_links=False, prune=None,
+                  on_error=None, scan=None):
+    """
+    Walks the trees under 'top' (a directory, or a list of them) with
+    'workers' threads, yielding a (dirpath, dirnames, filenames) tuple per
+    directory as soon as a thread listed it, in no particular order. The
+    threads share out the subdirectories through work stealing (see
+    '_WorkQueues'), so a single deep tree keeps them all busy.
+
+    As the threads don't wait for the caller, 'prune' (called with the
+    dirpath and dirnames, from the threads) removes names from 'dirnames'
+    to keep the walk out of them. 'follow_links' and 'on_error' are like in
+    'walk'. Stopping the iteration stops the threads.
+
+    'scan' replaces the listing of a directory (also called from the
+    threads); it returns the (dirnames, filenames, links) of a directory
+    like '_scan' does, or None to leave it out
+    """
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    elif workers < 1:
+        raise ValueError(NOT_ENOUGH_WORKERS.format(workers))
+    tops = [top] if isinstance(top, str) else list(top)
+    work = _WorkQueues(workers, tops)
+    results = queue.Queue(RESULTS_SIZE)
+    visited = set()
+    lock = threading.Lock()
+    errors = []
+    finished = []
+
+    def put(item):
+        while not work.isStopped():
+            try:
+                results.put(item, timeout=STOP_POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def run(worker):
+        try:
+            while True:
+                directory = work.pop(worker)
+                if directory is None:
+                    break
+                try:
+                    if follow_links and not _is_new(directory, visited,
+                                                    on_error, lock):
+                        continue
+                    if scan is not None:
+                        listing = scan(directory)
+                    else:
+                        listing = _scan(directory, follow_links, on_error)
+                    if listing is None:
+                        continue
+                    dirnames, filenames, links = listing
+                    if prune is not None:
+                        prune(directory, dirnames)
+                    work.push(worker, _get_children(directory, dirnames,
+                                                    links))
+                    put((directory, dirnames, filenames))
+                finally:
+                    work.done()
+        except BaseException as error:
+            with lock:
+                errors.append(error)
+            work.stop()
+        finally:
+            with lock:
+                finished.append(worker)
+            # Only wakes the caller up; it may have stopped listening, and
+            # the queue may be full
+            try:
+                results.put_nowait(_FINISHED)
+            except queue.Full:
+                pass
+
+    threads = [threading.Thread(target=run, args=(worker,), daemon=True)
+               for worker in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            if errors:
+                raise errors[0]
+            try:
+                item = results.get(timeout=STOP_POLL_INTERVAL)
+            except queue.Empty:
+                item = _FINISHED
+            if item is not _FINISHED:
+                yield item
+            elif len(finished) == workers and results.empty():
+                if errors:
+                    raise errors[0]
+                break
+    finally:
+        work.stop()
+
+
+@contextmanager
+def count_calls(counts):
+    """
+    Counts the calls made to the functions of 'os' in 'COUNTED_CALLS' into
+    the 'counts' dictionary, for as long as the context lasts. These are the
+    Python-level calls, not a trace of the system calls; the functions are
+    replaced for the whole process (the calls of every thread are counted),
+    and what C code does on its own (the 'stat' behind 'DirEntry.is_dir',
+    say) isn't seen
+    """
+    originals = {name: getattr(os, name) for name in COUNTED_CALLS}
+    lock = threading.Lock()
+
+    def counting(name, function):
+        def wrapper(*args, **kwargs):
+            with lock:
+                counts[name] = counts.get(name, 0) + 1
+            return function(*args, **kwargs)
+        return wrapper
+
+    for name, function in originals.items():
+        setattr(os, name, counting(name, function))
+    try:
+        yield counts
+    finally:
+        for name, function in originals.items():
+            setattr(os, name, function)
+
+
+def _walk_and_check(top):
+    # How 'find' used to walk; 'os.walk', then a check per directory
+    for dirpath, _, filenames in os.walk(top):
+        file_path = os.path.join(dirpath, 'Python.h')
+        if os.path.isfile(file_path) and os.access(file_path, os.X_OK):
+            pass
+
+
+def _list_and_check(top):
+    # 'os.listdir', then 'os.path.isdir' on every entry
+    to_visit = [top]
+    while to_visit:
+        directory = to_visit.pop()
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            file_path = os.path.join(directory, name)
+            if os.path.isdir(file_path) and not os.path.islink(file_path):
+                to_visit.append(file_path)
+
+
+def _scandir_walk(order):
+    def run(top):
+        for _ in walk(top, order=order):
+            pass
+    return run
+
+
+def _parallel_walk(top):
+    for _ in parallel_walk(top):
+        pass
+
+
+BENCHMARKS = (('os.walk + isfile/access', _walk_and_check),
+              ('listdir + isdir', _list_and_check),
+              ('scandir, depth first', _scandir_walk(DEPTH_FIRST)),
+              ('scandir, breadth first', _scandir_walk(BREADTH_FIRST)),
+              ('scandir, parallel', _parallel_walk))
+
+
+def benchmark_walk(top):
+    """
+    Walks the tree under 'top' the ways 'BENCHMARKS' lists, and returns
+    (name, seconds, calls) for each of them; 'calls' maps each function of
+    'COUNTED_CALLS' to how many times it was called (see 'count_calls')
+    """
+    results = []
+    for name, function in BENCHMARKS:
+        counts = {}
+        start = time.perf_counter()
+        with count_calls(counts):
+            function(top)
+        results.append((name, time.perf_counter() - start, counts))
+    return results
+
+
+def format_benchmark(results):
+    lines = []
+    for name, seconds, counts in results:
+        calls = ', '.join('{} {}'.format(counts[call], call)
+                          for call in COUNTED_CALLS if counts.get(call))
+        lines.append("{:<24} {:>8.3f}s  {:>9} os calls ({})".format(
+            name, seconds, sum(counts.values()), calls or 'none'))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import sys
+
+    for directory in sys.argv[1:] or [os.getcwd()]:
+        print("Walking '{}':".format(directory))
+        print(format_benchmark(benchmark_walk(directory)))